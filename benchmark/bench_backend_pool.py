@@ -0,0 +1,100 @@
+"""
+複数の ComfyUI バックエンドへの振り分けの確認。
+
+スタブの ComfyUI サーバーを複数起動し、JobTable + BackendPool で
+ジョブを投入して次の 3 つを確認する。
+
+- 1 台と複数台での所要時間とジョブの振り分け
+- 応答しないバックエンドを外して振り分けること
+- 同じチェックポイントのジョブがロード済みのバックエンドに集まること
+
+    uv run python benchmark/bench_backend_pool.py [jobs] [backends] [delay]
+"""
+
+import asyncio
+import logging
+import socket
+import sys
+import time
+
+from stub_comfyui import StubComfyui
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.job_table import JOB_DONE, JobTable
+from fm_mcp_comfyui_bridge.lora_yaml import SdLoraYaml
+
+
+def workflow(checkpoint: str) -> dict:
+    lora = SdLoraYaml(
+        data={
+            "checkpoint": checkpoint,
+            "lora": [{"enabled": False, "model": "none", "strength": 1.0}],
+        }
+    )
+    return ComfyuiBridge.t2i_request_build("1girl", "", lora, lora.image_size)
+
+
+def unused_url() -> str:
+    # 何も待ち受けていないポート
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/"
+
+
+async def run_jobs(urls: list[str], checkpoints: list[str]) -> tuple[float, JobTable]:
+    pool = BackendPool([ComfyuiBridge(url) for url in urls], health_interval=0)
+    jobs = JobTable(pool, free_policy="never")
+    start = time.perf_counter()
+    submitted = []
+    for checkpoint in checkpoints:
+        job = await jobs.submit(workflow(checkpoint), "26", (checkpoint,))
+        submitted.append(job)
+    await asyncio.gather(*(jobs.wait(job) for job in submitted))
+    elapsed = time.perf_counter() - start
+    assert all(job.status == JOB_DONE for job in submitted)
+    await pool.close()
+    return elapsed, jobs
+
+
+def dispatched(jobs: JobTable) -> str:
+    return " ".join(str(b["dispatched"]) for b in jobs.pool.stats())
+
+
+def main():
+    logging.getLogger("fm_mcp_comfyui_bridge.job_table").setLevel(logging.WARNING)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    backends = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+    stubs = [StubComfyui(delay=delay, load_delay=delay * 3) for _ in range(backends)]
+    for stub in stubs:
+        stub.__enter__()
+    urls = [stub.url for stub in stubs]
+    print(f"{count} jobs, {backends} backends, {delay:.2f} s/job")
+
+    same = ["a.safetensors"] * count
+    elapsed, jobs = asyncio.run(run_jobs(urls[:1], same))
+    print(f"1 backend         {elapsed:6.2f} s  dispatched {dispatched(jobs)}")
+    elapsed, jobs = asyncio.run(run_jobs(urls, same))
+    print(f"{backends} backends        {elapsed:6.2f} s  dispatched {dispatched(jobs)}")
+    elapsed, jobs = asyncio.run(run_jobs([unused_url()] + urls, same))
+    print(f"+1 dead backend   {elapsed:6.2f} s  dispatched {dispatched(jobs)}")
+
+    # チェックポイントを交互に投入してもロード済みのバックエンドに寄せる
+    swaps_before = sum(stub.swaps for stub in stubs)
+    mixed = [f"{'ab'[i % 2]}.safetensors" for i in range(count)]
+    elapsed, jobs = asyncio.run(run_jobs(urls, mixed))
+    swaps = sum(stub.swaps for stub in stubs) - swaps_before
+    print(
+        f"mixed checkpoints {elapsed:6.2f} s  dispatched {dispatched(jobs)}"
+        f"  model swaps {swaps}"
+    )
+    stats = jobs.stats()
+    print(f"cold/warm         {stats['cold_generations']}/{stats['warm_generations']}")
+    for stub in stubs:
+        stub.__exit__(None, None, None)
+
+
+if __name__ == "__main__":
+    main()
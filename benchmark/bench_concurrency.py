@@ -0,0 +1,89 @@
+"""
+MCP ツールの並行実行の確認。
+
+スタブの ComfyUI サーバーに対して generate_picture を jobs 件同時に投げ、
+その最中に get_picture を繰り返し呼んで応答時間を測る。
+あわせてイベントループの最大停止時間を計測し、生成待ちの間も
+他のリクエストが止まらずに処理されていることを確認する。
+
+    uv run python benchmark/bench_concurrency.py [jobs] [delay]
+"""
+
+import asyncio
+import importlib
+import logging
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+from stub_comfyui import StubComfyui
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.job_table import JobTable
+
+# パッケージの main 関数と名前が重なるので import_module で取得する
+server = importlib.import_module("fm_mcp_comfyui_bridge.main")
+
+
+async def loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    # sleep の遅れからイベントループが止まっていた最大時間を求める
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def poll_picture(stop: asyncio.Event, subfolder: str, filename: str) -> list[float]:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await server.get_picture(subfolder, filename)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.05)
+    return latencies
+
+
+async def run(url: str, jobs: int):
+    server.pool = BackendPool([ComfyuiBridge(url)])
+    server.jobs = JobTable(server.pool)
+    # 1 件目で画像を用意しておき、以降の get_picture はキャッシュから返す
+    first = await server.generate_picture("1girl, solo")
+    query = parse_qs(urlparse(first).query)
+    subfolder, filename = query["subfolder"][0], query["filename"][0]
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(loop_lag(stop))
+    poll_task = asyncio.create_task(poll_picture(stop, subfolder, filename))
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(server.generate_picture("1girl, solo") for _ in range(jobs))
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst_lag = await lag_task
+    latencies = await poll_task
+    await server.pool.close()
+
+    ok = sum(1 for r in results if r.startswith("http"))
+    print(f"generate_picture  {ok}/{jobs} ok in {elapsed:.2f} s")
+    print(
+        f"get_picture       {len(latencies)} calls during generation,"
+        f" max {max(latencies) * 1000:.1f} ms"
+    )
+    print(f"event loop lag    max {worst_lag * 1000:.1f} ms")
+
+
+def main():
+    logging.getLogger("fm_mcp_comfyui_bridge.job_table").setLevel(logging.WARNING)
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    with StubComfyui(delay=delay) as stub:
+        print(f"{jobs} concurrent jobs, {delay:.2f} s/job on stub ComfyUI")
+        asyncio.run(run(stub.url, jobs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+MCP の進捗通知の確認。
+
+ステップ数の多いスタブの ComfyUI サーバーに対して、インメモリの MCP
+クライアントから generate_picture を 2 件同時に呼ぶ。後の 1 件は
+ComfyUI のキューで待つので、キューの位置、実行中のノード、ステップが
+進捗通知として届くこと、通知の数がステップ数より間引かれていることを確認する。
+
+    uv run python benchmark/bench_progress.py [steps] [delay]
+"""
+
+import asyncio
+import importlib
+import logging
+import sys
+import time
+
+from mcp.shared.memory import create_connected_server_and_client_session
+from stub_comfyui import StubComfyui
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.job_table import JobTable
+
+# パッケージの main 関数と名前が重なるので import_module で取得する
+server = importlib.import_module("fm_mcp_comfyui_bridge.main")
+
+
+async def call_with_progress(session, name: str, start: float) -> list[tuple]:
+    received = []
+
+    async def on_progress(progress: float, total: float | None, message: str | None):
+        received.append((time.perf_counter() - start, progress, total, message))
+
+    result = await session.call_tool(
+        name="generate_picture",
+        arguments={"prompt": f"1girl, {name}"},
+        progress_callback=on_progress,
+    )
+    assert not result.isError, result
+    return received
+
+
+async def measure(url: str) -> list[list[tuple]]:
+    server.pool = BackendPool([ComfyuiBridge(url)], health_interval=0)
+    server.jobs = JobTable(server.pool, free_policy="never")
+    start = time.perf_counter()
+    async with create_connected_server_and_client_session(server.mcp) as session:
+        results = await asyncio.gather(
+            call_with_progress(session, "first", start),
+            call_with_progress(session, "second", start),
+        )
+    await server.pool.close()
+    return results
+
+
+def main():
+    logging.getLogger("fm_mcp_comfyui_bridge.job_table").setLevel(logging.WARNING)
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+    with StubComfyui(delay=delay, steps=steps) as stub:
+        results = asyncio.run(measure(stub.url))
+    for name, received in zip(("first", "second"), results):
+        print(f"{name}: {len(received)} notifications for {steps} steps")
+        for elapsed, progress, total, message in received:
+            print(f"  {elapsed:6.2f}s {progress:5.2f}/{total:g} {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+モデルごとにまとめるスケジューラーの効果の計測。
+
+チェックポイントのロードに時間がかかるスタブの ComfyUI サーバーに、
+2 種類のチェックポイントのジョブを交互に投入する。到着順にそのまま
+送る場合とスケジューラーで並べ替える場合で、所要時間と
+モデルの読み替え回数を比較する。
+
+    uv run python benchmark/bench_scheduler.py [jobs] [delay] [load_delay]
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from stub_comfyui import StubComfyui
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.job_table import JOB_DONE, JobTable
+from fm_mcp_comfyui_bridge.lora_yaml import SdLoraYaml
+from fm_mcp_comfyui_bridge.scheduler import ModelAffinityScheduler
+
+
+def workflow(checkpoint: str) -> dict:
+    lora = SdLoraYaml(
+        data={
+            "checkpoint": checkpoint,
+            "lora": [{"enabled": False, "model": "none", "strength": 1.0}],
+        }
+    )
+    return ComfyuiBridge.t2i_request_build("1girl", "", lora, lora.image_size)
+
+
+async def run_jobs(url: str, checkpoints: list[str], scheduler) -> tuple[float, dict]:
+    pool = BackendPool([ComfyuiBridge(url)], health_interval=0)
+    jobs = JobTable(pool, free_policy="never", scheduler=scheduler)
+    start = time.perf_counter()
+    submitted = []
+    for checkpoint in checkpoints:
+        job = await jobs.submit(workflow(checkpoint), "26", (checkpoint,))
+        submitted.append(job)
+        # リクエストが少しずつ届く状況
+        await asyncio.sleep(0.01)
+    await asyncio.gather(*(jobs.wait(job) for job in submitted))
+    elapsed = time.perf_counter() - start
+    assert all(job.status == JOB_DONE for job in submitted)
+    await pool.close()
+    return elapsed, jobs.stats()
+
+
+def main():
+    logging.getLogger("fm_mcp_comfyui_bridge.job_table").setLevel(logging.WARNING)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    load_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+    checkpoints = [f"{'ab'[i % 2]}.safetensors" for i in range(count)]
+    print(f"{count} jobs alternating 2 checkpoints, {delay:.2f} s/job, {load_delay:.2f} s/load")
+    for name, scheduler in (
+        ("fifo", None),
+        ("scheduler", ModelAffinityScheduler(max_wait=60.0, max_skips=count)),
+    ):
+        with StubComfyui(delay=delay, load_delay=load_delay) as stub:
+            elapsed, stats = asyncio.run(run_jobs(stub.url, checkpoints, scheduler))
+            line = f"{name:10s} {elapsed:6.2f} s  model swaps {stub.swaps:3d}"
+            if stats["scheduler"]:
+                line += f"  max wait {stats['scheduler']['max_waited_seconds']:.2f} s"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+サーバーの起動時間の計測。
+
+1. `python -X importtime` でサーバーのモジュールを import し、
+   累積時間の大きいモジュールと、起動時に読み込まれた重いモジュール
+   (onnxruntime, pandas, numpy, ollama など) を表示する。
+2. MCP クライアントが stdio でサーバーを起動してから、initialize と
+   最初の tools/list の応答が返るまでの時間を runs 回計測する。
+
+    uv run python benchmark/bench_startup.py [runs] [importtime_log]
+"""
+
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+# 最初に使うときまで読み込まれないはずのモジュール
+HEAVY_MODULES = ("onnxruntime", "pandas", "numpy", "huggingface_hub", "ollama", "requests")
+SERVER_COMMAND = "from fm_mcp_comfyui_bridge import main; main()"
+
+
+def import_times(log_path: str = None) -> list[tuple[int, int, str]]:
+    # (self us, cumulative us, module) のリスト
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import fm_mcp_comfyui_bridge.main"],
+        capture_output=True,
+        text=True,
+        env=os.environ,
+        check=True,
+    )
+    if log_path:
+        with open(log_path, "w", encoding="utf-8") as file:
+            file.write(result.stderr)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        entries.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return entries
+
+
+async def first_tools_list() -> tuple[float, float, int]:
+    params = StdioServerParameters(
+        command=sys.executable, args=["-c", SERVER_COMMAND], env=dict(os.environ)
+    )
+    start = time.perf_counter()
+    async with stdio_client(params, errlog=open(os.devnull, "w")) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            initialized = time.perf_counter() - start
+            tools = await session.list_tools()
+            listed = time.perf_counter() - start
+    return initialized, listed, len(tools.tools)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    log_path = sys.argv[2] if len(sys.argv) > 2 else None
+    entries = import_times(log_path)
+    total = max(cumulative for _, cumulative, _ in entries)
+    print(f"import fm_mcp_comfyui_bridge.main: {total / 1000:.1f} ms")
+    # main が直接 import したモジュール (main より 1 段深いもの) の累積時間
+    depth = {name: len(name) - len(name.lstrip()) for _, _, name in entries}
+    main_depth = next(d for n, d in depth.items() if n.strip() == "fm_mcp_comfyui_bridge.main")
+    children = [e for e in entries if depth[e[2]] == main_depth + 2]
+    for _, cumulative, name in sorted(children, key=lambda e: -e[1])[:10]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name.strip()}")
+    loaded = {name.strip() for _, _, name in entries}
+    heavy = [module for module in HEAVY_MODULES if module in loaded]
+    print(f"heavy modules loaded at startup: {', '.join(heavy) or 'none'}")
+
+    results = [asyncio.run(first_tools_list()) for _ in range(runs)]
+    initialized = statistics.median(r[0] for r in results)
+    listed = statistics.median(r[1] for r in results)
+    print(f"stdio spawn -> initialize: {initialized * 1000:.0f} ms (median of {runs})")
+    print(f"stdio spawn -> tools/list: {listed * 1000:.0f} ms ({results[0][2]} tools)")
+
+
+if __name__ == "__main__":
+    main()
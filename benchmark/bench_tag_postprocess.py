@@ -0,0 +1,84 @@
+"""
+WD14Tagger のタグ後処理(スコア -> タグ文字列)の 1 画像あたりコスト計測。
+
+wd-*-tagger-v3 と同じ規模・カテゴリ構成のラベル表と乱数スコアで、
+以前の Python リストによる実装と TagLabels の NumPy 実装を比較する。
+モデルのダウンロードは不要。
+
+    uv run python benchmark/bench_tag_postprocess.py [iterations]
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+from fm_mcp_comfyui_bridge.tagger import (
+    CATEGORY_CHARACTER,
+    CATEGORY_GENERAL,
+    CATEGORY_RATING,
+    TagLabels,
+)
+
+# selected_tags.csv (v3) のカテゴリ別件数
+RATING_COUNT = 4
+GENERAL_COUNT = 7911
+CHARACTER_COUNT = 2946
+
+
+def make_labels() -> TagLabels:
+    categories = np.array(
+        [CATEGORY_RATING] * RATING_COUNT
+        + [CATEGORY_GENERAL] * GENERAL_COUNT
+        + [CATEGORY_CHARACTER] * CHARACTER_COUNT,
+        dtype=np.int64,
+    )
+    names = np.array([f"tag_{i}_(x)" for i in range(len(categories))], dtype=object)
+    return TagLabels.from_arrays(names, categories)
+
+
+def make_scores(size: int) -> np.ndarray:
+    # 実際の出力と同様、ほとんどのタグはスコアが低く数十件だけ閾値を超える
+    rng = np.random.default_rng(0)
+    return (rng.random(size, dtype=np.float32) ** 300).astype(np.float32)
+
+
+def tags_before(tag_names, general_indexes, scores, threshold):
+    labels = list(zip(tag_names, scores.astype(float)))
+    general_names = [labels[i] for i in general_indexes]
+    general_res = [x for x in general_names if x[1] > threshold]
+    general_res = dict(general_res)
+    sorted_general_strings = sorted(
+        general_res.items(),
+        key=lambda x: x[1],
+        reverse=True,
+    )
+    sorted_general_strings = [x[0] for x in sorted_general_strings]
+    return ", ".join(sorted_general_strings).replace("(", "\\(").replace(")", "\\)")
+
+
+def tags_after(labels, scores, threshold):
+    return labels.result(scores, threshold).general_string()
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    labels = make_labels()
+    scores = make_scores(len(labels.names))
+    tag_names = labels.names.tolist()
+    general_indexes = list(labels.general_indexes)
+    threshold = 0.25
+    assert tags_before(tag_names, general_indexes, scores, threshold) == tags_after(
+        labels, scores, threshold
+    )
+    for name, func in (
+        ("before", lambda: tags_before(tag_names, general_indexes, scores, threshold)),
+        ("after", lambda: tags_after(labels, scores, threshold)),
+        ("top_k=10", lambda: labels.result(scores, threshold, top_k=10)),
+    ):
+        elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+        print(f"{name:10s} {elapsed / iterations * 1e6:9.1f} us/image")
+
+
+if __name__ == "__main__":
+    main()
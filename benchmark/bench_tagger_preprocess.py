@@ -0,0 +1,137 @@
+"""
+tagger の前処理の計測。
+
+以前の前処理 (全サイズの LANCZOS 縮小、パディング用の RGB 画像への貼り付け、
+float32 への変換と BGR の反転、np.stack によるバッチ化) と現在の前処理を比べる。
+
+1. 画像の種類ごとに、バイト列から 1 枚分の入力を作るまでの時間
+2. tag_many と同じ並列度で前処理と推論を重ねたときの処理枚数 (枚/秒)
+3. 透過 PNG の透過部分の入力値 (白 = 255 に合成されているか)
+
+    uv run python benchmark/bench_tagger_preprocess.py [model_repo] [images] [image_size]
+"""
+
+import io
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from fm_mcp_comfyui_bridge.tagger import (
+    SWINV2_MODEL_DSV3_REPO,
+    TAGGER_MAX_BATCH_SIZE,
+    TAGGER_PREPROCESS_WORKERS,
+    WD14Tagger,
+)
+
+REPEAT = 5
+
+
+def legacy_preprocess(tagger: WD14Tagger, data: bytes) -> np.ndarray:
+    image = Image.open(io.BytesIO(data))
+    size = tagger.model_target_size
+    aspect_ratio = min(size / image.width, size / image.height)
+    new_size = (int(image.width * aspect_ratio), int(image.height * aspect_ratio))
+    resized_image = image.resize(new_size, Image.LANCZOS)
+    square_image = Image.new("RGB", (size, size), (255, 255, 255))
+    square_image.paste(resized_image, ((size - new_size[0]) // 2, (size - new_size[1]) // 2))
+    image_array = np.asarray(square_image, dtype=np.float32)[:, :, ::-1]
+    if tagger.channels_first:
+        image_array = image_array.transpose(2, 0, 1)
+    return image_array
+
+
+def legacy_tag_many(tagger: WD14Tagger, sources: list[bytes], max_batch_size: int, workers: int):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(sources), max_batch_size):
+            chunk = sources[start : start + max_batch_size]
+            arrays = list(executor.map(lambda data: legacy_preprocess(tagger, data), chunk))
+            tagger.predict(np.stack(arrays))
+
+
+def make_images(image_size: int) -> dict[str, bytes]:
+    rng = np.random.default_rng(0)
+    # ノイズだと LANCZOS 以外の差が見えにくいので、なめらかな模様を重ねる
+    y, x = np.mgrid[0:image_size, 0:image_size] / image_size
+    base = np.stack([np.sin(x * 9), np.cos(y * 7), np.sin((x + y) * 5)], axis=-1)
+    pixels = ((base + 1) * 110 + rng.integers(0, 35, base.shape)).astype(np.uint8)
+    rgb = Image.fromarray(pixels)
+    rgba = rgb.convert("RGBA")
+    alpha = np.full((image_size, image_size), 255, dtype=np.uint8)
+    alpha[:, : image_size // 4] = 0
+    rgba.putalpha(Image.fromarray(alpha))
+    wide = rgb.resize((image_size * 2, image_size))
+    images = {}
+    for name, image, format in (
+        ("png rgb", rgb, "PNG"),
+        ("png rgba", rgba, "PNG"),
+        ("jpeg", rgb, "JPEG"),
+        ("jpeg 2x wide", wide, "JPEG"),
+    ):
+        buffer = io.BytesIO()
+        image.save(buffer, format=format, quality=92)
+        images[name] = buffer.getvalue()
+    return images
+
+
+def per_image(function, data: bytes) -> float:
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        function(data)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def throughput(function, count: int) -> float:
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    model_repo = sys.argv[1] if len(sys.argv) > 1 else SWINV2_MODEL_DSV3_REPO
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    image_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1024
+    tagger = WD14Tagger(model_repo)
+    images = make_images(image_size)
+
+    print(f"{model_repo}, input {tagger.model_target_size}px, source {image_size}px")
+    print(f"{'image':14} {'bytes':>10} {'legacy':>9} {'current':>9} {'max diff':>9}")
+    for name, data in images.items():
+        legacy = per_image(lambda d: legacy_preprocess(tagger, d), data)
+        current = per_image(tagger.prepare_image, data)
+        diff = np.abs(legacy_preprocess(tagger, data) - tagger.prepare_image(data)[0]).max()
+        print(
+            f"{name:14} {len(data):10,} {legacy * 1000:7.1f}ms {current * 1000:7.1f}ms {diff:9.1f}"
+        )
+
+    sources = [images["png rgb"], images["jpeg"]] * (count // 2)
+    tagger.tag_many(sources[:TAGGER_MAX_BATCH_SIZE])
+    legacy = throughput(
+        lambda: legacy_tag_many(tagger, sources, TAGGER_MAX_BATCH_SIZE, TAGGER_PREPROCESS_WORKERS),
+        len(sources),
+    )
+    current = throughput(lambda: tagger.tag_many(sources), len(sources))
+    print(
+        f"tag_many {len(sources)} images (batch {TAGGER_MAX_BATCH_SIZE},"
+        f" {TAGGER_PREPROCESS_WORKERS} workers): legacy {legacy:.1f} img/s,"
+        f" current {current:.1f} img/s ({current / legacy:.2f}x)"
+    )
+
+    transparent = tagger.prepare_image(images["png rgba"])[0]
+    legacy_transparent = legacy_preprocess(tagger, images["png rgba"])
+    hwc = transparent.transpose(1, 2, 0) if tagger.channels_first else transparent
+    legacy_hwc = (
+        legacy_transparent.transpose(1, 2, 0) if tagger.channels_first else legacy_transparent
+    )
+    # 透過にした左 1/4 の中央
+    point = (tagger.model_target_size // 2, tagger.model_target_size // 8)
+    print(f"transparent pixel: legacy {legacy_hwc[point]}, current {hwc[point]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+tagger の FP32 モデルと INT8 に動的量子化したモデルの比較。
+
+同じ画像を両方のモデルで推論し、モデルのロード時間とファイルサイズ、
+1 枚あたりの推論時間、閾値を超えた general タグの一致率 (Jaccard)、
+スコアの差を表示する。image_dir を省略するとノイズ画像で計測するので、
+一致率は実際の画像で確認すること。初回の INT8 のロード時間には量子化の時間が含まれる。
+
+    uv run --extra quantize python benchmark/bench_tagger_quantize.py [model_repo] [image_dir] [threshold]
+"""
+
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from fm_mcp_comfyui_bridge.tagger import (
+    SWINV2_MODEL_DSV3_REPO,
+    SessionConfig,
+    WD14Tagger,
+)
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+NOISE_IMAGES = 8
+
+
+def load_images(image_dir: str | None) -> list[Image.Image]:
+    if image_dir:
+        paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+        return [Image.open(p).convert("RGB") for p in paths]
+    rng = np.random.default_rng(0)
+    return [
+        Image.fromarray(rng.integers(0, 256, (768, 512, 3), dtype=np.uint8))
+        for _ in range(NOISE_IMAGES)
+    ]
+
+
+def load_tagger(model_repo: str, quantize: bool) -> tuple[WD14Tagger, float]:
+    start = time.perf_counter()
+    tagger = WD14Tagger(model_repo, session_config=SessionConfig(quantize=quantize))
+    return tagger, time.perf_counter() - start
+
+
+def general_tags(tagger: WD14Tagger, scores: np.ndarray, threshold: float) -> set[str]:
+    return set(tagger.tag_result(scores, threshold, top_k=None).general)
+
+
+def main():
+    model_repo = sys.argv[1] if len(sys.argv) > 1 else SWINV2_MODEL_DSV3_REPO
+    image_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.35
+    fp32, fp32_load = load_tagger(model_repo, quantize=False)
+    int8, int8_load = load_tagger(model_repo, quantize=True)
+    if not int8.quantized:
+        print("INT8 model is not available (install the quantize extra)")
+        return
+    images = load_images(image_dir)
+    inputs = [fp32.prepare_image(image) for image in images]
+    # 最初の推論の初期化を計測から外す
+    fp32.predict(inputs[0])
+    int8.predict(inputs[0])
+
+    fp32_times, int8_times, jaccards, max_diffs, mean_diffs = [], [], [], [], []
+    for input in inputs:
+        start = time.perf_counter()
+        fp32_scores = fp32.predict(input)[0]
+        fp32_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        int8_scores = int8.predict(input)[0]
+        int8_times.append(time.perf_counter() - start)
+        diff = np.abs(fp32_scores - int8_scores)
+        max_diffs.append(float(diff.max()))
+        mean_diffs.append(float(diff.mean()))
+        expected = general_tags(fp32, fp32_scores, threshold)
+        actual = general_tags(int8, int8_scores, threshold)
+        union = expected | actual
+        jaccards.append(len(expected & actual) / len(union) if union else 1.0)
+
+    source = image_dir or f"{NOISE_IMAGES} noise images"
+    print(f"{model_repo}, {len(images)} images from {source}, threshold {threshold}")
+    print(f"{'':6} {'load':>9} {'model MB':>9} {'median':>9} {'mean':>9}")
+    for name, tagger, load, times in (
+        ("fp32", fp32, fp32_load, fp32_times),
+        ("int8", int8, int8_load, int8_times),
+    ):
+        size = os.path.getsize(tagger.model_path) / 1024 / 1024
+        print(
+            f"{name:6} {load:8.2f}s {size:9.1f}"
+            f" {statistics.median(times) * 1000:7.1f}ms {statistics.mean(times) * 1000:7.1f}ms"
+        )
+    print(f"speedup: {statistics.median(fp32_times) / statistics.median(int8_times):.2f}x")
+    print(f"general tag agreement (Jaccard): mean {statistics.mean(jaccards):.3f}, min {min(jaccards):.3f}")
+    print(f"score diff: mean {statistics.mean(mean_diffs):.5f}, max {max(max_diffs):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+get_picture の縮小・形式変換の計測。
+
+スタブの ComfyUI サーバーの 1024x1024 の PNG を、変換の指定ごとに
+get_picture で取得し、返すデータのサイズ (base64 後) と、
+初回 (変換あり) と 2 回目 (キャッシュ) の所要時間を比較する。
+
+    uv run python benchmark/bench_transcode.py [image_size]
+"""
+
+import asyncio
+import base64
+import importlib
+import sys
+import time
+
+from stub_comfyui import StubComfyui
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.image_cache import ImageCache
+from fm_mcp_comfyui_bridge.job_table import JobTable
+
+# パッケージの main 関数と名前が重なるので import_module で取得する
+server = importlib.import_module("fm_mcp_comfyui_bridge.main")
+
+VARIANTS = [
+    {},
+    {"format": "png", "max_side": 512},
+    {"format": "webp", "quality": 85},
+    {"format": "webp", "max_side": 512, "quality": 80},
+    {"format": "jpeg", "max_side": 512, "quality": 80},
+    {"format": "webp", "max_side": 256, "quality": 70},
+]
+
+
+async def measure(url: str) -> list[tuple]:
+    server.pool = BackendPool([ComfyuiBridge(url)], health_interval=0)
+    server.jobs = JobTable(server.pool, free_policy="never")
+    server.image_cache = ImageCache()
+    # 元の画像の取得はあらかじめ済ませておく
+    await server.get_picture("stub", "bench.png")
+    results = []
+    for params in VARIANTS:
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            image = await server.get_picture("stub", "bench.png", **params)
+            timings.append(time.perf_counter() - start)
+        wire = len(base64.b64encode(image.data))
+        results.append((params, len(image.data), wire, timings))
+    await server.pool.close()
+    return results
+
+
+def main():
+    image_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    with StubComfyui(image_size=image_size) as stub:
+        results = asyncio.run(measure(stub.url))
+    print(f"{image_size}x{image_size} noise PNG from stub ComfyUI")
+    print(f"{'params':45} {'bytes':>9} {'base64':>9} {'first':>9} {'cached':>9}")
+    for params, size, wire, (first, cached) in results:
+        label = ", ".join(f"{k}={v}" for k, v in params.items()) or "(original)"
+        print(
+            f"{label:45} {size:9,} {wire:9,}"
+            f" {first * 1000:7.1f}ms {cached * 1000:7.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
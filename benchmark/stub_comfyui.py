@@ -0,0 +1,304 @@
+"""
+ベンチマーク用の ComfyUI スタブサーバー。
+
+/prompt, /history, /queue, /view, /free, /interrupt と /ws を持ち、
+キューに入ったプロンプトを 1 つずつ delay 秒かけて「実行」して
+実際の ComfyUI と同じ形式の websocket イベントを送る。
+チェックポイントが前のプロンプトと違う場合は load_delay 秒のロード時間を加える。
+前のプロンプトと同じ入力のノードは execution_cached で通知して実行しない。
+output_cached を True にすると出力ノードもキャッシュ済みとして executed を送らない。
+/interrupt は実行中のプロンプトを止め、ComfyUI と同じく error として history に残す。
+failures に {"queue": 2} のようにパスの先頭と回数を入れると、その回数だけ
+503 を返す (リトライの確認用)。
+
+    with StubComfyui(delay=0.5) as stub:
+        bridge = ComfyuiBridge(stub.url)
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import threading
+import time
+import uuid
+
+import uvicorn
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+
+def _png(size: int = 1024) -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_noise((size, size), 64).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class StubComfyui:
+    def __init__(
+        self,
+        delay: float = 0.5,
+        steps: int = 4,
+        image_size: int = 1024,
+        load_delay: float = 0.0,
+    ):
+        self.delay = delay
+        # チェックポイントのロードにかかる時間
+        self.load_delay = load_delay
+        self.steps = steps
+        self.png = _png(image_size)
+        self.history = {}
+        self.counts = {
+            "prompt": 0,
+            "history": 0,
+            "queue": 0,
+            "view": 0,
+            "free": 0,
+            "interrupt": 0,
+        }
+        # パスの先頭ごとに 503 を返す残りの回数
+        self.failures: dict[str, int] = {}
+        self.loaded_checkpoint = None
+        # チェックポイントを読み替えた回数
+        self.swaps = 0
+        self._queue: list[tuple[str, dict, str]] = []
+        self._running: str | None = None
+        self._interrupted = False
+        # 出力ノードもキャッシュ済みとして扱うか
+        self.output_cached = False
+        self._last_prompt: dict = {}
+        self._clients: dict[str, WebSocket] = {}
+        self._wakeup: asyncio.Event | None = None
+        self.app = Starlette(
+            routes=[
+                Route("/prompt", self._prompt, methods=["POST"]),
+                Route("/history", self._history),
+                Route("/history/{prompt_id}", self._history),
+                Route("/queue", self._queue_status, methods=["GET", "POST"]),
+                Route("/view", self._view),
+                Route("/free", self._free, methods=["POST"]),
+                Route("/interrupt", self._interrupt, methods=["POST"]),
+                Route("/system_stats", self._system_stats),
+                WebSocketRoute("/ws", self._ws),
+            ],
+            lifespan=self._lifespan,
+        )
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    # --- lifecycle ---
+    def __enter__(self):
+        config = uvicorn.Config(
+            self._asgi, host="127.0.0.1", port=0, log_level="warning", interface="asgi3"
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.01)
+        port = self._server.servers[0].sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/"
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+
+    async def _asgi(self, scope, receive, send):
+        if scope["type"] == "http":
+            name = scope["path"].strip("/").split("/")[0]
+            if self.failures.get(name):
+                self.failures[name] -= 1
+                await Response(status_code=503)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+    @contextlib.asynccontextmanager
+    async def _lifespan(self, app):
+        self._wakeup = asyncio.Event()
+        worker = asyncio.create_task(self._worker())
+        yield
+        worker.cancel()
+
+    # --- execution ---
+    async def _send(self, client_id: str, type: str, data: dict):
+        ws = self._clients.get(client_id)
+        if ws is not None:
+            try:
+                await ws.send_text(json.dumps({"type": type, "data": data}))
+            except Exception:
+                self._clients.pop(client_id, None)
+
+    async def _worker(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            prompt_id, prompt, client_id = self._queue.pop(0)
+            self._running = prompt_id
+            self._interrupted = False
+            await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+            output_node = next(
+                (k for k, v in prompt.items() if v.get("class_type") == "SaveImage"),
+                "9",
+            )
+            sampler_node = next(
+                (k for k, v in prompt.items() if "Sampler" in v.get("class_type", "")),
+                "3",
+            )
+            # ComfyUI と同じく、前回と入力が変わらないノードはキャッシュの結果を使う
+            # (サンプラーはステップを送るため毎回実行する)
+            cached = [
+                k
+                for k, v in prompt.items()
+                if self._last_prompt.get(k) == v
+                and k != sampler_node
+                and (k != output_node or self.output_cached)
+            ]
+            self._last_prompt = prompt
+            await self._send(
+                client_id, "execution_cached", {"prompt_id": prompt_id, "nodes": cached}
+            )
+            batch_size = 1
+            checkpoint = self.loaded_checkpoint
+            for node in prompt.values():
+                inputs = node.get("inputs", {})
+                if "batch_size" in inputs:
+                    batch_size = inputs["batch_size"]
+                if "ckpt_name" in inputs:
+                    checkpoint = inputs["ckpt_name"]
+            if checkpoint != self.loaded_checkpoint:
+                if self.loaded_checkpoint is not None:
+                    self.swaps += 1
+                self.loaded_checkpoint = checkpoint
+                await asyncio.sleep(self.load_delay)
+            await self._send(client_id, "executing", {"prompt_id": prompt_id, "node": sampler_node})
+            for step in range(1, self.steps + 1):
+                await asyncio.sleep(self.delay / self.steps)
+                if self._interrupted:
+                    break
+                await self._send(
+                    client_id,
+                    "progress",
+                    {"prompt_id": prompt_id, "node": sampler_node, "value": step, "max": self.steps},
+                )
+            if self._interrupted:
+                await self._send(
+                    client_id,
+                    "execution_interrupted",
+                    {"prompt_id": prompt_id, "node_id": sampler_node},
+                )
+                self.history[prompt_id] = {
+                    "outputs": {},
+                    "status": {"status_str": "error", "completed": False},
+                }
+                self._running = None
+                await self._send(client_id, "executing", {"prompt_id": prompt_id, "node": None})
+                continue
+            output = {
+                "images": [
+                    {"filename": f"{prompt_id}_{i:05}_.png", "subfolder": "stub", "type": "output"}
+                    for i in range(batch_size)
+                ]
+            }
+            if output_node not in cached:
+                await self._send(
+                    client_id, "executing", {"prompt_id": prompt_id, "node": output_node}
+                )
+                await self._send(
+                    client_id,
+                    "executed",
+                    {"prompt_id": prompt_id, "node": output_node, "output": output},
+                )
+            # ComfyUI は execution_success の後で history に書き込み、最後に node None を送る
+            await self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+            self.history[prompt_id] = {
+                "outputs": {output_node: output},
+                "status": {"status_str": "success", "completed": True},
+            }
+            self._running = None
+            await self._send(client_id, "executing", {"prompt_id": prompt_id, "node": None})
+
+    # --- routes ---
+    async def _prompt(self, request):
+        self.counts["prompt"] += 1
+        body = await request.json()
+        prompt_id = uuid.uuid4().hex
+        self._queue.append((prompt_id, body["prompt"], body.get("client_id")))
+        self._wakeup.set()
+        return JSONResponse({"prompt_id": prompt_id, "number": len(self._queue)})
+
+    async def _history(self, request):
+        self.counts["history"] += 1
+        prompt_id = request.path_params.get("prompt_id")
+        if prompt_id is None:
+            # ComfyUI と同じく max_items と offset で古い順に切り出す
+            items = list(self.history.items())
+            max_items = request.query_params.get("max_items")
+            if max_items is not None:
+                offset = int(request.query_params.get("offset", -1))
+                if offset < 0:
+                    offset = max(0, len(items) - int(max_items))
+                items = items[offset : offset + int(max_items)]
+            return JSONResponse(dict(items))
+        entry = self.history.get(prompt_id)
+        return JSONResponse({prompt_id: entry} if entry else {})
+
+    async def _queue_status(self, request):
+        self.counts["queue"] += 1
+        if request.method == "POST":
+            body = await request.json()
+            delete = set(body.get("delete", []))
+            self._queue = [q for q in self._queue if q[0] not in delete]
+            return JSONResponse({})
+        running = [[0, self._running]] if self._running else []
+        pending = [[i + 1, q[0]] for i, q in enumerate(self._queue)]
+        return JSONResponse({"queue_running": running, "queue_pending": pending})
+
+    async def _view(self, request):
+        self.counts["view"] += 1
+        return Response(self.png, media_type="image/png")
+
+    async def _free(self, request):
+        self.counts["free"] += 1
+        body = await request.json()
+        if body.get("unload_models"):
+            self.loaded_checkpoint = None
+        return JSONResponse({})
+
+    async def _interrupt(self, request):
+        self.counts["interrupt"] += 1
+        body = await request.json()
+        # prompt_id を指定した場合はそれが実行中のときだけ止める
+        prompt_id = body.get("prompt_id")
+        if self._running and prompt_id in (None, self._running):
+            self._interrupted = True
+        return JSONResponse({})
+
+    async def _system_stats(self, request):
+        return JSONResponse({"system": {"comfyui_version": "stub"}, "devices": []})
+
+    async def _ws(self, websocket: WebSocket):
+        await websocket.accept()
+        client_id = websocket.query_params.get("clientId") or uuid.uuid4().hex
+        self._clients[client_id] = websocket
+        await websocket.send_text(
+            json.dumps(
+                {
+                    "type": "status",
+                    "data": {
+                        "status": {"exec_info": {"queue_remaining": len(self._queue)}},
+                        "sid": client_id,
+                    },
+                }
+            )
+        )
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            self._clients.pop(client_id, None)
@@ -1,3 +1,9 @@
-from .main import main
+def main():
+    # .main は import するとサーバーの状態 (ComfyUI への接続やスレッド) を作るので、
+    # indexer などのサブモジュールを import しただけでは読み込まないよう呼ばれたときに import する
+    from .main import main as run_server
+
+    run_server()
+
 
 __all__ = ['main']
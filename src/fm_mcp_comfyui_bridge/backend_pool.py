@@ -0,0 +1,149 @@
+import asyncio
+from dataclasses import dataclass
+
+import httpx
+
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+
+# default config value
+## ヘルスチェックの間隔(秒)、0 で無効
+POOL_HEALTH_INTERVAL = 30.0
+## 同じモデルがロード済みのバックエンドを優先するキュー長の差の上限
+POOL_AFFINITY_SLACK = 2
+
+
+@dataclass
+class Backend:
+    bridge: ComfyuiBridge
+    healthy: bool = True
+    # /queue の実行中 + 待機中の件数
+    queue_length: int = 0
+    # 選ばれてからプロンプトを送信し終わるまでの件数
+    dispatching: int = 0
+    # 最後に投入したモデル (workflow, checkpoint, LoRA)
+    model: tuple | None = None
+    # モデルがロード済みか (メモリ解放で False)
+    warm: bool = False
+    dispatched: int = 0
+    last_error: str | None = None
+
+    @property
+    def server_url(self) -> str:
+        return self.bridge.server_url
+
+    @property
+    def load(self) -> int:
+        return self.queue_length + self.dispatching
+
+    def stats(self) -> dict:
+        return {
+            "server_url": self.server_url,
+            "healthy": self.healthy,
+            "queue_length": self.queue_length,
+            "model": list(self.model) if self.model else None,
+            "warm": self.warm,
+            "dispatched": self.dispatched,
+            "last_error": self.last_error,
+        }
+
+
+class BackendPool:
+    """
+    複数の ComfyUI サーバーへの振り分け。
+
+    acquire はヘルスチェックに通っているバックエンドの /queue を確認し、
+    キューの一番短いものを選ぶ。要求されたモデルがロード済みの
+    バックエンドがあれば、キュー長の差が affinity_slack 以内ならそちらを優先する。
+    応答しないバックエンドは外し、health_interval 秒ごとのチェックで復帰させる。
+    """
+
+    def __init__(
+        self,
+        bridges: list[ComfyuiBridge],
+        health_interval: float = POOL_HEALTH_INTERVAL,
+        affinity_slack: int = POOL_AFFINITY_SLACK,
+    ):
+        if not bridges:
+            raise ValueError("ComfyUI のバックエンドが指定されていません")
+        self.backends = [Backend(bridge) for bridge in bridges]
+        self.health_interval = health_interval
+        self.affinity_slack = affinity_slack
+        self._health_task: asyncio.Task | None = None
+
+    @property
+    def primary(self) -> ComfyuiBridge:
+        return self.backends[0].bridge
+
+    def find(self, server_url: str) -> Backend | None:
+        for backend in self.backends:
+            if backend.server_url == server_url:
+                return backend
+        return None
+
+    async def check(self, backend: Backend) -> bool:
+        # /queue が取れればキュー長を更新して healthy
+        try:
+            queue = await backend.bridge.get_queue(retries=0)
+        except httpx.HTTPError as e:
+            queue = None
+            backend.last_error = str(e) or type(e).__name__
+        if queue is None:
+            backend.healthy = False
+            return False
+        running, pending = queue
+        backend.queue_length = len(running) + len(pending)
+        backend.healthy = True
+        backend.last_error = None
+        return True
+
+    async def check_all(self, backends: list[Backend] = None):
+        backends = self.backends if backends is None else backends
+        await asyncio.gather(*(self.check(backend) for backend in backends))
+
+    def start(self):
+        # イベントループ上で最初に使われたときにヘルスチェックを始める
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_all()
+
+    async def acquire(self, model: tuple = None) -> Backend:
+        # 投入先を選ぶ、送信が終わったら release を呼ぶこと
+        self.start()
+        if len(self.backends) == 1:
+            backend = self.backends[0]
+        else:
+            candidates = [b for b in self.backends if b.healthy]
+            await self.check_all(candidates)
+            candidates = [b for b in candidates if b.healthy]
+            if not candidates:
+                # 全滅していたら外したものも確認し直す
+                await self.check_all()
+                candidates = [b for b in self.backends if b.healthy] or self.backends
+            backend = min(candidates, key=lambda b: b.load)
+            if model is not None:
+                affinity = [
+                    b
+                    for b in candidates
+                    if b.model == model and b.load <= backend.load + self.affinity_slack
+                ]
+                if affinity:
+                    backend = min(affinity, key=lambda b: b.load)
+        backend.dispatching += 1
+        return backend
+
+    def release(self, backend: Backend):
+        backend.dispatching -= 1
+
+    def stats(self) -> list[dict]:
+        return [backend.stats() for backend in self.backends]
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for backend in self.backends:
+            await backend.bridge.close()
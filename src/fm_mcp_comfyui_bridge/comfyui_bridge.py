@@ -1,14 +1,21 @@
+import asyncio
 import datetime
-import importlib
 import io
 import json
+import logging
 import random
-import time
+from collections.abc import Callable
 
-import requests
 from PIL import Image
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidURI
 
+from fm_mcp_comfyui_bridge.http_client import HttpClient
 from fm_mcp_comfyui_bridge.lora_yaml import SdLoraYaml
+from fm_mcp_comfyui_bridge.workflow_template import WorkflowTemplate, get_template
+
+# 標準出力は MCP の stdio トランスポートが使うので、診断メッセージはログに出す
+logger = logging.getLogger(__name__)
 
 # default config value
 ## API endpoint of ComfyUI
@@ -27,80 +34,230 @@ COMFYUI_NODE_SIZE = "15"
 COMFYUI_NODE_SAMPLING_DISCRETE = "16"
 COMFYUI_NODE_SAMPLING_STEPS = "12"
 COMFYUI_NODE_SAMPLING_CFG = "10"
+COMFYUI_WORKFLOW_DEFAULT = "SDXL_LoRA_Base_API.json"
+COMFYUI_WORKFLOW_PATHS = {
+    "checkpoint": (COMFYUI_NODE_CHECKPOINT, "inputs", "ckpt_name"),
+    "prompt": (COMFYUI_NODE_PROMPT, "inputs", "text"),
+    "negative": (COMFYUI_NODE_NEGATIVE, "inputs", "text"),
+    "seed": (COMFYUI_NODE_SEED, "inputs", "noise_seed"),
+    "width": (COMFYUI_NODE_SIZE, "inputs", "width"),
+    "height": (COMFYUI_NODE_SIZE, "inputs", "height"),
+    "batch_size": (COMFYUI_NODE_SIZE, "inputs", "batch_size"),
+    "lora_name": (COMFYUI_NODE_LORA_CHECKPOINT, "inputs", "lora_name"),
+    "lora_strength_model": (COMFYUI_NODE_LORA_CHECKPOINT, "inputs", "strength_model"),
+    "lora_strength_clip": (COMFYUI_NODE_LORA_CHECKPOINT, "inputs", "strength_clip"),
+    "sampling": (COMFYUI_NODE_SAMPLING_DISCRETE, "inputs", "sampling"),
+    "steps": (COMFYUI_NODE_SAMPLING_STEPS, "inputs", "steps"),
+    "cfg": (COMFYUI_NODE_SAMPLING_CFG, "inputs", "cfg"),
+    "filename_prefix": (COMFYUI_NODE_OUTPUT, "inputs", "filename_prefix"),
+}
 
 
 class ComfyuiBridge:
-    @staticmethod
-    def send_request(prompt: str, server_url: str = None) -> str | None:
+    """
+    ComfyUI API へのブリッジ。
+
+    server_url ごとに 1 インスタンスを作り、HTTP 通信はすべて
+    インスタンスが持つ HttpClient のコネクションプールを通す。
+    """
+
+    def __init__(self, server_url: str = None, client: HttpClient = None):
+        self.server_url = server_url if server_url else COMFYUI_URL
+        self.client = client if client else HttpClient(self.server_url)
+
+    async def close(self):
+        await self.client.close()
+
+    async def send_request(self, prompt: str, client_id: str = None) -> str | None:
         # APIにリクエスト送信
-        headers = {"Content-Type": "application/json"}
         data = {"prompt": prompt}
-        url = server_url if server_url else COMFYUI_URL
-        response = requests.post(
-            f"{url}prompt",
-            headers=headers,
-            data=json.dumps(data).encode("utf-8"),
-        )
+        # client_id を付けると実行イベントがその websocket に届く
+        if client_id:
+            data["client_id"] = client_id
+        response = await self.client.post("prompt", json=data)
         if response.status_code != 200:
-            print(f"Error: {response.status_code}")
-            print(response.text)
+            logger.error(f"HTTP {response.status_code}: {response.text}")
             return None
         return response.json()["prompt_id"]
 
-    @staticmethod
-    def await_request(
-        check_interval: float, retry_interval: float, server_url: str = None
-    ):
-        # 一定時間ごとにリクエストの状態を確認
-        url = server_url if server_url else COMFYUI_URL
+    async def open_websocket(self, client_id: str) -> ClientConnection | None:
+        # 実行イベント受信用の websocket を開く、開けなければ None
+        ws_url = "ws" + self.server_url.removeprefix("http")
+        try:
+            return await connect(
+                f"{ws_url}ws?clientId={client_id}", open_timeout=10, max_size=None
+            )
+        except (OSError, TimeoutError, InvalidHandshake, InvalidURI) as e:
+            logger.warning(f"Websocket connect error: {e}")
+            return None
+
+    async def await_prompt(
+        self,
+        prompt_id: str,
+        ws: ClientConnection | None,
+        output_node: str = None,
+        check_interval: float = 10.0,
+        on_event: Callable[[str, dict], None] = None,
+    ) -> dict | None:
+        """
+        prompt_id の実行完了を待ち、出力ノードIDごとの output を返す。
+
+        websocket の executing (node が None) / executed / execution_error を見て
+        完了を判定する。websocket が無いか途中で切れた場合と、output_node の
+        executed が来なかった場合 (キャッシュされた出力など) は /history/{prompt_id} で補う。
+        output_node を省略した場合は executed が 1 つも来なかったときに補う。
+        エラーで終了した場合と、ComfyUI の再起動などでプロンプトが /queue にも
+        /history にも無くなった場合は None。
+        on_event を渡すと prompt_id 宛てのイベントごとに (type, data) で呼ぶ。
+        """
+        if ws is None:
+            return await self.await_history(prompt_id, 1.0)
+        outputs = {}
+        try:
+            while True:
+                try:
+                    async with asyncio.timeout(check_interval):
+                        message = await ws.recv()
+                except TimeoutError:
+                    # イベントの取りこぼしに備えて history も確認する
+                    finished, outputs = await self.poll_history(prompt_id)
+                    if finished:
+                        return outputs
+                    continue
+                if not isinstance(message, str):
+                    # バイナリはプレビュー画像なので無視
+                    continue
+                event = json.loads(message)
+                data = event.get("data", {})
+                if data.get("prompt_id") != prompt_id:
+                    continue
+                if on_event:
+                    on_event(event.get("type"), data)
+                match event.get("type"):
+                    case "executed":
+                        outputs[data["node"]] = data["output"]
+                    case "execution_error" | "execution_interrupted":
+                        logger.error(
+                            f"{event['type']} prompt_id={prompt_id}"
+                            f" {data.get('exception_message', '')}"
+                        )
+                        return None
+                    case "executing" if data.get("node") is None:
+                        # execution_success は history の書き込み前に届くので、
+                        # history まで揃ったこちらで終了とする
+                        break
+        except ConnectionClosed as e:
+            logger.warning(f"Websocket closed: {e}")
+            return await self.await_history(prompt_id, 1.0)
+        missing = output_node not in outputs if output_node else not outputs
+        if missing:
+            # キャッシュされた出力ノードの結果は history にしか無い
+            history = await self.await_history(prompt_id, 1.0)
+            if history is not None:
+                outputs = history | outputs
+        return outputs
+
+    async def await_history(
+        self, prompt_id: str, check_interval: float
+    ) -> dict | None:
+        # /history/{prompt_id} に結果が出るまで一定時間ごとに確認
         while True:
-            time.sleep(check_interval)
-            headers = {"Content-Type": "application/json"}
-            response = requests.get(f"{url}queue", headers=headers)
-            if response.status_code != 200:
-                print(f"Error: {response.status_code}")
-                print(response.text)
-                time.sleep(retry_interval)
-                continue
-            json_data = response.json()
-            if (
-                len(json_data.get("queue_running", [])) == 0
-                and len(json_data.get("queue_pending", [])) == 0
-            ):
-                break
+            finished, outputs = await self.poll_history(prompt_id)
+            if finished:
+                return outputs
+            await asyncio.sleep(check_interval)
+
+    async def poll_history(self, prompt_id: str) -> tuple[bool, dict | None]:
+        """
+        prompt_id が終わっていれば (True, outputs)、実行中か待機中なら (False, None)。
+
+        /history に無く /queue にも無いプロンプトは ComfyUI の再起動などで失われた
+        ものとして (True, None) を返す。/queue が取得できないときは待ち続ける。
+        """
+        history = await self.get_history(prompt_id)
+        if history is None:
+            queue = await self.get_queue()
+            if queue is None or prompt_id in queue[0] or prompt_id in queue[1]:
+                return False, None
+            # キューから出た直後に history に入った場合に備えてもう一度確認する
+            history = await self.get_history(prompt_id)
+            if history is None:
+                logger.error(f"prompt_id={prompt_id} is not in the queue or history")
+                return True, None
+        return True, self._history_outputs(history)
+
+    async def get_history(self, prompt_id: str) -> dict | None:
+        # 完了していれば prompt_id の history エントリ、未完了なら None
+        response = await self.client.get(f"history/{prompt_id}")
+        if response.status_code != 200:
+            logger.error(f"HTTP {response.status_code}: {response.text}")
+            return None
+        return response.json().get(prompt_id)
+
+    async def get_histories(self, max_items: int, offset: int = 0) -> dict | None:
+        # 完了したプロンプトの history を古い順に offset から max_items 件
+        params = {"max_items": max_items, "offset": offset}
+        response = await self.client.get("history", params=params)
+        if response.status_code != 200:
+            logger.error(f"HTTP {response.status_code}: {response.text}")
+            return None
+        return response.json()
 
     @staticmethod
-    def get_image(id: any, server_url: str = None, output_node: str = None):
-        url = server_url if server_url else COMFYUI_URL
+    def _history_outputs(history: dict) -> dict | None:
+        status = history.get("status", {})
+        if status.get("status_str") == "error":
+            logger.error(f"prompt failed: {status.get('messages', [])}")
+            return None
+        return history.get("outputs", {})
+
+    async def get_image(self, id: any, output_node: str = None):
         if not output_node:
             output_node = COMFYUI_NODE_OUTPUT
         # リクエストヒストリからファイル名を取得
-        headers = {"Content-Type": "application/json"}
-        response = requests.get(f"{url}history/{id}", headers=headers)
-        if response.status_code != 200:
-            print(f"Error: {response.status_code}")
-            print(response.text)
+        history = await self.get_history(id)
+        if history is None:
             return None
-        subdir = response.json()[id]["outputs"][output_node]["images"][0]["subfolder"]
-        filename = response.json()[id]["outputs"][output_node]["images"][0]["filename"]
-        headers = {"Content-Type": "application/json"}
-        params = {"subfolder": subdir, "filename": filename}
-        response = requests.get(f"{url}view", headers=headers, params=params)
+        subdir = history["outputs"][output_node]["images"][0]["subfolder"]
+        filename = history["outputs"][output_node]["images"][0]["filename"]
+        response = await self.get_view(subdir, filename)
         if response.status_code != 200:
-            print(f"Error: {response.status_code}")
-            print(response.text)
+            logger.error(f"HTTP {response.status_code}: {response.text}")
             return None
         return Image.open(io.BytesIO(response.content))
 
-    @staticmethod
-    def free(server_url: str = None):
-        url = server_url if server_url else COMFYUI_URL
+    async def get_view(self, subfolder: str, filename: str):
+        params = {"subfolder": subfolder, "filename": filename}
+        return await self.client.get("view", params=params)
+
+    async def get_queue(self, retries: int = None) -> tuple[list[str], list[str]] | None:
+        # 実行中と待機中の prompt_id のリスト、取得できなければ None
+        response = await self.client.get("queue", retries=retries)
+        if response.status_code != 200:
+            logger.error(f"HTTP {response.status_code}: {response.text}")
+            return None
+        queue = response.json()
+        running = [item[1] for item in queue.get("queue_running", [])]
+        pending = [item[1] for item in queue.get("queue_pending", [])]
+        return running, pending
+
+    async def delete_queue(self, prompt_ids: list[str]):
+        # 待機中のプロンプトをキューから削除
+        response = await self.client.post("queue", json={"delete": prompt_ids})
+        return response
+
+    async def interrupt(self, prompt_id: str = None):
+        # 実行中のプロンプトを中断、prompt_id を指定するとそれが実行中の場合のみ
+        data = {"prompt_id": prompt_id} if prompt_id else {}
+        response = await self.client.post("interrupt", json=data)
+        return response
+
+    async def free(self):
         data = {
             "unload_models": True,
             "free_memory": True,
         }
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(f"{url}free", headers=headers, json=data)
+        response = await self.client.post("free", json=data)
         return response
 
     @staticmethod
@@ -109,61 +266,63 @@ class ComfyuiBridge:
         negative: str,
         lora: SdLoraYaml,
         image_size: tuple[int, int],
+        seed: int = None,
+        batch_size: int = 1,
     ) -> any:
-        with importlib.resources.open_text(
-            "fm_mcp_comfyui_bridge.config.workflow", "SDXL_LoRA_Base_API.json"
-        ) as f:
-            prompt_path = json.load(f)
+        template = get_template(COMFYUI_WORKFLOW_DEFAULT, COMFYUI_WORKFLOW_PATHS)
         # パラメータ埋め込み(workflowによって異なる処理)
-        prompt_path[COMFYUI_NODE_CHECKPOINT]["inputs"]["ckpt_name"] = lora.checkpoint
-        prompt_path[COMFYUI_NODE_PROMPT]["inputs"]["text"] = prompt
-        prompt_path[COMFYUI_NODE_NEGATIVE]["inputs"]["text"] = negative
-        prompt_path[COMFYUI_NODE_SEED]["inputs"]["noise_seed"] = random.randint(
-            1, 10000000000
-        )
-        prompt_path[COMFYUI_NODE_SIZE]["inputs"]["width"] = image_size[0]
-        prompt_path[COMFYUI_NODE_SIZE]["inputs"]["height"] = image_size[1]
-        prompt_path[COMFYUI_NODE_LORA_CHECKPOINT]["inputs"]["lora_name"] = lora.model
-        prompt_path[COMFYUI_NODE_LORA_CHECKPOINT]["inputs"]["strength_model"] = (
-            lora.strength
-        )
-        prompt_path[COMFYUI_NODE_LORA_CHECKPOINT]["inputs"]["strength_clip"] = (
-            lora.strength
-        )
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        prompt_path[COMFYUI_NODE_OUTPUT]["inputs"]["filename_prefix"] = (
-            f"{current_date}/Bridge"
-        )
+        values = {
+            "checkpoint": lora.checkpoint,
+            "prompt": prompt,
+            "negative": negative,
+            "seed": seed if seed is not None else random.randint(1, 10000000000),
+            "width": image_size[0],
+            "height": image_size[1],
+            "batch_size": batch_size,
+            "lora_name": lora.model,
+            "lora_strength_model": lora.strength,
+            "lora_strength_clip": lora.strength,
+            "filename_prefix": f"{current_date}/Bridge",
+        }
         # lora, prediction
         if not lora.lora_enabled:
-            prompt_path[COMFYUI_NODE_LORA_CHECKPOINT]["inputs"]["strength_model"] = 0
-            prompt_path[COMFYUI_NODE_LORA_CHECKPOINT]["inputs"]["strength_clip"] = 0
-        if lora.vpred:
-            prompt_path[COMFYUI_NODE_SAMPLING_DISCRETE]["inputs"]["sampling"] = (
-                "v_prediction"
-            )
-        else:
-            prompt_path[COMFYUI_NODE_SAMPLING_DISCRETE]["inputs"]["sampling"] = "eps"
+            values["lora_strength_model"] = 0
+            values["lora_strength_clip"] = 0
+        values["sampling"] = "v_prediction" if lora.vpred else "eps"
         if lora.steps is not None:
-            prompt_path[COMFYUI_NODE_SAMPLING_STEPS]["inputs"]["steps"] = lora.steps
+            values["steps"] = lora.steps
         if lora.cfg is not None:
-            prompt_path[COMFYUI_NODE_SAMPLING_CFG]["inputs"]["cfg"] = lora.cfg
-        return prompt_path
+            values["cfg"] = lora.cfg
+        return template.build(values)
 
     @staticmethod
-    def t2i_custom_request_build(prompt: str, custom_config: any) -> any:
-        with importlib.resources.open_text(
-            "fm_mcp_comfyui_bridge.config.workflow", custom_config["workflow"]
-        ) as f:
-            prompt_path = json.load(f)
-        # text prompt
-        tree = custom_config["text_prompt"].split(":")
-        prompt_path[tree[0]][tree[1]][tree[2]] = prompt
-        # seed
-        tree = custom_config["seed"].split(":")
-        prompt_path[tree[0]][tree[1]][tree[2]] = random.randint(1, 10000000000)
-        # output prefix
+    def custom_template(custom_config: any) -> WorkflowTemplate:
+        # custom.yaml で指定された埋め込み先でテンプレートを取得
+        paths = {
+            "prompt": custom_config["text_prompt"],
+            "seed": custom_config["seed"],
+            "filename_prefix": custom_config["filename_prefix"],
+        }
+        if "batch_size" in custom_config:
+            paths["batch_size"] = custom_config["batch_size"]
+        return get_template(custom_config["workflow"], paths)
+
+    @staticmethod
+    def t2i_custom_request_build(
+        prompt: str, custom_config: any, seed: int = None, batch_size: int = 1
+    ) -> any:
+        template = ComfyuiBridge.custom_template(custom_config)
         current_date = datetime.datetime.now().strftime("%Y-%m-%d")
-        tree = custom_config["filename_prefix"].split(":")
-        prompt_path[tree[0]][tree[1]][tree[2]] = f"{current_date}/Bridge"
-        return prompt_path
+        values = {
+            # text prompt
+            "prompt": prompt,
+            # seed
+            "seed": seed if seed is not None else random.randint(1, 10000000000),
+            # output prefix
+            "filename_prefix": f"{current_date}/Bridge",
+        }
+        # batch size (custom.yaml に場所の指定がある場合のみ)
+        if "batch_size" in template.paths:
+            values["batch_size"] = batch_size
+        return template.build(values)
@@ -0,0 +1,63 @@
+import threading
+from pathlib import Path
+from types import MappingProxyType
+
+import yaml
+
+
+def freeze(value: any) -> any:
+    # dict は読み取り専用の MappingProxyType に、list は tuple にする
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class ConfigStore:
+    """
+    config ディレクトリの YAML ファイルを読み込んで保持するストア。
+
+    ファイルごとに一度だけ読み込み、更新時刻かサイズが変わったときだけ
+    読み直すので、サーバーを再起動せずに設定の変更が反映される。
+    get が返すのは書き換えできないスナップショットで、読み直しの後も
+    それまでに渡したスナップショットは変わらない。
+    """
+
+    def __init__(self, config_dir: str | Path):
+        self.config_dir = Path(config_dir)
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[tuple, any]] = {}
+
+    def path(self, name: str) -> Path:
+        return self.config_dir / name
+
+    def get(self, name: str, required: bool = False) -> any:
+        # ファイルがなければ None (required なら FileNotFoundError)
+        path = self.path(name)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self._entries.pop(name, None)
+            if required:
+                raise
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != stamp:
+                with open(path, "r", encoding="utf-8") as file:
+                    entry = (stamp, freeze(yaml.safe_load(file)))
+                self._entries[name] = entry
+        return entry[1]
+
+    def invalidate(self, name: str = None):
+        # 次の get で読み直させる、name を省略するとすべて
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+import httpx
+
+# default config value
+## タイムアウト(秒)
+HTTP_TIMEOUT_CONNECT = 5.0
+HTTP_TIMEOUT_READ = 60.0
+## コネクションプール
+HTTP_MAX_CONNECTIONS = 10
+## リトライ回数とバックオフ(秒、リトライごとに倍)
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+## リトライ対象のステータスコード
+HTTP_RETRY_STATUS = (502, 503, 504)
+
+# リクエストごとの INFO ログは MCP サーバーのログを埋めてしまうので抑制
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class HttpClient:
+    """
+    ComfyUI との通信で共有する非同期 HTTP クライアント。
+
+    keep-alive でコネクションを使い回し、接続エラーや 5xx は
+    指数バックオフで上限回数までリトライする。
+    POST は二重送信を避けるため、リクエストが送られていないことが確実な
+    接続失敗の場合のみリトライする。
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout_connect: float = HTTP_TIMEOUT_CONNECT,
+        timeout_read: float = HTTP_TIMEOUT_READ,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout_read, connect=timeout_connect),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+    async def request(
+        self, method: str, path: str, retries: int = None, **kwargs
+    ) -> httpx.Response:
+        # retries を指定するとそのリクエストだけリトライ回数を変える
+        retries = self.retries if retries is None else retries
+        idempotent = method.upper() in ("GET", "HEAD", "OPTIONS")
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, path, **kwargs)
+                if (
+                    not idempotent
+                    or response.status_code not in HTTP_RETRY_STATUS
+                    or attempt >= retries
+                ):
+                    return response
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if attempt >= retries:
+                    raise
+            except httpx.TransportError:
+                if not idempotent or attempt >= retries:
+                    raise
+            await asyncio.sleep(self.backoff * (2**attempt))
+            attempt += 1
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def close(self):
+        await self.client.aclose()
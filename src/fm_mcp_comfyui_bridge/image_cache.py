@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.image_transcode import TRANSCODE_QUALITY, transcode
+
+# 標準出力は MCP の stdio トランスポートが使うので、診断メッセージはログに出す
+logger = logging.getLogger(__name__)
+
+# default config value
+## メモリに保持する画像の合計サイズ(MB)
+IMAGE_CACHE_MAX_MB = 256
+## ディスクキャッシュの合計サイズ(MB)
+IMAGE_CACHE_DISK_MAX_MB = 2048
+## 縮小・変換した画像をメモリに保持する合計サイズ(MB)
+IMAGE_CACHE_VARIANT_MAX_MB = 64
+
+
+class ImageCache:
+    """
+    ComfyUI の /view から取得した画像バイト列の LRU キャッシュ。
+
+    (server, subfolder, filename) をキーに合計 max_mb までメモリに保持する。
+    disk_dir を指定するとメモリから追い出した画像をディスクに書き出し、
+    次に要求されたときはそこから読み戻す。
+    同じ画像を同時に要求された場合、取得は 1 回だけ行う。
+    variant で縮小・変換した画像は、変換の指定ごとに別枠で
+    合計 variant_max_mb までメモリに保持する。
+    イベントループのスレッドからのみ使う。
+    """
+
+    def __init__(
+        self,
+        max_mb: float = IMAGE_CACHE_MAX_MB,
+        disk_dir: str = None,
+        disk_max_mb: float = IMAGE_CACHE_DISK_MAX_MB,
+        variant_max_mb: float = IMAGE_CACHE_VARIANT_MAX_MB,
+    ):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: OrderedDict[tuple, bytes] = OrderedDict()
+        self._size = 0
+        self._fetch_locks: dict[tuple, asyncio.Lock] = {}
+        self.variant_max_bytes = int(variant_max_mb * 1024 * 1024)
+        self._variants: OrderedDict[tuple, bytes] = OrderedDict()
+        self._variant_size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.variant_hits = 0
+        self.variant_misses = 0
+
+    async def get(
+        self, bridge: ComfyuiBridge, subfolder: str, filename: str
+    ) -> bytes | None:
+        key = (bridge.server_url, subfolder, filename)
+        data = self._lookup(key)
+        if data is not None:
+            self.hits += 1
+            return data
+        fetch_lock = self._fetch_locks.setdefault(key, asyncio.Lock())
+        try:
+            async with fetch_lock:
+                data = self._lookup(key)
+                if data is not None:
+                    self.hits += 1
+                    return data
+                data = await asyncio.to_thread(self._read_disk, key)
+                if data is not None:
+                    self.disk_hits += 1
+                else:
+                    response = await bridge.get_view(subfolder, filename)
+                    if response.status_code != 200:
+                        logger.error(
+                            f"failed to fetch {subfolder}/{filename}: "
+                            f"{response.status_code} {response.text}"
+                        )
+                        return None
+                    data = response.content
+                    self.misses += 1
+                evicted = self._store(key, data)
+                if evicted:
+                    await asyncio.to_thread(self._write_disk, evicted)
+                return data
+        finally:
+            self._fetch_locks.pop(key, None)
+
+    async def variant(
+        self,
+        bridge: ComfyuiBridge,
+        subfolder: str,
+        filename: str,
+        max_side: int | None = None,
+        format: str = "png",
+        quality: int = TRANSCODE_QUALITY,
+    ) -> bytes | None:
+        # 縮小も形式の変更もなければ元の画像をそのまま返す
+        if not max_side and format == "png":
+            return await self.get(bridge, subfolder, filename)
+        if format == "png":
+            quality = None
+        key = (bridge.server_url, subfolder, filename, max_side, format, quality)
+        data = self._lookup_variant(key)
+        if data is not None:
+            self.variant_hits += 1
+            return data
+        fetch_lock = self._fetch_locks.setdefault(key, asyncio.Lock())
+        try:
+            async with fetch_lock:
+                data = self._lookup_variant(key)
+                if data is not None:
+                    self.variant_hits += 1
+                    return data
+                original = await self.get(bridge, subfolder, filename)
+                if original is None:
+                    return None
+                data = await asyncio.to_thread(
+                    transcode, original, max_side, format, quality
+                )
+                self.variant_misses += 1
+                self._store_variant(key, data)
+                return data
+        finally:
+            self._fetch_locks.pop(key, None)
+
+    def _lookup_variant(self, key: tuple) -> bytes | None:
+        data = self._variants.get(key)
+        if data is not None:
+            self._variants.move_to_end(key)
+        return data
+
+    def _store_variant(self, key: tuple, data: bytes):
+        if len(data) > self.variant_max_bytes or key in self._variants:
+            return
+        self._variants[key] = data
+        self._variant_size += len(data)
+        while self._variant_size > self.variant_max_bytes:
+            _, old_data = self._variants.popitem(last=False)
+            self._variant_size -= len(old_data)
+
+    def _lookup(self, key: tuple) -> bytes | None:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def _store(self, key: tuple, data: bytes) -> list[tuple[tuple, bytes]]:
+        # 追い出したエントリを返す
+        if len(data) > self.max_bytes or key in self._entries:
+            return []
+        evicted = []
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            old_key, old_data = self._entries.popitem(last=False)
+            self._size -= len(old_data)
+            evicted.append((old_key, old_data))
+        return evicted
+
+    def _disk_path(self, key: tuple) -> Path:
+        name = hashlib.sha256("\0".join(key).encode("utf-8")).hexdigest()
+        return self.disk_dir / f"{name}{Path(key[2]).suffix}"
+
+    def _read_disk(self, key: tuple) -> bytes | None:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, entries: list[tuple[tuple, bytes]]):
+        if not self.disk_dir:
+            return
+        for key, data in entries:
+            path = self._disk_path(key)
+            if path.exists():
+                continue
+            tmp_path = path.with_suffix(path.suffix + ".tmp")
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        self._prune_disk()
+
+    def _prune_disk(self):
+        # 古いファイルから消してディスク使用量を上限内に収める
+        files = [p for p in self.disk_dir.iterdir() if p.is_file()]
+        stats = {p: p.stat() for p in files}
+        total = sum(s.st_size for s in stats.values())
+        for path in sorted(files, key=lambda p: stats[p].st_mtime):
+            if total <= self.disk_max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= stats[path].st_size
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+        self._variants.clear()
+        self._variant_size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "variants": len(self._variants),
+            "variant_bytes": self._variant_size,
+            "variant_max_bytes": self.variant_max_bytes,
+            "variant_hits": self.variant_hits,
+            "variant_misses": self.variant_misses,
+        }
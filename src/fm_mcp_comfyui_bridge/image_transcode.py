@@ -0,0 +1,71 @@
+import io
+
+from PIL import Image
+
+# default config value
+## 変換できる形式
+TRANSCODE_FORMATS = ("png", "webp", "jpeg")
+## webp / jpeg の品質
+TRANSCODE_QUALITY = 85
+
+
+def normalize_format(format: str | None) -> str | None:
+    # 対応していない形式なら None
+    format = (format or "png").lower()
+    if format == "jpg":
+        format = "jpeg"
+    return format if format in TRANSCODE_FORMATS else None
+
+
+def decode(
+    data: bytes, max_side: int | None = None, opaque: bool = False
+) -> Image.Image:
+    # 長辺 max_side 以下に縮小して読み込む、opaque なら透過を白背景に合成する
+    with Image.open(io.BytesIO(data)) as image:
+        if max_side and max(image.size) > max_side and image.format == "JPEG":
+            # JPEG はデコード時に 1/2^n で読み込んで縮小を軽くする
+            image.draft(image.mode, (max_side, max_side))
+        image.load()
+        return fit(image, max_side, opaque)
+
+
+def fit(image: Image.Image, max_side: int | None = None, opaque: bool = False) -> Image.Image:
+    # 読み込み済みの画像を decode と同じように縮小・変換する、image 自体は書き換えない
+    if max_side and max(image.size) > max_side:
+        scale = max_side / max(image.size)
+        size = tuple(max(1, round(side * scale)) for side in image.size)
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    if opaque and image.mode != "RGB":
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+        image = image.convert("RGBA")
+    return image
+
+
+def encode(image: Image.Image, format: str = "png", quality: int = TRANSCODE_QUALITY) -> bytes:
+    buffer = io.BytesIO()
+    if format == "png":
+        image.save(buffer, format="PNG")
+    elif format == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def transcode(
+    data: bytes,
+    max_side: int | None = None,
+    format: str = "png",
+    quality: int = TRANSCODE_QUALITY,
+) -> bytes:
+    """
+    画像を長辺 max_side 以下に縮小して format でエンコードし直す。
+
+    縮小しない場合でもエンコードし直すので、ComfyUI が PNG に埋め込む
+    workflow のメタデータは取り除かれる。JPEG は透過を持てないので白背景に合成する。
+    CPU を使うのでイベントループのスレッドからは呼ばないこと。
+    """
+    return encode(decode(data, max_side, opaque=format == "jpeg"), format, quality)
@@ -0,0 +1,581 @@
+"""
+ComfyUI の出力画像にまとめてタグとキャプションを付けるコマンド。
+
+ディレクトリ以下の画像、または ComfyUI の /history にある出力画像を順に読み込み、
+デコード、WD14Tagger のバッチ推論、Ollama のキャプション生成をパイプラインで
+重ねて実行する。結果は 1 画像 1 レコードで JSONL または SQLite に追記し、
+次回の実行では内容の SHA-256 が記録済みの画像を飛ばすので、中断しても続きから再開できる。
+
+    fm-mcp-comfyui-bridge-index /path/to/ComfyUI/output -o index.jsonl
+    fm-mcp-comfyui-bridge-index --history -o index.sqlite3 --caption-rate 0.5
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sqlite3
+import sys
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+
+from PIL import Image
+
+from fm_mcp_comfyui_bridge.comfyui_bridge import COMFYUI_URL
+from fm_mcp_comfyui_bridge.image_transcode import decode
+from fm_mcp_comfyui_bridge.services import (
+    VISION_PROMPT,
+    create_bridge,
+    get_caption_settings,
+    get_captioner,
+    get_comfyui_config,
+    get_ollama_config,
+    get_tagger_model_repo,
+    load_ollama_caption,
+    load_tagger,
+    tagger_config,
+)
+
+# default config value
+## 索引を付ける画像の拡張子
+INDEX_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+## タグの閾値 (get_tag と同じ)
+INDEX_TAG_THRESHOLD = 0.25
+## 並列にデコードするスレッド数
+INDEX_DECODE_WORKERS = 4
+## /history を 1 回に取得するプロンプト数
+INDEX_HISTORY_PAGE_SIZE = 100
+## 進捗を表示する間隔(秒)
+INDEX_PROGRESS_INTERVAL = 5.0
+
+
+@dataclass
+class IndexItem:
+    subfolder: str
+    filename: str
+    data: bytes = None
+    sha256: str = None
+    image: Image.Image = None
+    tags: str | None = None
+    caption: str | None = None
+
+    @property
+    def source(self) -> str:
+        return f"{self.subfolder}/{self.filename}" if self.subfolder else self.filename
+
+    def record(self) -> dict:
+        return {
+            "sha256": self.sha256,
+            "subfolder": self.subfolder,
+            "filename": self.filename,
+            "width": self.image.width,
+            "height": self.image.height,
+            "tags": self.tags,
+            "caption": self.caption,
+            "indexed_at": time.time(),
+        }
+
+
+class JsonlIndex:
+    """1 行 1 レコードの JSONL。途中で書きかけになった最後の行は切り詰める"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hashes = set()
+        self.sources = set()
+        if path.exists():
+            # 改行で終わった行の末尾の位置
+            end = 0
+            with open(path, "rb") as file:
+                for line in file:
+                    if not line.endswith(b"\n"):
+                        break
+                    end += len(line)
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.hashes.add(record["sha256"])
+                    self.sources.add(IndexItem(record["subfolder"], record["filename"]).source)
+            if end < path.stat().st_size:
+                # 書きかけの行に続けて追記すると次のレコードまで壊れるので消す
+                with open(path, "r+b") as file:
+                    file.truncate(end)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def add(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        self.hashes.add(record["sha256"])
+
+    def close(self):
+        self._file.close()
+
+
+class SqliteIndex:
+    """sha256 を主キーにした SQLite のテーブル"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " sha256 TEXT PRIMARY KEY,"
+            " subfolder TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " width INTEGER,"
+            " height INTEGER,"
+            " tags TEXT,"
+            " caption TEXT,"
+            " indexed_at REAL NOT NULL)"
+        )
+        rows = self._conn.execute("SELECT sha256, subfolder, filename FROM images")
+        self.hashes = set()
+        self.sources = set()
+        for sha256, subfolder, filename in rows:
+            self.hashes.add(sha256)
+            self.sources.add(IndexItem(subfolder, filename).source)
+
+    def add(self, record: dict):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO images"
+            " (sha256, subfolder, filename, width, height, tags, caption, indexed_at)"
+            " VALUES (:sha256, :subfolder, :filename, :width, :height, :tags, :caption,"
+            " :indexed_at)",
+            record,
+        )
+        self.hashes.add(record["sha256"])
+
+    def close(self):
+        self._conn.close()
+
+
+def open_index(path: str) -> JsonlIndex | SqliteIndex:
+    # 拡張子が .jsonl なら JSONL、それ以外は SQLite
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return JsonlIndex(path) if path.suffix == ".jsonl" else SqliteIndex(path)
+
+
+@dataclass
+class IndexStats:
+    found: int = 0
+    skipped: int = 0
+    failed: int = 0
+    indexed: int = 0
+    tag_batches: int = 0
+    tagged: int = 0
+    captioned: int = 0
+    # 段階ごとの処理時間の合計(秒)、並列に実行した分は重複して数える
+    seconds: dict[str, float] = field(
+        default_factory=lambda: {"load": 0.0, "decode": 0.0, "tag": 0.0, "caption": 0.0}
+    )
+    start: float = field(default_factory=time.perf_counter)
+    last_report: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def progress(self):
+        now = time.perf_counter()
+        if now - self.last_report >= INDEX_PROGRESS_INTERVAL:
+            self.last_report = now
+            print(
+                f"indexed {self.indexed}, skipped {self.skipped}, failed {self.failed}"
+                f" ({self.indexed / self.elapsed:.2f} img/s)"
+            )
+
+    def report(self, captioner=None):
+        elapsed = self.elapsed
+        print(
+            f"indexed {self.indexed} images in {elapsed:.1f}s"
+            f" ({self.indexed / elapsed if elapsed else 0.0:.2f} img/s)"
+        )
+        print(f"found {self.found}, skipped {self.skipped} (already indexed), failed {self.failed}")
+        stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.seconds.items())
+        print(f"stage time: {stages}")
+        if self.tag_batches:
+            print(
+                f"tag batches: {self.tag_batches},"
+                f" mean size {self.tagged / self.tag_batches:.1f}"
+            )
+        if captioner is not None and self.captioned:
+            stats = captioner.stats()
+            means = ", ".join(
+                f"{name} {seconds:.2f}s" for name, seconds in stats["mean_seconds"].items()
+            )
+            line = f"caption: {stats['count']} generated, mean {means}"
+            if stats["mean_ttft_seconds"] is not None:
+                line += f", ttft {stats['mean_ttft_seconds']:.2f}s"
+            if stats["tokens_per_second"] is not None:
+                line += f", {stats['tokens_per_second']:.1f} tokens/s"
+            print(line)
+
+
+class RateLimiter:
+    """rate 件/秒を超えないよう呼び出しの間隔を空ける、rate が 0 なら制限しない"""
+
+    def __init__(self, rate: float = 0.0):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+
+Loader = Callable[[], Awaitable[bytes | None]]
+
+
+async def walk_directory(root: Path) -> AsyncIterator[tuple[str, str, Loader]]:
+    # root 以下の画像を (subfolder, filename, 読み込み関数) で返す
+    for path in sorted(root.rglob("*")):
+        if path.suffix.lower() not in INDEX_IMAGE_SUFFIXES or not path.is_file():
+            continue
+        subfolder = path.parent.relative_to(root).as_posix()
+        yield ("" if subfolder == "." else subfolder), path.name, partial(
+            asyncio.to_thread, path.read_bytes
+        )
+
+
+async def walk_history(
+    url: str, page_size: int = INDEX_HISTORY_PAGE_SIZE
+) -> AsyncIterator[tuple[str, str, Loader]]:
+    # /history を古い順にページ単位で取得し、出力ノードの画像を返す
+    bridge = create_bridge(url)
+
+    async def load(subfolder: str, filename: str) -> bytes | None:
+        response = await bridge.get_view(subfolder, filename)
+        if response.status_code != 200:
+            print(f"Error: {response.status_code} {subfolder}/{filename}")
+            return None
+        return response.content
+
+    try:
+        offset = 0
+        while True:
+            histories = await bridge.get_histories(page_size, offset)
+            if not histories:
+                break
+            for history in histories.values():
+                for output in (history.get("outputs") or {}).values():
+                    for image in output.get("images", []):
+                        # プレビューなどの一時ファイルは対象外
+                        if image.get("type", "output") != "output":
+                            continue
+                        subfolder = image.get("subfolder", "")
+                        filename = image["filename"]
+                        yield subfolder, filename, partial(load, subfolder, filename)
+            offset += len(histories)
+    finally:
+        await bridge.close()
+
+
+class Indexer:
+    """
+    読み込み → デコード → タグ解析 → キャプション生成 → 書き込みのパイプライン。
+
+    段階の間は上限付きのキューでつなぎ、デコードは decode_workers 個のスレッド、
+    タグ解析は 1 つのスレッドで溜まっている画像を最大 batch_size 枚ずつまとめて推論し、
+    キャプションは Ollama の max_concurrency 件まで同時に生成する。
+    """
+
+    def __init__(
+        self,
+        index: JsonlIndex | SqliteIndex,
+        tags: bool = True,
+        caption: bool = True,
+        threshold: float = INDEX_TAG_THRESHOLD,
+        batch_size: int = None,
+        decode_workers: int = INDEX_DECODE_WORKERS,
+        caption_rate: float = 0.0,
+        limit: int = None,
+        skip_known_sources: bool = False,
+    ):
+        self.index = index
+        self.tags = tags
+        self.caption = caption
+        self.threshold = threshold
+        self.batch_size = batch_size or tagger_config.get("max_batch_size", 8)
+        self.decode_workers = decode_workers
+        self.limiter = RateLimiter(caption_rate)
+        self.limit = limit
+        # /history は同じ名前のファイルを上書きしないので、記録済みの名前はダウンロードしない
+        self.skip_known_sources = skip_known_sources
+        self.stats = IndexStats()
+        self.tagger = None
+        self.captioner = None
+        self.caption_settings = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="indexer")
+        # tag_many の前処理のスレッド、バッチごとに作らず実行中は使い回す
+        self._preprocess_executor = None
+
+    async def _timed(self, stage: str, coroutine):
+        start = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            self.stats.seconds[stage] += time.perf_counter() - start
+
+    def _write(self, item: IndexItem):
+        self.index.add(item.record())
+        self.stats.indexed += 1
+        self.stats.progress()
+
+    async def _produce(self, sources: AsyncIterator, loaded: asyncio.Queue):
+        seen = set()
+        queued = 0
+        async for subfolder, filename, load in sources:
+            if self.limit is not None and queued >= self.limit:
+                break
+            item = IndexItem(subfolder, filename)
+            self.stats.found += 1
+            if self.skip_known_sources and item.source in self.index.sources:
+                self.stats.skipped += 1
+                continue
+            try:
+                item.data = await self._timed("load", load())
+            except Exception as e:
+                print(f"Error: failed to load {item.source}: {e}")
+                item.data = None
+            if item.data is None:
+                self.stats.failed += 1
+                continue
+            item.sha256 = hashlib.sha256(item.data).hexdigest()
+            # 記録済みの画像と、今回すでに読んだ同じ内容の画像は飛ばす
+            if item.sha256 in self.index.hashes or item.sha256 in seen:
+                self.stats.skipped += 1
+                continue
+            seen.add(item.sha256)
+            queued += 1
+            await loaded.put(item)
+
+    async def _decode(self, loaded: asyncio.Queue, decoded: asyncio.Queue):
+        while (item := await loaded.get()) is not None:
+            try:
+                item.image = await self._timed("decode", asyncio.to_thread(decode, item.data))
+            except Exception as e:
+                print(f"Error: failed to decode {item.source}: {e}")
+                self.stats.failed += 1
+                continue
+            await decoded.put(item)
+
+    async def _tag(self, decoded: asyncio.Queue, captions: asyncio.Queue | None):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            item = await decoded.get()
+            if item is None:
+                break
+            # 推論中に溜まった画像をまとめて 1 回の推論にする
+            batch = [item]
+            while len(batch) < self.batch_size and not decoded.empty():
+                item = decoded.get_nowait()
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            if self.tags:
+                results = await self._timed(
+                    "tag",
+                    loop.run_in_executor(
+                        self._executor,
+                        partial(
+                            self.tagger.tag_many,
+                            [item.image for item in batch],
+                            threshold=self.threshold,
+                            max_batch_size=self.batch_size,
+                            executor=self._preprocess_executor,
+                        ),
+                    ),
+                )
+                self.stats.tag_batches += 1
+                self.stats.tagged += len(batch)
+            else:
+                results = [None] * len(batch)
+            for item, tags in zip(batch, results):
+                if self.tags and tags is None:
+                    self.stats.failed += 1
+                    continue
+                item.tags = tags
+                if captions is not None:
+                    await captions.put(item)
+                else:
+                    self._write(item)
+
+    async def _caption(self, captions: asyncio.Queue):
+        while (item := await captions.get()) is not None:
+            await self.limiter.wait()
+            item.caption = await self._timed(
+                "caption",
+                self.captioner.caption(
+                    item.data,
+                    prompt=VISION_PROMPT,
+                    decoded=item.image,
+                    settings=self.caption_settings,
+                ),
+            )
+            if item.caption is None:
+                self.stats.failed += 1
+                continue
+            self.stats.captioned += 1
+            self._write(item)
+
+    async def run(self, sources: AsyncIterator):
+        loop = asyncio.get_running_loop()
+        if self.tags:
+            Tagger = await loop.run_in_executor(self._executor, load_tagger)
+            self.tagger = await loop.run_in_executor(
+                self._executor, Tagger.get_tagger, get_tagger_model_repo()
+            )
+            self._preprocess_executor = ThreadPoolExecutor(
+                max_workers=Tagger.TAGGER_PREPROCESS_WORKERS,
+                thread_name_prefix="indexer-preprocess",
+            )
+        caption_workers = 0
+        if self.caption:
+            await asyncio.to_thread(load_ollama_caption)
+            self.captioner = get_captioner()
+            self.caption_settings = get_caption_settings()
+            caption_workers = self.captioner.max_concurrency
+        # キューの上限でデコード済みの画像をメモリに溜めすぎないようにする
+        loaded = asyncio.Queue(maxsize=self.decode_workers * 2)
+        decoded = asyncio.Queue(maxsize=self.batch_size * 2)
+        captions = asyncio.Queue(maxsize=caption_workers * 2) if self.caption else None
+
+        async def finish(workers: list[asyncio.Task], queue: asyncio.Queue, count: int):
+            # 前の段階が終わったら次の段階のワーカーの数だけ終了の印を入れる
+            await asyncio.gather(*workers)
+            for _ in range(count):
+                await queue.put(None)
+
+        producer = asyncio.create_task(self._produce(sources, loaded))
+        decoders = [
+            asyncio.create_task(self._decode(loaded, decoded))
+            for _ in range(self.decode_workers)
+        ]
+        tagger = asyncio.create_task(self._tag(decoded, captions))
+        stages = [
+            finish([producer], loaded, self.decode_workers),
+            finish(decoders, decoded, 1),
+        ]
+        if captions is not None:
+            captioners = [
+                asyncio.create_task(self._caption(captions)) for _ in range(caption_workers)
+            ]
+            stages += [finish([tagger], captions, caption_workers), *captioners]
+        else:
+            stages.append(tagger)
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            if self._preprocess_executor is not None:
+                self._preprocess_executor.shutdown(wait=False, cancel_futures=True)
+            self.stats.report(self.captioner)
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="fm-mcp-comfyui-bridge-index",
+        description="ComfyUI の出力画像にまとめてタグとキャプションを付ける",
+    )
+    parser.add_argument("directory", nargs="?", help="画像を探すディレクトリ (ComfyUI の output など)")
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="ディレクトリの代わりに ComfyUI の /history にある出力画像を対象にする",
+    )
+    parser.add_argument(
+        "--comfyui",
+        action="append",
+        help="--history で使う ComfyUI の URL、未指定時は comfyui.yaml の backends",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="index.jsonl",
+        help="出力先、拡張子が .jsonl なら JSONL、それ以外は SQLite (既定: index.jsonl)",
+    )
+    parser.add_argument("--no-tags", action="store_true", help="タグ解析を行わない")
+    parser.add_argument("--no-caption", action="store_true", help="キャプション生成を行わない")
+    parser.add_argument("--threshold", type=float, default=INDEX_TAG_THRESHOLD, help="タグの閾値")
+    parser.add_argument(
+        "--batch-size", type=int, help="一度の推論にまとめる最大画像数、未指定時は tagger.yaml"
+    )
+    parser.add_argument(
+        "--decode-workers", type=int, default=INDEX_DECODE_WORKERS, help="デコードのスレッド数"
+    )
+    parser.add_argument(
+        "--caption-rate",
+        type=float,
+        default=0.0,
+        help="1 秒あたりに開始するキャプション生成の上限、0 で制限しない",
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=INDEX_HISTORY_PAGE_SIZE, help="/history の 1 ページの件数"
+    )
+    parser.add_argument("--limit", type=int, help="今回新しく処理する画像数の上限")
+    args = parser.parse_args(argv)
+    if bool(args.directory) == args.history:
+        parser.error("directory か --history のどちらか一方を指定してください")
+    if args.no_tags and args.no_caption:
+        parser.error("--no-tags と --no-caption は同時に指定できません")
+    return args
+
+
+async def run(args: argparse.Namespace):
+    index = open_index(args.output)
+    if args.history:
+        urls = args.comfyui or get_comfyui_config().get("backends") or [COMFYUI_URL]
+
+        async def sources():
+            for url in urls:
+                async for source in walk_history(url.rstrip("/") + "/", args.page_size):
+                    yield source
+
+        sources = sources()
+    else:
+        sources = walk_directory(Path(args.directory))
+    indexer = Indexer(
+        index,
+        tags=not args.no_tags,
+        caption=not args.no_caption,
+        threshold=args.threshold,
+        batch_size=args.batch_size,
+        decode_workers=args.decode_workers,
+        caption_rate=args.caption_rate,
+        limit=args.limit,
+        skip_known_sources=args.history,
+    )
+    try:
+        await indexer.run(sources)
+    finally:
+        index.close()
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    if not args.no_caption and get_ollama_config() is None:
+        print("Error: ollama.yaml がないのでキャプションを生成できません (--no-caption で省略)")
+        sys.exit(1)
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print("中断しました。同じコマンドを実行すると続きから再開します。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+
+import httpx
+
+from fm_mcp_comfyui_bridge.backend_pool import Backend, BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.scheduler import (
+    SCHEDULER_MAX_INFLIGHT,
+    ModelAffinityScheduler,
+)
+
+# default config value
+## 完了したジョブを保持する件数
+JOB_TABLE_MAX_FINISHED = 256
+## 画像の取得先として覚えておく生成画像の件数
+JOB_TABLE_MAX_IMAGES = 4096
+## 進捗を通知する最短間隔(秒)
+PROGRESS_MIN_INTERVAL = 0.5
+## 待機中のジョブのキューの位置を確認する間隔(秒)
+PROGRESS_QUEUE_INTERVAL = 2.0
+## ComfyUI のメモリ解放のタイミング
+## never: 解放しない / always: ジョブが終わるたび / idle: idle_seconds 秒ジョブが無ければ
+FREE_POLICY_NEVER = "never"
+FREE_POLICY_ALWAYS = "always"
+FREE_POLICY_IDLE = "idle"
+FREE_POLICY = FREE_POLICY_IDLE
+FREE_IDLE_SECONDS = 300.0
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+JOB_CANCELLED = "cancelled"
+JOB_FINISHED = (JOB_DONE, JOB_ERROR, JOB_CANCELLED)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    job_id: str
+    output_node: str
+    # (workflow, checkpoint, LoRA)
+    model: tuple | None = None
+    priority: int = 0
+    prompt_id: str | None = None
+    # 投入したバックエンド、history や /view はここに問い合わせる
+    backend: Backend | None = field(default=None, repr=False)
+    # スケジューラーの待ち行列にいる間だけ保持する workflow
+    workflow: dict | None = field(default=None, repr=False)
+    status: str = JOB_QUEUED
+    progress: int = 0
+    progress_max: int = 0
+    # 実行中のノードIDと、ノードIDごとの class_type
+    node: str | None = None
+    node_types: dict[str, str] = field(default_factory=dict, repr=False)
+    # 先に実行されるジョブの数 (待機中のみ)
+    queue_position: int | None = None
+    images: list[dict] = field(default_factory=list)
+    error: str | None = None
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    # 投入時にモデルが解放済み(ロードから始まる)だったか
+    cold: bool = False
+    task: asyncio.Task | None = field(default=None, repr=False)
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def on_event(self, type: str, data: dict):
+        # websocket の実行イベントで状態を更新する
+        match type:
+            case "execution_start" | "executing":
+                if self.status == JOB_QUEUED:
+                    self.status = JOB_RUNNING
+                    self.queue_position = None
+                if data.get("node") is not None:
+                    self.node = data["node"]
+            case "progress":
+                if self.status == JOB_QUEUED:
+                    self.status = JOB_RUNNING
+                    self.queue_position = None
+                self.node = data.get("node", self.node)
+                self.progress = data.get("value", 0)
+                self.progress_max = data.get("max", 0)
+
+    @property
+    def fraction(self) -> float:
+        # 進み具合 (0〜1)、ノードのステップ数しか分からないので目安
+        if self.status in JOB_FINISHED:
+            return 1.0
+        if self.status == JOB_RUNNING and self.progress_max:
+            return self.progress / self.progress_max
+        return 0.0
+
+    def progress_message(self) -> str:
+        if self.status == JOB_QUEUED:
+            if self.queue_position is None:
+                return "queued"
+            return f"queued ({self.queue_position} ahead)"
+        if self.status == JOB_RUNNING:
+            message = "running"
+            if self.node is not None:
+                node_type = self.node_types.get(self.node)
+                message += f" node {self.node}" + (f" ({node_type})" if node_type else "")
+            if self.progress_max:
+                message += f" step {self.progress}/{self.progress_max}"
+            return message
+        return self.status
+
+    @property
+    def bridge(self) -> ComfyuiBridge:
+        return self.backend.bridge
+
+    def status_dict(self) -> dict:
+        server_url = self.bridge.server_url if self.backend else None
+        return {
+            "job_id": self.job_id,
+            "server_url": server_url,
+            "status": self.status,
+            "progress": self.progress,
+            "progress_max": self.progress_max,
+            "urls": [
+                f"{server_url}view?subfolder={image['subfolder']}&filename={image['filename']}"
+                for image in self.images
+            ],
+            "images": self.images,
+            "error": self.error,
+        }
+
+
+class JobTable:
+    """
+    ComfyUI に投入した画像生成ジョブの表。
+
+    submit はプロンプトを送信したらすぐに Job を返し、完了待ちは
+    バックグラウンドのタスクで websocket のイベントを見ながら行う。
+    投入先は pool から選び、ジョブはそのバックエンドに固定する。
+    scheduler を渡すとジョブはすぐには送らずに待ち行列に入れ、ComfyUI の
+    キューにはバックエンドごとに max_inflight 件までしか送らない。
+    バックエンドが空いたら、そのバックエンドのモデルと同じジョブを優先して送る。
+    ComfyUI のメモリ解放はバックエンドごとに free_policy に従い、idle の場合は
+    ジョブが無い状態が free_idle_seconds 秒続いたら解放する。
+    完了したジョブは max_finished 件まで古いものから残す。
+    """
+
+    def __init__(
+        self,
+        pool: BackendPool,
+        max_finished: int = JOB_TABLE_MAX_FINISHED,
+        free_policy: str = FREE_POLICY,
+        free_idle_seconds: float = FREE_IDLE_SECONDS,
+        scheduler: ModelAffinityScheduler = None,
+        max_inflight: int = SCHEDULER_MAX_INFLIGHT,
+    ):
+        if free_policy not in (FREE_POLICY_NEVER, FREE_POLICY_ALWAYS, FREE_POLICY_IDLE):
+            raise ValueError(f"Unknown free policy: {free_policy}")
+        self.pool = pool
+        self.max_finished = max_finished
+        self.free_policy = free_policy
+        self.free_idle_seconds = free_idle_seconds
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        self._free_timers: dict[str, asyncio.Task] = {}
+        # 生成した画像がどのバックエンドにあるか
+        self._images: OrderedDict[tuple[str, str], Backend] = OrderedDict()
+        self._latency = {"cold": [0, 0.0], "warm": [0, 0.0]}
+        self.scheduler = scheduler
+        self.max_inflight = max_inflight
+        self._dispatch_lock = asyncio.Lock()
+        # 別のモデルに切り替えて投入した回数
+        self.swaps = 0
+
+    async def submit(
+        self, workflow: dict, output_node: str, model: tuple = None, priority: int = 0
+    ) -> Job | None:
+        # model は (workflow, checkpoint, LoRA) で、同じモデルが続くよう投入先や順番を選ぶ
+        # priority はスケジューラーがある場合のみ使い、大きいほど先に送る
+        job = Job(
+            job_id=uuid.uuid4().hex,
+            output_node=output_node,
+            model=model,
+            priority=priority,
+        )
+        if self.scheduler is None:
+            backend = await self.pool.acquire(model)
+            try:
+                sent = await self._send(job, workflow, backend)
+            finally:
+                self.pool.release(backend)
+            return job if sent else None
+        job.workflow = workflow
+        self._jobs[job.job_id] = job
+        self.scheduler.push(job, model, priority)
+        self.pool.start()
+        await self._dispatch()
+        return job
+
+    async def _send(self, job: Job, workflow: dict, backend: Backend) -> bool:
+        # 新しいジョブが来たら解放待ちのタイマーは取り消す
+        self._cancel_free_timer(backend)
+        # 完了イベントを受け取れるよう送信前に websocket を開いておく
+        client_id = uuid.uuid4().hex
+        ws = await backend.bridge.open_websocket(client_id)
+        prompt_id = None
+        try:
+            prompt_id = await backend.bridge.send_request(workflow, client_id=client_id)
+        finally:
+            # 送信に失敗したら (例外を含めて) websocket は使わない
+            if not prompt_id and ws is not None:
+                await ws.close()
+        if not prompt_id:
+            if not self.active(backend):
+                await self._release(backend)
+            return False
+        if job.status == JOB_CANCELLED:
+            # 送信中に取り消されたので、送ったプロンプトも ComfyUI から取り除く
+            if ws is not None:
+                await ws.close()
+            await self._abort(backend.bridge, prompt_id)
+            if not self.active(backend):
+                await self._release(backend)
+            return True
+        # 解放済みか、別のモデルに切り替わる場合はロードから始まる
+        if self.active(backend):
+            # 先に投入したジョブの後に実行されるので、そのモデルが残っている
+            cold = backend.model != job.model
+        else:
+            cold = not backend.warm or backend.model != job.model
+        if backend.model is not None and backend.model != job.model:
+            self.swaps += 1
+        backend.model = job.model
+        backend.dispatched += 1
+        job.node_types = {
+            node_id: node.get("class_type") for node_id, node in workflow.items()
+        }
+        job.prompt_id = prompt_id
+        job.backend = backend
+        job.cold = cold
+        self._jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job, ws))
+        return True
+
+    async def _dispatch(self):
+        # 空いているバックエンドに待ち行列のジョブを送る
+        if self.scheduler is None:
+            return
+        async with self._dispatch_lock:
+            while len(self.scheduler):
+                backends = [b for b in self.pool.backends if b.healthy]
+                free = [
+                    b
+                    for b in backends or self.pool.backends
+                    if len(self.active(b)) < self.max_inflight
+                ]
+                if not free:
+                    return
+                backend = min(free, key=lambda b: len(self.active(b)))
+                job = self.scheduler.pop(backend.model)
+                workflow, job.workflow = job.workflow, None
+                try:
+                    sent = await self._send(job, workflow, backend)
+                except httpx.HTTPError as e:
+                    # 接続できなかったバックエンドはヘルスチェックで戻るまで外す
+                    backend.healthy = False
+                    backend.last_error = str(e) or type(e).__name__
+                    sent = False
+                if not sent and job.status != JOB_CANCELLED:
+                    job.status = JOB_ERROR
+                    job.error = "Generate error."
+                    job.finished = time.time()
+                    job.done.set()
+
+    async def _run(self, job: Job, ws):
+        try:
+            outputs = await job.bridge.await_prompt(
+                job.prompt_id, ws, job.output_node, on_event=job.on_event
+            )
+            if job.status == JOB_CANCELLED:
+                return
+            if not outputs or job.output_node not in outputs:
+                job.status = JOB_ERROR
+                job.error = "Generate error."
+            else:
+                job.images = [
+                    {"subfolder": image["subfolder"], "filename": image["filename"]}
+                    for image in outputs[job.output_node].get("images", [])
+                ]
+                job.status = JOB_DONE
+                job.backend.warm = True
+                self._remember_images(job)
+                self._record_latency(job)
+        except asyncio.CancelledError:
+            job.status = JOB_CANCELLED
+        except Exception as e:
+            job.status = JOB_ERROR
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            job.done.set()
+            if ws is not None:
+                await ws.close()
+            self._prune()
+            # 空いたバックエンドに次のジョブを送ってから解放を判断する
+            await self._dispatch()
+            if not self.active(job.backend):
+                await self._release(job.backend)
+
+    async def wait(self, job: Job) -> Job:
+        await job.done.wait()
+        return job
+
+    async def follow(
+        self,
+        followed: list[Job],
+        report: Callable[[list[Job]], Awaitable[None]],
+        min_interval: float = PROGRESS_MIN_INTERVAL,
+        queue_interval: float = PROGRESS_QUEUE_INTERVAL,
+    ):
+        """
+        ジョブがすべて終わるまで、状態が変わるたびに report を呼ぶ。
+
+        websocket のイベントごとには呼ばず min_interval 秒ごとに状態を見るので、
+        ステップ数の多い生成でも通知は間引かれる。
+        待機中のジョブのキューの位置は queue_interval 秒ごとに確認する。
+        """
+        if not followed:
+            return
+        all_done = asyncio.ensure_future(
+            asyncio.gather(*(job.done.wait() for job in followed))
+        )
+        last_state = None
+        last_queue_check = 0.0
+        try:
+            while not all_done.done():
+                now = time.monotonic()
+                if now - last_queue_check >= queue_interval:
+                    last_queue_check = now
+                    await self._update_queue_positions(followed)
+                state = [
+                    (j.status, j.node, j.progress, j.queue_position) for j in followed
+                ]
+                if state != last_state:
+                    last_state = state
+                    await report(followed)
+                await asyncio.wait([all_done], timeout=min_interval)
+            # 完了した状態も 1 回通知する
+            await report(followed)
+        finally:
+            all_done.cancel()
+
+    async def _update_queue_positions(self, followed: list[Job]):
+        queued = [job for job in followed if job.status == JOB_QUEUED]
+        if self.scheduler is not None:
+            # 待ち行列で先に出るジョブと、一番空いているバックエンドで実行中のジョブ
+            in_flight = min(len(self.active(b)) for b in self.pool.backends)
+            for job in queued:
+                if job.backend is None:
+                    position = self.scheduler.position(job)
+                    if position is not None:
+                        job.queue_position = position + in_flight
+        for backend in {job.backend.server_url: job.backend for job in queued if job.backend}.values():
+            try:
+                queue = await backend.bridge.get_queue(retries=0)
+            except httpx.HTTPError:
+                continue
+            if queue is None:
+                continue
+            running, pending = queue
+            for job in queued:
+                if job.backend is backend and job.prompt_id in pending:
+                    job.queue_position = len(running) + pending.index(job.prompt_id)
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def active(self, backend: Backend = None) -> list[Job]:
+        # backend を指定するとそのバックエンドのジョブのみ
+        return [
+            job
+            for job in self._jobs.values()
+            if job.status not in JOB_FINISHED
+            and (backend is None or job.backend is backend)
+        ]
+
+    def bridge_for(self, subfolder: str, filename: str) -> ComfyuiBridge:
+        # 画像を生成したバックエンド、分からなければ先頭のバックエンド
+        backend = self._images.get((subfolder, filename))
+        return backend.bridge if backend else self.pool.primary
+
+    def _remember_images(self, job: Job):
+        for image in job.images:
+            key = (image["subfolder"], image["filename"])
+            self._images[key] = job.backend
+            self._images.move_to_end(key)
+        while len(self._images) > JOB_TABLE_MAX_IMAGES:
+            self._images.popitem(last=False)
+
+    async def cancel(self, job_id: str) -> Job | None:
+        job = self._jobs.get(job_id)
+        if job is None or job.status in JOB_FINISHED:
+            return job
+        if self.scheduler is not None and self.scheduler.remove(job):
+            # まだ ComfyUI に送っていない
+            job.status = JOB_CANCELLED
+            job.workflow = None
+            job.finished = time.time()
+            job.done.set()
+            self._prune()
+            return job
+        if job.backend is None:
+            # 待ち行列から出て送信中、プロンプトは送信後に _send が取り除く
+            job.status = JOB_CANCELLED
+            job.finished = time.time()
+            job.done.set()
+            self._prune()
+            return job
+        # 中断の通知で _run が先に終わってもエラーではなく取り消しとして扱う
+        job.status = JOB_CANCELLED
+        await self._abort(job.bridge, job.prompt_id)
+        job.task.cancel()
+        try:
+            await job.task
+        except asyncio.CancelledError:
+            pass
+        return job
+
+    async def _abort(self, bridge: ComfyuiBridge, prompt_id: str):
+        # ComfyUI で実行中なら中断し、待機中ならキューから削除する
+        running, pending = await bridge.get_queue() or ([], [])
+        if prompt_id in running:
+            await bridge.interrupt(prompt_id)
+        elif prompt_id in pending:
+            await bridge.delete_queue([prompt_id])
+
+    def _record_latency(self, job: Job):
+        # 投入から完了までの時間をモデルのロード有無で分けて記録する
+        elapsed = time.time() - job.created
+        kind = "cold" if job.cold else "warm"
+        self._latency[kind][0] += 1
+        self._latency[kind][1] += elapsed
+        logger.info(
+            f"Generation finished ({kind}) on {job.bridge.server_url}: {elapsed:.2f} s"
+        )
+
+    async def _release(self, backend: Backend):
+        if self.free_policy == FREE_POLICY_ALWAYS:
+            await self._free(backend)
+        elif self.free_policy == FREE_POLICY_IDLE:
+            self._cancel_free_timer(backend)
+            self._free_timers[backend.server_url] = asyncio.create_task(
+                self._free_after_idle(backend)
+            )
+
+    async def _free_after_idle(self, backend: Backend):
+        await asyncio.sleep(self.free_idle_seconds)
+        if not self.active(backend):
+            self._free_timers.pop(backend.server_url, None)
+            await self._free(backend)
+
+    def _cancel_free_timer(self, backend: Backend):
+        timer = self._free_timers.pop(backend.server_url, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _free(self, backend: Backend):
+        # 解放はジョブの結果に関係しないので、失敗してもログに残すだけにする
+        try:
+            await backend.bridge.free()
+        except httpx.HTTPError as e:
+            logger.warning(
+                f"Failed to free memory on {backend.server_url}: "
+                f"{str(e) or type(e).__name__}"
+            )
+            return
+        backend.warm = False
+        backend.model = None
+
+    async def close(self):
+        # 解放待ちのタイマーを止めてからバックエンドとの接続を閉じる
+        timers = list(self._free_timers.values())
+        self._free_timers.clear()
+        for timer in timers:
+            timer.cancel()
+        await asyncio.gather(*timers, return_exceptions=True)
+        await self.pool.close()
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self.active()),
+            "free_policy": self.free_policy,
+            "backends": self.pool.stats(),
+            "model_swaps": self.swaps,
+            "scheduler": self.scheduler.stats() if self.scheduler is not None else None,
+            **{
+                f"{kind}_generations": count
+                for kind, (count, _) in self._latency.items()
+            },
+            **{
+                f"{kind}_mean_seconds": total / count if count else None
+                for kind, (count, total) in self._latency.items()
+            },
+        }
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.status in JOB_FINISHED]
+        for job in finished[: max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.job_id]
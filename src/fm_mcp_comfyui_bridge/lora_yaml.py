@@ -68,11 +68,8 @@ class SdLoraYaml:
     @property
     def vpred(self) -> bool:
         """Vpred mode flag"""
-        if "vpred" in self.data:  # Check if 'vpred' key exists in the data dictionary
-            return self.data["vpred"]
-        else:
-            self.data["vpred"] = False  # Set default value to False if not present
-            return False
+        # 未指定なら False (data は書き換えない)
+        return self.data.get("vpred", False)
 
     @property
     def steps(self) -> int:
@@ -1,151 +1,509 @@
-from pathlib import Path
-
-import requests
-import yaml
-from mcp.server.fastmcp import FastMCP, Image
-
-import fm_mcp_comfyui_bridge.ollama_caption as OllamaCaption
-import fm_mcp_comfyui_bridge.tagger as Tagger
+import asyncio
+import contextlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from functools import partial
+from typing import TypedDict
+
+from mcp.server.fastmcp import Context, FastMCP, Image
+
+from fm_mcp_comfyui_bridge.backend_pool import (
+    POOL_AFFINITY_SLACK,
+    POOL_HEALTH_INTERVAL,
+    BackendPool,
+)
 from fm_mcp_comfyui_bridge.comfyui_bridge import (
     COMFYUI_NODE_OUTPUT,
     COMFYUI_URL,
+    COMFYUI_WORKFLOW_DEFAULT,
     ComfyuiBridge,
 )
+from fm_mcp_comfyui_bridge.image_cache import ImageCache
+from fm_mcp_comfyui_bridge.image_transcode import (
+    TRANSCODE_QUALITY,
+    decode,
+    normalize_format,
+)
+from fm_mcp_comfyui_bridge.job_table import (
+    FREE_IDLE_SECONDS,
+    FREE_POLICY,
+    JOB_DONE,
+    JOB_FINISHED,
+    Job,
+    JobTable,
+)
 from fm_mcp_comfyui_bridge.lora_yaml import SdLoraYaml
+from fm_mcp_comfyui_bridge.scheduler import (
+    SCHEDULER_MAX_INFLIGHT,
+    SCHEDULER_MAX_SKIPS,
+    SCHEDULER_MAX_WAIT,
+    ModelAffinityScheduler,
+)
+from fm_mcp_comfyui_bridge.services import (
+    VISION_PROMPT,
+    captioners,
+    config_store,
+    create_bridge,
+    get_cache_config,
+    get_caption_settings,
+    get_captioner,
+    get_comfyui_config,
+    get_result_cache,
+    get_tagger_model_repo,
+    load_ollama_caption,
+    load_tagger,
+    tagger_config,
+)
+
+# 標準出力は MCP の stdio トランスポートが使うので、診断メッセージはログに出す
+logger = logging.getLogger(__name__)
 
 NEGATIVE = """
 worst quality, bad quality, low quality, lowres, scan artifacts, jpeg artifacts, sketch,
 light particles, jpeg artifacts, unfinished, oldest, old, abstract, signature
 """
 
-VISION_PROMPT = """
-# 指示
-以下のイラストについて、詳細なテキストキャプションを生成してください。
-
-# 注目してほしい点
-*   全体的な雰囲気（例：暖かく穏やか、神秘的で静かなど）
-*   主要な被写体（人物の場合：外見、服装、表情、ポーズ、何をしているか。物の場合：種類、状態、特徴）
-*   背景（場所、時間帯、天候、描かれている要素）
-*   構図と構成要素（主要なオブジェクトの位置関係、前景・中景・後景の要素）
-*   色使い（全体的なトーン、印象的な色）
-*   画風（例：アニメスタイル、写実的、水彩風など）
-*   イラストから感じられる感情やストーリー
-
-# 出力形式
-自然な文章で、上記の注目点を網羅するように、できるだけ詳しく記述してください。
-"""
-
 HOST = "http://localhost:8188"
 
+# generate_pictures で一度に生成できる最大枚数
+GENERATE_MAX_COUNT = 16
+
+
+class PictureRef(TypedDict):
+    subfolder: str
+    filename: str
+
+
+@contextlib.asynccontextmanager
+async def lifespan(server: FastMCP):
+    try:
+        yield
+    finally:
+        # 終了時は解放待ちのタイマーを止めて ComfyUI との接続を閉じる
+        await jobs.close()
+
+
 # MCPサーバーを作成
-mcp = FastMCP("fm-mcp-comfyui-bridge")
+mcp = FastMCP("fm-mcp-comfyui-bridge", lifespan=lifespan)
 
 
 def get_lora() -> SdLoraYaml:
-    # main.py のあるディレクトリを取得
-    current_dir = Path(__file__).parent
-    # config ディレクトリ内の lora.yaml へのパスを構築
-    lora_yaml_path = current_dir / "config" / "config.yaml"
-    lora = SdLoraYaml()
-    lora.read_from_yaml(lora_yaml_path)
-    return lora
-
-
-def get_ollama_config() -> str:
-    # main.py のあるディレクトリを取得
-    current_dir = Path(__file__).parent
-    # config ディレクトリ内の lora.yaml へのパスを構築
-    ollama_yaml_path = current_dir / "config" / "ollama.yaml"
-    # ファイルがなかったら戻り
-    if not ollama_yaml_path.exists():
-        return None
-    # ファイルがあったら yaml として読み込み
-    with open(ollama_yaml_path, "r", encoding="utf-8") as file:
-        ollama_yaml = yaml.safe_load(file)
-        return ollama_yaml["vision_model"]
+    # config ディレクトリ内の config.yaml
+    data = config_store.get("config.yaml", required=True)
+    return SdLoraYaml(data=data, recent_file=str(config_store.path("config.yaml")))
+
+
+def create_pool() -> BackendPool:
+    # comfyui.yaml の backends に並べた ComfyUI に振り分ける
+    comfyui_config = get_comfyui_config()
+    urls = comfyui_config.get("backends") or [COMFYUI_URL]
+    # 末尾の / を揃えておく (URL はそのまま連結して使う)
+    bridges = [create_bridge(url.rstrip("/") + "/") for url in urls]
+    return BackendPool(
+        bridges,
+        health_interval=comfyui_config.get("health_interval", POOL_HEALTH_INTERVAL),
+        affinity_slack=comfyui_config.get("affinity_slack", POOL_AFFINITY_SLACK),
+    )
 
 
 def get_custom_config() -> any:
-    # main.py のあるディレクトリを取得
-    current_dir = Path(__file__).parent
-    # config ディレクトリ内の lora.yaml へのパスを構築
-    custom_yaml_path = current_dir / "config" / "custom.yaml"
-    # ファイルがなかったら戻り
-    if not custom_yaml_path.exists():
-        return None
-    # ファイルがあったら yaml として読み込み
-    with open(custom_yaml_path, "r", encoding="utf-8") as file:
-        custom_yaml = yaml.safe_load(file)
-        return custom_yaml
+    # config ディレクトリ内の custom.yaml、ファイルがなかったら None
+    return config_store.get("custom.yaml")
 
 
-@mcp.tool()
-def generate_picture(prompt: str) -> str:
-    """生成したいプロンプトを渡すことで画像生成を依頼し、生成された image の url を返すのでユーザーに提示してください。英語のプロンプトのみ受け付けるので、他言語は英語に翻訳してから渡してください。"""
+def get_workflow_config() -> tuple[any, SdLoraYaml | None]:
+    # 1 回のツール呼び出しの間は同じ設定を使うよう、まとめて取得する
     custom = get_custom_config()
+    return custom, (None if custom else get_lora())
+
+
+# ComfyUI との通信はバックエンドごとのブリッジのコネクションを使い回す
+pool = create_pool()
+# submit_picture で投入したジョブの状態を保持する
+# メモリ解放のタイミングは comfyui.yaml の free で設定する
+free_config = get_comfyui_config().get("free") or {}
+# scheduler を有効にすると同じモデルのジョブをまとめて ComfyUI に送る
+scheduler_config = get_comfyui_config().get("scheduler") or {}
+scheduler = (
+    ModelAffinityScheduler(
+        max_wait=scheduler_config.get("max_wait", SCHEDULER_MAX_WAIT),
+        max_skips=scheduler_config.get("max_skips", SCHEDULER_MAX_SKIPS),
+    )
+    if scheduler_config.get("enabled", False)
+    else None
+)
+jobs = JobTable(
+    pool,
+    free_policy=free_config.get("policy", FREE_POLICY),
+    free_idle_seconds=free_config.get("idle_seconds", FREE_IDLE_SECONDS),
+    scheduler=scheduler,
+    max_inflight=scheduler_config.get("max_inflight", SCHEDULER_MAX_INFLIGHT),
+)
+# get_picture / get_caption / get_tag で取得した画像を共有するキャッシュ
+cache_config = get_cache_config()
+image_cache = ImageCache(**(cache_config.get("image") or {}))
+# タグ解析(モデルのロードと推論)はイベントループを止めないよう専用スレッドで行う
+tagger_executor = ThreadPoolExecutor(
+    max_workers=tagger_config.get("workers", 2), thread_name_prefix="tagger"
+)
+
+
+async def run_tagger(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(tagger_executor, partial(func, *args, **kwargs))
+
+
+async def get_tagger():
+    # import とモデルのロードはどちらも tagger 用のスレッドで行う
+    Tagger = await run_tagger(load_tagger)
+    return await run_tagger(Tagger.get_tagger, get_tagger_model_repo())
+
+
+def build_workflow(
+    prompt: str,
+    config: tuple[any, SdLoraYaml | None],
+    seed: int = None,
+    batch_size: int = 1,
+) -> tuple[dict, str]:
+    # custom.yaml があればその workflow、なければ config.yaml の既定 workflow
+    custom, lora = config
     if custom:
-        prompt = ComfyuiBridge.t2i_custom_request_build(prompt, custom)
+        workflow = ComfyuiBridge.t2i_custom_request_build(
+            prompt, custom, seed=seed, batch_size=batch_size
+        )
         tree = custom["filename_prefix"].split(":")
         output_node = tree[0]
     else:
-        lora = get_lora()
-        prompt = ComfyuiBridge.t2i_request_build(
-            prompt, NEGATIVE, lora, lora.image_size
+        workflow = ComfyuiBridge.t2i_request_build(
+            prompt, NEGATIVE, lora, lora.image_size, seed=seed, batch_size=batch_size
         )
         output_node = COMFYUI_NODE_OUTPUT
+    return workflow, output_node
+
+
+def model_key(config: tuple[any, SdLoraYaml | None]) -> tuple:
+    # 振り分けでロード済みのバックエンドを優先するためのモデルの組
+    custom, lora = config
+    if custom:
+        return (custom["workflow"], None, None)
+    return (
+        COMFYUI_WORKFLOW_DEFAULT,
+        lora.checkpoint,
+        lora.model if lora.lora_enabled else None,
+    )
+
+
+def batch_supported(config: tuple[any, SdLoraYaml | None]) -> bool:
+    # 既定 workflow と batch_size の場所を指定した custom.yaml はバッチ生成できる
+    custom, _ = config
+    return not custom or "batch_size" in custom
+
+
+async def wait_jobs(submitted: list[Job], ctx: Context = None):
+    # 完了を待つ間、クライアントが progressToken を付けていれば進捗を通知する
+    if not submitted:
+        return
+    if ctx is None:
+        await asyncio.gather(*(jobs.wait(job) for job in submitted))
+        return
+
+    async def report(followed: list[Job]):
+        current = next((j for j in followed if j.status not in JOB_FINISHED), None)
+        message = current.progress_message() if current else followed[-1].status
+        if len(followed) > 1:
+            finished = sum(1 for j in followed if j.status in JOB_FINISHED)
+            message = f"{finished}/{len(followed)} done, {message}"
+        await ctx.report_progress(
+            sum(j.fraction for j in followed), len(followed), message
+        )
+
+    await jobs.follow(submitted, report)
+
+
+@mcp.tool()
+async def generate_picture(prompt: str, priority: int = 0, ctx: Context = None) -> str:
+    """生成したいプロンプトを渡すことで画像生成を依頼し、生成された image の url を返すのでユーザーに提示してください。英語のプロンプトのみ受け付けるので、他言語は英語に翻訳してから渡してください。priority は大きいほど先に生成される"""
+    config = get_workflow_config()
+    workflow, output_node = build_workflow(prompt, config)
     # image generate
-    id = ComfyuiBridge.send_request(prompt)
-    if id:
-        ComfyuiBridge.await_request(1, 3)
-        ComfyuiBridge.free()
+    job = await jobs.submit(workflow, output_node, model_key(config), priority)
+    if job is None:
+        return "Generate error."
+    await wait_jobs([job], ctx)
+    if job.status != JOB_DONE or not job.images:
+        return "Generate error."
+    # executed イベントの output からファイル名を取得
+    return job.status_dict()["urls"][0]
+
+
+@mcp.tool()
+async def generate_pictures(
+    prompt: str,
+    count: int = 4,
+    seeds: list[int] | None = None,
+    priority: int = 0,
+    ctx: Context = None,
+) -> list[str] | str:
+    """同じプロンプトで count 枚のバリエーションをまとめて生成し、生成された image の url のリストを返すのでユーザーに提示してください。seeds を指定するとその seed ごとに 1 枚ずつ生成する。英語のプロンプトのみ受け付けるので、他言語は英語に翻訳してから渡してください。priority は大きいほど先に生成される"""
+    config = get_workflow_config()
+    if seeds:
+        # seed はプロンプト単位なので seed ごとに投入する
+        requests = [(seed, 1) for seed in seeds[:GENERATE_MAX_COUNT]]
     else:
+        count = max(1, min(count, GENERATE_MAX_COUNT))
+        if batch_supported(config):
+            # latent の batch_size で 1 回のプロンプトにまとめる
+            requests = [(None, count)]
+        else:
+            requests = [(None, 1)] * count
+    # 続けて投入し、すべて終わるまでメモリは解放しない
+    submitted = []
+    for seed, batch_size in requests:
+        workflow, output_node = build_workflow(prompt, config, seed, batch_size)
+        job = await jobs.submit(workflow, output_node, model_key(config), priority)
+        if job is not None:
+            submitted.append(job)
+    if not submitted:
         return "Generate error."
-    url = COMFYUI_URL
-    # リクエストヒストリからファイル名を取得
-    headers = {"Content-Type": "application/json"}
-    response = requests.get(f"{url}history/{id}", headers=headers)
-    if response.status_code != 200:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        return None
-    subdir = response.json()[id]["outputs"][output_node]["images"][0]["subfolder"]
-    filename = response.json()[id]["outputs"][output_node]["images"][0]["filename"]
-    return f"{url}view?subfolder={subdir}&filename={filename}"
+    await wait_jobs(submitted, ctx)
+    urls = [
+        url
+        for job in submitted
+        if job.status == JOB_DONE
+        for url in job.status_dict()["urls"]
+    ]
+    if not urls:
+        return "Generate error."
+    return urls
+
+
+@mcp.tool()
+async def submit_picture(prompt: str, priority: int = 0) -> str:
+    """generate_picture と同じ画像生成を依頼し、完了を待たずにジョブIDを返す。結果は get_job_status で確認する。英語のプロンプトのみ受け付けるので、他言語は英語に翻訳してから渡してください。priority は大きいほど先に生成される"""
+    config = get_workflow_config()
+    workflow, output_node = build_workflow(prompt, config)
+    job = await jobs.submit(workflow, output_node, model_key(config), priority)
+    if job is None:
+        return "Generate error."
+    return job.job_id
+
+
+@mcp.tool()
+async def get_job_status(job_id: str) -> dict:
+    """submit_picture で受け取ったジョブIDの状態 (queued / running / done / error / cancelled) と進捗を返す。done の場合は urls に生成された image の url が入るのでユーザーに提示してください。"""
+    job = jobs.get(job_id)
+    if job is None:
+        return {"job_id": job_id, "status": "unknown"}
+    return job.status_dict()
+
+
+@mcp.tool()
+async def cancel_job(job_id: str) -> dict:
+    """submit_picture で受け取ったジョブIDの画像生成を取り消す。実行中なら中断し、待機中ならキューから削除する。"""
+    job = await jobs.cancel(job_id)
+    if job is None:
+        return {"job_id": job_id, "status": "unknown"}
+    return job.status_dict()
 
 
 @mcp.tool()
-def get_picture(subfolder: str, filename: str) -> Image:
-    """subfolder と filename を指定して画像の PNG バイナリを取得する"""
-    url = COMFYUI_URL
-    headers = {"Content-Type": "application/json"}
-    params = {"subfolder": subfolder, "filename": filename}
-    response = requests.get(f"{url}view", headers=headers, params=params)
-    if response.status_code != 200:
-        print(f"Error: {response.status_code}")
-        print(response.text)
+async def get_picture(
+    subfolder: str,
+    filename: str,
+    max_side: int | None = None,
+    format: str = "png",
+    quality: int = TRANSCODE_QUALITY,
+) -> Image:
+    """subfolder と filename を指定して画像を取得する。指定がなければ元の PNG をそのまま返す。プレビューには max_side で長辺を縮小し、format に webp か jpeg、quality (1-100) を指定すると転送量を減らせる"""
+    if max_side is not None and max_side <= 0:
+        raise ValueError(f"max_side must be a positive number of pixels, got {max_side}")
+    image_format = normalize_format(format)
+    if image_format is None:
+        logger.error(f"unsupported format {format}")
+        return None
+    data = await image_cache.variant(
+        jobs.bridge_for(subfolder, filename),
+        subfolder,
+        filename,
+        max_side=max_side,
+        format=image_format,
+        quality=max(1, min(quality, 100)),
+    )
+    if data is None:
         return None
-    return Image(data=response.content, format="png")
+    return Image(data=data, format=image_format)
 
 
 @mcp.tool()
-def get_caption(subfolder: str, filename: str) -> str:
+async def get_caption(subfolder: str, filename: str, ctx: Context = None) -> str:
     """subfolder と filename を指定して生成した画像のキャプションをテキスト形式で取得する"""
-    ollama_model = get_ollama_config()
-    url = f"{COMFYUI_URL}view?subfolder={subfolder}&filename={filename}"
-    vision = OllamaCaption.OllamaCaption(model_name=ollama_model)
-    caption = vision.caption(url, prompt=VISION_PROMPT)
+    start = time.perf_counter()
+    data = await image_cache.get(
+        jobs.bridge_for(subfolder, filename), subfolder, filename
+    )
+    fetch_seconds = time.perf_counter() - start
+    if data is None:
+        return None
+    await asyncio.to_thread(load_ollama_caption)
+    vision = get_captioner()
+    caption = await vision.caption(
+        data,
+        prompt=VISION_PROMPT,
+        fetch_seconds=fetch_seconds,
+        on_text=caption_relay(ctx) if ctx is not None else None,
+        settings=get_caption_settings(),
+    )
     return caption
 
 
+def caption_relay(ctx: Context):
+    # 生成途中のキャプションを、progressToken があれば進捗通知、なければログで送る
+    meta = ctx.request_context.meta
+    progress_token = meta.progressToken if meta else None
+    received = 0
+
+    async def relay(text: str):
+        nonlocal received
+        received += len(text)
+        if progress_token is not None:
+            await ctx.report_progress(received, None, text)
+        else:
+            await ctx.info(text)
+
+    return relay
+
+
 @mcp.tool()
-def get_tag(subfolder: str, filename: str) -> str:
-    """subfolder と filename を指定して生成した画像からWD1.4タグを解析してテキスト形式で取得する"""
-    url = f"{COMFYUI_URL}view?subfolder={subfolder}&filename={filename}"
-    tagger = Tagger.WD14Tagger(Tagger.SWINV2_MODEL_DSV3_REPO)
-    tags = tagger.image_tag(url, threshold=0.25)
+async def get_tag(subfolder: str, filename: str, top_k: int | None = None) -> str:
+    """subfolder と filename を指定して生成した画像からWD1.4タグを解析してテキスト形式で取得する。top_k を指定するとスコア上位 top_k 件に絞る"""
+    data = await image_cache.get(
+        jobs.bridge_for(subfolder, filename), subfolder, filename
+    )
+    if data is None:
+        return None
+    tagger = await get_tagger()
+    tags = await run_tagger(tagger.image_tag, data, threshold=0.25, top_k=top_k)
     return tags
 
 
+@mcp.tool()
+async def get_tag_scores(
+    subfolder: str,
+    filename: str,
+    general_threshold: float = 0.25,
+    character_threshold: float | None = None,
+    top_k: int | None = None,
+) -> dict:
+    """subfolder と filename を指定して生成した画像のWD1.4タグを general / character / rating のカテゴリ別にスコア付きで取得する。閾値はカテゴリごとに指定でき (character_threshold の省略時は 0.85)、top_k で general タグを上位 top_k 件に絞る"""
+    data = await image_cache.get(
+        jobs.bridge_for(subfolder, filename), subfolder, filename
+    )
+    if data is None:
+        return None
+    tagger = await get_tagger()
+    if character_threshold is None:
+        character_threshold = load_tagger().TAGGER_CHARACTER_THRESHOLD
+    result = await run_tagger(
+        tagger.image_tag_result, data, general_threshold, character_threshold, top_k
+    )
+    return asdict(result)
+
+
+@mcp.tool()
+async def get_tags(pictures: list[PictureRef]) -> list[dict]:
+    """subfolder と filename の組のリストを指定して、複数の画像からWD1.4タグをまとめて解析する。画像ごとに subfolder, filename, tags を返す"""
+    # 画像はまとめて並行に取得する
+    sources = await asyncio.gather(
+        *(
+            image_cache.get(
+                jobs.bridge_for(p["subfolder"], p["filename"]),
+                p["subfolder"],
+                p["filename"],
+            )
+            for p in pictures
+        )
+    )
+    tagger = await get_tagger()
+    max_batch_size = tagger_config.get(
+        "max_batch_size", load_tagger().TAGGER_MAX_BATCH_SIZE
+    )
+    tags = await run_tagger(
+        tagger.tag_many, sources, threshold=0.25, max_batch_size=max_batch_size
+    )
+    return [
+        {"subfolder": p["subfolder"], "filename": p["filename"], "tags": t}
+        for p, t in zip(pictures, tags)
+    ]
+
+
+@mcp.tool()
+async def analyze_picture(
+    subfolder: str,
+    filename: str,
+    tags: bool = True,
+    caption: bool = True,
+    top_k: int | None = None,
+    ctx: Context = None,
+) -> dict:
+    """subfolder と filename を指定して、生成した画像の WD1.4 タグとキャプションをまとめて取得する。get_tag と get_caption を続けて呼ぶより速い。tags / caption を False にするとその解析は行わない。top_k を指定するとタグをスコア上位 top_k 件に絞る"""
+    start = time.perf_counter()
+    data = await image_cache.get(
+        jobs.bridge_for(subfolder, filename), subfolder, filename
+    )
+    seconds = {"fetch": time.perf_counter() - start}
+    if data is None:
+        return None
+    # デコードは 1 回だけ行い、タグ解析とキャプション生成で共有する
+    decoded_at = time.perf_counter()
+    try:
+        image = await asyncio.to_thread(decode, data)
+    except Exception as e:
+        logger.error(f"failed to decode image: {e}")
+        return None
+    seconds["decode"] = time.perf_counter() - decoded_at
+
+    async def timed(name: str, coroutine):
+        started = time.perf_counter()
+        result = await coroutine
+        seconds[name] = time.perf_counter() - started
+        return result
+
+    async def run_tags():
+        tagger = await get_tagger()
+        return await run_tagger(
+            tagger.image_tag, data, threshold=0.25, top_k=top_k, decoded=image
+        )
+
+    async def run_caption():
+        await asyncio.to_thread(load_ollama_caption)
+        return await get_captioner().caption(
+            data,
+            prompt=VISION_PROMPT,
+            fetch_seconds=seconds["fetch"],
+            on_text=caption_relay(ctx) if ctx is not None else None,
+            decoded=image,
+            settings=get_caption_settings(),
+        )
+
+    # タグ解析 (ONNX) とキャプション生成 (Ollama) は並行に実行する
+    tag_result, caption_result = await asyncio.gather(
+        timed("tags", run_tags()) if tags else asyncio.sleep(0),
+        timed("caption", run_caption()) if caption else asyncio.sleep(0),
+    )
+    seconds["total"] = time.perf_counter() - start
+    return {
+        "subfolder": subfolder,
+        "filename": filename,
+        "tags": tag_result,
+        "caption": caption_result,
+        "seconds": seconds,
+    }
+
+
 # リソースを追加
 @mcp.resource("info://about")
 def get_info() -> str:
@@ -159,12 +517,45 @@ def get_info() -> str:
     """
 
 
+@mcp.resource("stats://image-cache")
+def get_image_cache_stats() -> str:
+    """画像キャッシュのヒット数・ミス数と使用量"""
+    return json.dumps(image_cache.stats())
+
+
+@mcp.resource("stats://caption")
+def get_caption_stats() -> str:
+    """キャプション生成の実行中・待機中の件数と、段階ごとの平均所要時間"""
+    return json.dumps([captioner.stats() for captioner in captioners.values()])
+
+
+@mcp.resource("stats://result-cache")
+def get_result_cache_stats() -> str:
+    """キャプション・タグ結果キャッシュのヒット数・ミス数と件数"""
+    result_cache = get_result_cache()
+    if result_cache is None:
+        return json.dumps({"enabled": False})
+    return json.dumps(result_cache.stats())
+
+
+@mcp.resource("stats://jobs")
+def get_job_stats() -> str:
+    """画像生成ジョブの件数と、モデルのロードあり(cold)/なし(warm)別の平均生成時間"""
+    return json.dumps(jobs.stats())
+
+
 @mcp.resource("help://tools")
 def get_tools_help() -> str:
     """ツールのヘルプ"""
     return """
     以下のツールが存在します:
     - generate_picture: 画像生成。プロンプト文字列を渡します。英語のプロンプトのみ受け付けるので、他言語は英語に翻訳してから渡してください。
+    - generate_pictures: 同じプロンプトで複数枚のバリエーションをまとめて生成し、url のリストを返します。
+    - submit_picture: 画像生成を依頼してすぐにジョブIDを返します。複数のプロンプトをまとめて投入する場合に使います。
+    - get_job_status: ジョブの状態と進捗、完了していれば画像の url を返します。
+    - cancel_job: ジョブを取り消します。
+    - get_picture: 画像を取得します。max_side と format (webp / jpeg) を指定すると縮小したプレビューを返します。
+    - analyze_picture: 画像のタグとキャプションを 1 回の呼び出しでまとめて取得します。
     """
 
 
@@ -184,6 +575,12 @@ def get_documents(topic: str) -> str:
 
 
 def main():
+    if tagger_config.get("warmup", False):
+        # 初回の get_tag を待たせないようバックグラウンドでモデルをロード
+        threading.Thread(
+            target=lambda: load_tagger().registry.warm(get_tagger_model_repo()),
+            daemon=True,
+        ).start()
     mcp.run()
 
 
@@ -1,20 +1,93 @@
+import asyncio
 import io
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import ollama
 import requests
 from PIL import Image
 
+from fm_mcp_comfyui_bridge import image_transcode
+from fm_mcp_comfyui_bridge.result_cache import ResultCache
+
+# 標準出力は MCP の stdio トランスポートが使うので、診断メッセージはログに出す
+logger = logging.getLogger(__name__)
+
+# default config value
+## Ollama に送る画像の長辺の上限(px)、vision モデルの入力サイズに合わせる (gemma3 は 896)
+OLLAMA_IMAGE_MAX_SIDE = 896
+## Ollama に送る画像の形式 (jpeg / webp / png)
+OLLAMA_IMAGE_FORMAT = "jpeg"
+## jpeg / webp の品質
+OLLAMA_IMAGE_QUALITY = 90
+## 変換せずにそのまま送る画像の形式
+OLLAMA_PASSTHROUGH_FORMATS = ("JPEG", "PNG")
+## キャプション生成後にモデルをメモリに残しておく時間 (Ollama の既定は 5m)
+OLLAMA_KEEP_ALIVE = "30m"
+## 1 つの Ollama ホストで同時に生成するキャプションの数
+OLLAMA_MAX_CONCURRENCY = 1
+## キャプションを生成しながら少しずつ受け取るか
+OLLAMA_STREAM = True
+## 生成途中のテキストを通知する最短間隔(秒)
+OLLAMA_STREAM_INTERVAL = 0.5
+
+
+@dataclass(frozen=True)
+class CaptionSettings:
+    """
+    キャプション生成ごとに変えられるモデルと画像・生成の設定 (ollama.yaml)。
+
+    キャプション生成は呼び出し時に受け取った設定だけを使うので、
+    順番を待っている間に設定が変わってもキャッシュのキーと生成内容はずれない。
+    """
+
+    model_name: str = "llama3.2-vision:latest"
+    max_side: int | None = OLLAMA_IMAGE_MAX_SIDE
+    image_format: str = OLLAMA_IMAGE_FORMAT
+    quality: int = OLLAMA_IMAGE_QUALITY
+    keep_alive: str | float = OLLAMA_KEEP_ALIVE
+    options: dict = field(default_factory=dict)
+    stream: bool = OLLAMA_STREAM
+
+    def __post_init__(self):
+        object.__setattr__(
+            self,
+            "image_format",
+            image_transcode.normalize_format(self.image_format) or "jpeg",
+        )
+        object.__setattr__(self, "options", dict(self.options or {}))
+
 
 class OllamaCaption:
     """
     OllamaのVisionモデルを使用して画像からキャプションを生成するクラス。
 
+    インスタンスは使い回す前提で、Ollama のクライアントは 1 つだけ持ち、
+    モデルの存在確認は最初のキャプション生成時に 1 回だけ行う。
+    同時に Ollama へ送るキャプションの数は max_concurrency までに制限する。
+
     Attributes:
-        model_name (str): 使用するOllamaのVisionモデル名 (デフォルト: "llava")。
+        settings (CaptionSettings): caption に設定を渡さなかったときに使う設定。
+        result_cache (ResultCache): 生成済みキャプションのキャッシュ (None で無効)。
+        host (str): Ollama のホスト (None で既定の http://localhost:11434)。
     """
 
-    def __init__(self, model_name: str = "llama3.2-vision:latest"):
+    def __init__(
+        self,
+        model_name: str = "llama3.2-vision:latest",
+        result_cache: ResultCache = None,
+        max_side: int | None = OLLAMA_IMAGE_MAX_SIDE,
+        image_format: str = OLLAMA_IMAGE_FORMAT,
+        quality: int = OLLAMA_IMAGE_QUALITY,
+        host: str = None,
+        keep_alive: str | float = OLLAMA_KEEP_ALIVE,
+        options: dict = None,
+        max_concurrency: int = OLLAMA_MAX_CONCURRENCY,
+        stream: bool = OLLAMA_STREAM,
+    ):
         """
         OllamaCaptionクラスのインスタンスを初期化します。
 
@@ -23,148 +96,441 @@ class OllamaCaption:
                                デフォルトは "llava" です。
                                指定するモデルは事前にOllamaにインストールされている必要があります。
                                (例: `ollama run llava`)
+            result_cache (ResultCache): 生成済みキャプションのキャッシュ。
+                               指定すると同じ画像・プロンプトの再要求ではOllamaを呼び出しません。
+            max_side (int): Ollamaに送る画像の長辺の上限。None で縮小しません。
+            image_format (str): 縮小・変換するときの形式 (jpeg / webp / png)。
+            quality (int): jpeg / webp の品質。
+            host (str): Ollama のホスト。None で既定のホストを使います。
+            keep_alive (str | float): キャプション生成後にモデルをメモリに残しておく時間。
+                               "30m" のような文字列か秒数、-1 で解放しません。
+            options (dict): Ollama に渡すオプション (num_ctx, num_predict など)。
+            max_concurrency (int): 同時に Ollama へ送るキャプションの数。
+            stream (bool): True で生成途中のテキストを受け取りながらキャプションを生成します。
         """
+        self.result_cache = result_cache
+        self.settings = CaptionSettings(
+            model_name, max_side, image_format, quality, keep_alive, options, stream
+        )
+        # 最後にキャプションを生成したモデル名 (stats 用)
         self.model_name = model_name
-        # モデルが存在するか簡単なチェック（オプション）
-        try:
-            ollama.show(model_name)
-        except ollama.ResponseError as e:
-            print(
-                f"警告: モデル '{model_name}' がOllamaに見つからないか、アクセスできません。"
-            )
-            print(f"エラー詳細: {e}")
-            print(
-                "続行しますが、captionメソッド呼び出し時にエラーが発生する可能性があります。"
-            )
-        except Exception as e:
-            print(f"Ollamaとの通信中に予期せぬエラーが発生しました: {e}")
+        # 段階ごとの所要時間の合計 (秒)
+        self.timings = {"fetch": 0.0, "decode": 0.0, "encode": 0.0, "inference": 0.0}
+        self.count = 0
+        self.passthrough = 0
+        # 最初のトークンまでの時間と、生成したトークン数・生成時間の合計
+        self.ttft_total = 0.0
+        self.ttft_count = 0
+        self.eval_tokens = 0
+        self.eval_seconds = 0.0
+        self.host = host
+        self.max_concurrency = max(1, max_concurrency)
+        self.client = ollama.AsyncClient(host=host)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        # 存在確認の済んだモデル名と、その結果
+        self._checked_models: dict[str, bool] = {}
+        self._check_lock = asyncio.Lock()
 
-    def _load_image(self, image_source: str) -> Image.Image | None:
+    async def check_model(self, model_name: str = None) -> bool | None:
         """
-        指定されたソース（URLまたはファイルパス）から画像を読み込み、
-        Pillow Imageオブジェクトを返します。
+        モデルがOllamaに存在するかを確認します。結果はモデル名ごとに記録し、
+        同じモデルについては Ollama に問い合わせません。
 
         Args:
-            image_source (str): 画像のURLまたはローカルファイルパス。
+            model_name (str): 確認するモデル名。None で settings のモデルを確認します。
 
         Returns:
-            Image.Image | None: 読み込まれたPillow Imageオブジェクト。
-                                読み込みに失敗した場合はNone。
+            bool | None: モデルが存在すればTrue、存在しなければFalse。
+                         Ollama と通信できなかった場合はNone (次回もう一度確認します)。
+        """
+        model_name = model_name or self.settings.model_name
+        checked = self._checked_models.get(model_name)
+        if checked is not None:
+            return checked
+        async with self._check_lock:
+            checked = self._checked_models.get(model_name)
+            if checked is not None:
+                return checked
+            try:
+                await self.client.show(model_name)
+                checked = True
+            except ollama.ResponseError as e:
+                logger.warning(
+                    f"警告: モデル '{model_name}' がOllamaに見つからないか、アクセスできません。"
+                )
+                logger.warning(f"エラー詳細: {e}")
+                logger.warning(
+                    "続行しますが、captionメソッド呼び出し時にエラーが発生する可能性があります。"
+                )
+                checked = False
+            except Exception as e:
+                logger.error(f"Ollamaとの通信中に予期せぬエラーが発生しました: {e}")
+                return None
+            self._checked_models[model_name] = checked
+            return checked
+
+    def _load_bytes(self, image_source: str | bytes) -> bytes | None:
+        """
+        指定されたソース（URL、ファイルパスまたは画像のバイト列）から画像ファイルの
+        バイト列を読み込みます。
+
+        Args:
+            image_source (str | bytes): 画像のURL、ローカルファイルパスまたは取得済みのバイト列。
+
+        Returns:
+            bytes | None: 読み込まれた画像ファイルのバイト列。
+                          読み込みに失敗した場合はNone。
         """
         try:
-            if image_source.startswith(("http://", "https://")):
+            if isinstance(image_source, bytes):
+                # 取得済みのバイト列はそのまま使う
+                return image_source
+            elif image_source.startswith(("http://", "https://")):
                 # URLから画像をダウンロード
                 response = requests.get(
                     image_source, stream=True, timeout=10
                 )  # タイムアウトを追加
                 response.raise_for_status()  # HTTPエラーがあれば例外を発生
-                # BytesIOを使ってメモリ上でファイルとして扱う
-                img = Image.open(io.BytesIO(response.content))
-                print(f"画像URLから読み込み成功: {image_source}")
-                return img
+                logger.info(f"画像URLから読み込み成功: {image_source}")
+                return response.content
             else:
                 # ローカルファイルパスから画像を読み込み
                 image_path = Path(image_source)
                 if not image_path.is_file():
-                    print(f"エラー: ファイルが見つかりません: {image_path}")
+                    logger.error(f"エラー: ファイルが見つかりません: {image_path}")
                     return None
-                img = Image.open(image_path)
-                print(f"画像ファイルから読み込み成功: {image_path}")
-                return img
+                data = image_path.read_bytes()
+                logger.info(f"画像ファイルから読み込み成功: {image_path}")
+                return data
         except requests.exceptions.RequestException as e:
-            print(
+            logger.error(
                 f"エラー: URLからの画像ダウンロードに失敗しました: {image_source}, 詳細: {e}"
             )
             return None
         except FileNotFoundError:
-            print(f"エラー: ファイルが見つかりません: {image_source}")
+            logger.error(f"エラー: ファイルが見つかりません: {image_source}")
             return None
         except IOError as e:
-            print(
-                f"エラー: 画像ファイルの読み込みまたは形式が無効です: {image_source}, 詳細: {e}"
+            logger.error(
+                f"エラー: 画像ファイルの読み込みに失敗しました: {image_source}, 詳細: {e}"
             )
             return None
         except Exception as e:
-            print(
+            logger.error(
                 f"エラー: 画像読み込み中に予期せぬエラーが発生しました: {image_source}, 詳細: {e}"
             )
             return None
 
-    def caption(
-        self, image_source: str, prompt: str = "Describe this image in detail:"
+    def _load_image(self, image_bytes: bytes) -> Image.Image | None:
+        """
+        画像ファイルのバイト列をPillow Imageオブジェクトとして開きます。
+
+        Args:
+            image_bytes (bytes): 画像ファイルのバイト列。
+
+        Returns:
+            Image.Image | None: 読み込まれたPillow Imageオブジェクト。
+                                形式が無効な場合はNone。
+        """
+        try:
+            # BytesIOを使ってメモリ上でファイルとして扱う
+            return Image.open(io.BytesIO(image_bytes))
+        except IOError as e:
+            logger.error(f"エラー: 画像ファイルの形式が無効です, 詳細: {e}")
+            return None
+
+    def _encode_image(
+        self,
+        image_bytes: bytes,
+        settings: CaptionSettings,
+        timings: dict,
+        decoded: Image.Image = None,
+    ) -> bytes | None:
+        """
+        画像をOllamaに渡すバイト列に変換します。
+        JPEG / PNG のRGB画像で長辺が max_side 以下ならデコードせずにそのまま返し、
+        それ以外は max_side に縮小して image_format でエンコードし直します。
+
+        Args:
+            image_bytes (bytes): 画像ファイルのバイト列。
+            settings (CaptionSettings): max_side / image_format / quality を読む設定。
+            timings (dict): decode / encode の所要時間(秒)を書き込む。
+            decoded (Image.Image): image_bytes をデコード済みの画像。指定するとデコードし直しません。
+
+        Returns:
+            bytes | None: Ollamaに渡すバイト列。変換に失敗した場合はNone。
+        """
+        start = time.perf_counter()
+        # Image.open はヘッダーだけを読むので形式とサイズの確認は軽い
+        img = decoded if decoded is not None else self._load_image(image_bytes)
+        if img is None:
+            return None  # 画像読み込み失敗
+        if (
+            img.format in OLLAMA_PASSTHROUGH_FORMATS
+            and img.mode in ("RGB", "L")
+            and (not settings.max_side or max(img.size) <= settings.max_side)
+        ):
+            timings["decode"] = time.perf_counter() - start
+            return image_bytes
+
+        try:
+            # アルファチャンネルがある場合は白背景に合成してRGBにする
+            if decoded is not None:
+                img = image_transcode.fit(decoded, settings.max_side, opaque=True)
+            else:
+                img = image_transcode.decode(image_bytes, settings.max_side, opaque=True)
+            decoded = time.perf_counter()
+            timings["decode"] = decoded - start
+            data = image_transcode.encode(img, settings.image_format, settings.quality)
+            timings["encode"] = time.perf_counter() - decoded
+        except Exception as e:
+            logger.error(f"エラー: 画像をバイト列に変換中にエラーが発生しました: {e}")
+            return None
+        return data
+
+    def _record_timings(self, timings: dict, passthrough: bool, generation: dict):
+        self.count += 1
+        if passthrough:
+            self.passthrough += 1
+        for name, seconds in timings.items():
+            self.timings[name] += seconds
+        if generation["ttft"] is not None:
+            self.ttft_total += generation["ttft"]
+            self.ttft_count += 1
+        if generation["eval_seconds"]:
+            self.eval_tokens += generation["tokens"]
+            self.eval_seconds += generation["eval_seconds"]
+        message = "キャプション生成の所要時間: " + ", ".join(
+            f"{name} {seconds:.3f}s" for name, seconds in timings.items()
+        )
+        if generation["ttft"] is not None:
+            message += f", ttft {generation['ttft']:.3f}s"
+        if generation["eval_seconds"]:
+            tokens_per_second = generation["tokens"] / generation["eval_seconds"]
+            message += f", {generation['tokens']} tokens ({tokens_per_second:.1f} tokens/s)"
+        logger.info(message + (" (画像はそのまま送信)" if passthrough else ""))
+
+    def stats(self) -> dict:
+        # 段階ごとの平均所要時間と、実行中・待機中のキャプション数
+        return {
+            "model": self.model_name,
+            "host": self.host,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "count": self.count,
+            "passthrough": self.passthrough,
+            "mean_seconds": {
+                name: total / self.count if self.count else None
+                for name, total in self.timings.items()
+            },
+            "mean_ttft_seconds": (
+                self.ttft_total / self.ttft_count if self.ttft_count else None
+            ),
+            "tokens_per_second": (
+                self.eval_tokens / self.eval_seconds if self.eval_seconds else None
+            ),
+        }
+
+    async def _chat_stream(
+        self,
+        messages: list[dict],
+        settings: CaptionSettings,
+        on_text: Callable[[str], Awaitable[None]] | None,
+        generation: dict,
+    ) -> str:
+        """
+        stream=True で Ollama を呼び出し、受け取ったテキストをつなげて返します。
+        on_text には前回の通知以降に受け取ったテキストを OLLAMA_STREAM_INTERVAL 秒ごとに渡します。
+        on_text が例外を出した場合は以降の通知をやめ、キャプションの生成は続けます。
+        """
+
+        async def notify(text: str):
+            nonlocal on_text
+            try:
+                await on_text(text)
+            except Exception as e:
+                logger.warning(f"生成途中のテキストを送れませんでした: {e}")
+                on_text = None
+
+        start = time.perf_counter()
+        parts = []
+        pending = []
+        # 最初のテキストはすぐに通知する
+        last_sent = float("-inf")
+        chunks = 0
+        async for chunk in await self.client.chat(
+            model=settings.model_name,
+            messages=messages,
+            options=settings.options or None,
+            keep_alive=settings.keep_alive,
+            stream=True,
+        ):
+            text = chunk["message"]["content"]
+            if text:
+                now = time.perf_counter()
+                if generation["ttft"] is None:
+                    generation["ttft"] = now - start
+                chunks += 1
+                parts.append(text)
+                pending.append(text)
+                if on_text is not None and now - last_sent >= OLLAMA_STREAM_INTERVAL:
+                    await notify("".join(pending))
+                    pending.clear()
+                    last_sent = now
+            if chunk.get("done"):
+                self._read_eval(chunk, generation)
+        if on_text is not None and pending:
+            await notify("".join(pending))
+        if not generation["eval_seconds"] and generation["ttft"] is not None:
+            # eval_count が返らない場合はチャンク数をトークン数の目安にする
+            generation["tokens"] = chunks
+            generation["eval_seconds"] = time.perf_counter() - start - generation["ttft"]
+        return "".join(parts)
+
+    @staticmethod
+    def _read_eval(response, generation: dict):
+        # 最後のレスポンスの eval_count / eval_duration(ns) から生成速度を求める
+        if response.get("eval_count") and response.get("eval_duration"):
+            generation["tokens"] = response["eval_count"]
+            generation["eval_seconds"] = response["eval_duration"] / 1e9
+
+    async def caption(
+        self,
+        image_source: str | bytes,
+        prompt: str = "Describe this image in detail:",
+        fetch_seconds: float = 0.0,
+        on_text: Callable[[str], Awaitable[None]] = None,
+        decoded: Image.Image = None,
+        settings: CaptionSettings = None,
     ) -> str | None:
         """
         指定された画像ソースからキャプションを生成します。
+        画像の読み込みと変換はスレッドで行い、Ollamaは非同期クライアントで呼び出します。
+        Ollama の呼び出しは同時に max_concurrency 件までで、それ以上は順番を待ちます。
 
         Args:
-            image_source (str): 画像のURLまたはローカルファイルパス。
+            image_source (str | bytes): 画像のURL、ローカルファイルパスまたは取得済みのバイト列。
             prompt (str): Ollamaモデルに渡すプロンプト。
                           デフォルトは "Describe this image in detail:"。
+            fetch_seconds (float): 呼び出し側でバイト列を取得するのにかかった時間(秒)。
+                          所要時間の内訳の fetch に加算します。
+            on_text (Callable): stream が True のとき、生成途中のテキストを受け取るコールバック。
+                          前回からの差分が OLLAMA_STREAM_INTERVAL 秒ごとにまとめて渡されます。
+            decoded (Image.Image): image_source をデコード済みの画像。他の処理とデコード結果を
+                          共有する場合に指定します。この画像は書き換えません。
+            settings (CaptionSettings): このキャプション生成に使う設定。None で settings を使います。
 
         Returns:
             str | None: 生成されたキャプション文字列。エラーが発生した場合はNone。
         """
-        img = self._load_image(image_source)
-        if img is None:
+        settings = settings or self.settings
+        timings = {"fetch": fetch_seconds, "decode": 0.0, "encode": 0.0, "inference": 0.0}
+        start = time.perf_counter()
+        data = await asyncio.to_thread(self._load_bytes, image_source)
+        timings["fetch"] += time.perf_counter() - start
+        if data is None:
             return None  # 画像読み込み失敗
 
-        # Pillow Imageオブジェクトをバイト列に変換 (PNG形式)
-        buffer = io.BytesIO()
-        try:
-            # 画像をRGBに変換（アルファチャンネルがある場合などに対応）
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            img.save(buffer, format="PNG")
-        except Exception as e:
-            print(f"エラー: 画像をバイト列に変換中にエラーが発生しました: {e}")
-            return None
-        image_bytes = buffer.getvalue()
+        # 同じ画像・モデル・プロンプトのキャプションがあればそれを返す
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = self.result_cache.make_key(
+                "caption",
+                data,
+                model=settings.model_name,
+                prompt=prompt,
+                max_side=settings.max_side,
+                image_format=settings.image_format,
+                quality=settings.quality,
+                options=settings.options,
+            )
+            # SQLite の読み書きはイベントループを止めないようスレッドで行う
+            cached = await asyncio.to_thread(self.result_cache.get, cache_key)
+            if cached is not None:
+                logger.info("キャッシュ済みのキャプションを返します。")
+                return cached
 
+        image_bytes = await asyncio.to_thread(self._encode_image, data, settings, timings, decoded)
+        if image_bytes is None:
+            return None  # 画像読み込み失敗
+
+        await self.check_model(settings.model_name)
         try:
-            print(
-                f"Ollamaモデル '{self.model_name}' を使用してキャプション生成を開始します..."
-            )
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
+            self.waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.model_name = settings.model_name
+            try:
+                logger.info(
+                    f"Ollamaモデル '{settings.model_name}' を使用してキャプション生成を開始します..."
+                )
+                messages = [
                     {
                         "role": "user",
                         "content": prompt,
                         "images": [image_bytes],  # バイト列を渡す
                     }
-                ],
-            )
-            print("キャプション生成成功。")
+                ]
+                generation = {"ttft": None, "tokens": 0, "eval_seconds": 0.0}
+                start = time.perf_counter()
+                if settings.stream:
+                    content = await self._chat_stream(
+                        messages, settings, on_text, generation
+                    )
+                    response = {"message": {"content": content}}
+                else:
+                    response = await self.client.chat(
+                        model=settings.model_name,
+                        messages=messages,
+                        options=settings.options or None,
+                        keep_alive=settings.keep_alive,
+                    )
+                    self._read_eval(response, generation)
+                timings["inference"] = time.perf_counter() - start
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+            logger.info("キャプション生成成功。")
+            self._record_timings(timings, image_bytes is data, generation)
             # レスポンスからキャプションテキストを抽出
             if response and "message" in response and "content" in response["message"]:
-                return response["message"]["content"].strip()
+                caption = response["message"]["content"].strip()
+                if cache_key is not None:
+                    await asyncio.to_thread(self.result_cache.put, cache_key, caption)
+                return caption
             else:
-                print(
+                logger.error(
                     "エラー: Ollamaからのレスポンス形式が予期されたものではありません。"
                 )
-                print(f"レスポンス: {response}")
+                logger.error(f"レスポンス: {response}")
                 return None
         except ollama.ResponseError as e:
-            print("エラー: Ollama API呼び出し中にエラーが発生しました。")
-            print(f"ステータスコード: {e.status_code}")
-            print(f"エラー詳細: {e.error}")
+            logger.error("エラー: Ollama API呼び出し中にエラーが発生しました。")
+            logger.error(f"ステータスコード: {e.status_code}")
+            logger.error(f"エラー詳細: {e.error}")
             # モデルが存在しない場合などの具体的なエラーメッセージを表示
             if "model not found" in e.error.lower():
-                print(
-                    f"ヒント: モデル '{self.model_name}' がOllamaに存在しません。`ollama run {self.model_name}` を実行してダウンロードしてください。"
+                logger.error(
+                    f"ヒント: モデル '{settings.model_name}' がOllamaに存在しません。`ollama run {settings.model_name}` を実行してダウンロードしてください。"
                 )
             elif "connection refused" in e.error.lower():
-                print(
+                logger.error(
                     "ヒント: Ollamaサーバーが実行されていないか、アクセスできません。Ollamaが起動していることを確認してください。"
                 )
             return None
         except Exception as e:
-            print(f"エラー: キャプション生成中に予期せぬエラーが発生しました: {e}")
+            logger.error(f"エラー: キャプション生成中に予期せぬエラーが発生しました: {e}")
             return None
 
 
 # --- 使用例 ---
-if __name__ == "__main__":
+async def _example():
     # OllamaCaption インスタンスを作成 (デフォルトモデル "llava" を使用)
     # もし別のモデルを使いたい場合は model_name="your_model_name" のように指定
     captioner = OllamaCaption()
@@ -174,7 +540,7 @@ if __name__ == "__main__":
     # 例: 有名な画像URL (動作確認用)
     image_url = "https://ollama.com/public/ollama.png"
     print(f"\n--- URLからのキャプション生成 ({image_url}) ---")
-    caption_from_url = captioner.caption(image_url)
+    caption_from_url = await captioner.caption(image_url)
     if caption_from_url:
         print("\n生成されたキャプション:")
         print(caption_from_url)
@@ -201,7 +567,7 @@ if __name__ == "__main__":
         except Exception as e:
             print(f"ダミー画像の生成に失敗しました: {e}")
 
-    caption_from_file = captioner.caption(
+    caption_from_file = await captioner.caption(
         local_image_path, prompt="What is in this picture?"
     )  # プロンプトも変更可能
     if caption_from_file:
@@ -221,13 +587,18 @@ if __name__ == "__main__":
     # 3. 存在しないファイルパスでのエラーテスト
     non_existent_path = "path/to/non_existent_image.png"
     print(f"\n--- 存在しないファイルパスでのテスト ({non_existent_path}) ---")
-    caption_non_existent = captioner.caption(non_existent_path)
+    caption_non_existent = await captioner.caption(non_existent_path)
     if caption_non_existent is None:
         print("期待通り、存在しないファイルからのキャプション生成は失敗しました。")
 
     # 4. 無効なURLでのエラーテスト
     invalid_url = "http://invalid-url-that-does-not-exist-abcxyz.com/image.jpg"
     print(f"\n--- 無効なURLでのテスト ({invalid_url}) ---")
-    caption_invalid_url = captioner.caption(invalid_url)
+    caption_invalid_url = await captioner.caption(invalid_url)
     if caption_invalid_url is None:
         print("期待通り、無効なURLからのキャプション生成は失敗しました。")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_example())
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# default config value
+## キャッシュの保存先
+RESULT_CACHE_DIR = Path.home() / ".cache" / "fm-mcp-comfyui-bridge"
+RESULT_CACHE_FILENAME = "results.sqlite3"
+## 有効期限(秒)
+RESULT_CACHE_TTL = 30 * 24 * 60 * 60
+## 保持する最大件数
+RESULT_CACHE_MAX_ENTRIES = 10000
+
+
+class ResultCache:
+    """
+    キャプションやタグの解析結果を SQLite に保存する永続キャッシュ。
+
+    キーは画像バイト列の SHA-256 と、モデル名やプロンプト、閾値などの
+    結果を左右するパラメータから作る。
+    ttl 秒を過ぎた結果は使わず、max_entries を超えたら参照の古いものから消す。
+    MCP クライアントごとにサーバープロセスが起動しても同じファイルを共有できるよう
+    WAL モードで開く。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        ttl: float = RESULT_CACHE_TTL,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        cache_dir = Path(cache_dir) if cache_dir else RESULT_CACHE_DIR
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = cache_dir / RESULT_CACHE_FILENAME
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, timeout=10, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind: str, image_bytes: bytes, **params) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return f"{kind}:{digest}:{params_json}"
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE results SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created, accessed)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        self._conn.execute(
+            "DELETE FROM results WHERE key IN ("
+            " SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()
+            return {
+                "path": str(self.path),
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,104 @@
+import itertools
+import time
+from dataclasses import dataclass, field
+
+# default config value
+## 待ち時間がこれを超えたジョブはモデルに関係なく先に出す(秒)
+SCHEDULER_MAX_WAIT = 60.0
+## 後から来たジョブに追い越された回数の上限
+SCHEDULER_MAX_SKIPS = 8
+## バックエンドごとに ComfyUI のキューへ送っておくジョブ数
+SCHEDULER_MAX_INFLIGHT = 1
+
+
+@dataclass
+class _Entry:
+    job: any
+    model: tuple | None
+    priority: int
+    seq: int
+    enqueued: float = field(default_factory=time.monotonic)
+    skips: int = 0
+
+
+class ModelAffinityScheduler:
+    """
+    ComfyUI に送る前のジョブを並べ替える待ち行列。
+
+    pop は優先度の一番高いジョブの中から、バックエンドに最後に投入した
+    モデル (workflow, checkpoint, LoRA) と同じものを先に出し、同じモデルの
+    ジョブが無くなってから一番古いジョブのモデルに切り替える。
+    max_wait 秒以上待ったか、max_skips 回追い越されたジョブは
+    モデルに関係なく先に出して、ジョブが取り残されないようにする。
+    """
+
+    def __init__(
+        self,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+        max_skips: int = SCHEDULER_MAX_SKIPS,
+    ):
+        self.max_wait = max_wait
+        self.max_skips = max_skips
+        self._entries: list[_Entry] = []
+        self._seq = itertools.count()
+        self.dispatched = 0
+        self.starved = 0
+        self.max_waited = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def push(self, job: any, model: tuple | None, priority: int = 0):
+        self._entries.append(_Entry(job, model, priority, next(self._seq)))
+
+    def pop(self, model: tuple | None) -> any:
+        # model はバックエンドに最後に投入したモデル
+        if not self._entries:
+            return None
+        now = time.monotonic()
+        starving = [
+            e
+            for e in self._entries
+            if now - e.enqueued >= self.max_wait or e.skips >= self.max_skips
+        ]
+        if starving:
+            chosen = min(starving, key=lambda e: (-e.priority, e.seq))
+            self.starved += 1
+        else:
+            top = max(e.priority for e in self._entries)
+            level = [e for e in self._entries if e.priority == top]
+            same = [e for e in level if e.model == model]
+            chosen = min(same or level, key=lambda e: e.seq)
+        for entry in self._entries:
+            if entry.seq < chosen.seq:
+                entry.skips += 1
+        self._entries.remove(chosen)
+        self.dispatched += 1
+        self.max_waited = max(self.max_waited, now - chosen.enqueued)
+        return chosen.job
+
+    def position(self, job: any) -> int | None:
+        # job より先に出る見込みのジョブの数 (モデルによる並べ替えは考えない)
+        for entry in self._entries:
+            if entry.job is job:
+                return sum(
+                    1
+                    for e in self._entries
+                    if (-e.priority, e.seq) < (-entry.priority, entry.seq)
+                )
+        return None
+
+    def remove(self, job: any) -> bool:
+        for entry in self._entries:
+            if entry.job is job:
+                self._entries.remove(entry)
+                return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._entries),
+            "dispatched": self.dispatched,
+            "starved": self.starved,
+            "max_waited_seconds": self.max_waited,
+        }
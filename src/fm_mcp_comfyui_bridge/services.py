@@ -0,0 +1,168 @@
+"""
+MCP サーバー (main) と索引付けのコマンド (indexer) が共有する、設定の読み込みと
+タグ解析・キャプション生成の準備。import してもサーバーの状態は作らない。
+"""
+
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.config_store import ConfigStore
+from fm_mcp_comfyui_bridge.http_client import HttpClient
+from fm_mcp_comfyui_bridge.result_cache import ResultCache
+
+if TYPE_CHECKING:
+    # 実行時は最初に使うときに load_ollama_caption で import する
+    from fm_mcp_comfyui_bridge import ollama_caption as OllamaCaption
+
+VISION_PROMPT = """
+# 指示
+以下のイラストについて、詳細なテキストキャプションを生成してください。
+
+# 注目してほしい点
+*   全体的な雰囲気（例：暖かく穏やか、神秘的で静かなど）
+*   主要な被写体（人物の場合：外見、服装、表情、ポーズ、何をしているか。物の場合：種類、状態、特徴）
+*   背景（場所、時間帯、天候、描かれている要素）
+*   構図と構成要素（主要なオブジェクトの位置関係、前景・中景・後景の要素）
+*   色使い（全体的なトーン、印象的な色）
+*   画風（例：アニメスタイル、写実的、水彩風など）
+*   イラストから感じられる感情やストーリー
+
+# 出力形式
+自然な文章で、上記の注目点を網羅するように、できるだけ詳しく記述してください。
+"""
+
+# config ディレクトリの YAML は変更されたときだけ読み直す
+config_store = ConfigStore(Path(__file__).parent / "config")
+
+
+def get_ollama_config() -> str:
+    # config ディレクトリ内の ollama.yaml、ファイルがなかったら None
+    ollama_yaml = config_store.get("ollama.yaml")
+    if ollama_yaml is None:
+        return None
+    return ollama_yaml["vision_model"]
+
+
+def get_ollama_image_config() -> dict:
+    # ollama.yaml の image、Ollama に送る画像の縮小と形式の設定
+    OllamaCaption = load_ollama_caption()
+    ollama_yaml = config_store.get("ollama.yaml") or {}
+    image_config = ollama_yaml.get("image") or {}
+    return {
+        "max_side": image_config.get("max_side", OllamaCaption.OLLAMA_IMAGE_MAX_SIDE),
+        "image_format": image_config.get("format", OllamaCaption.OLLAMA_IMAGE_FORMAT),
+        "quality": image_config.get("quality", OllamaCaption.OLLAMA_IMAGE_QUALITY),
+    }
+
+
+def get_ollama_client_config() -> dict:
+    # ollama.yaml のホスト・keep_alive・options・同時実行数の設定
+    OllamaCaption = load_ollama_caption()
+    ollama_yaml = config_store.get("ollama.yaml") or {}
+    return {
+        "host": ollama_yaml.get("host"),
+        "keep_alive": ollama_yaml.get("keep_alive", OllamaCaption.OLLAMA_KEEP_ALIVE),
+        "options": ollama_yaml.get("options") or {},
+        "max_concurrency": ollama_yaml.get(
+            "max_concurrency", OllamaCaption.OLLAMA_MAX_CONCURRENCY
+        ),
+        "stream": ollama_yaml.get("stream", OllamaCaption.OLLAMA_STREAM),
+    }
+
+
+def get_comfyui_config() -> dict:
+    # config ディレクトリ内の comfyui.yaml、ファイルがなかったらデフォルト値
+    return config_store.get("comfyui.yaml") or {}
+
+
+def get_tagger_config() -> dict:
+    # config ディレクトリ内の tagger.yaml、ファイルがなかったらデフォルト値
+    return config_store.get("tagger.yaml") or {}
+
+
+def get_cache_config() -> dict:
+    # config ディレクトリ内の cache.yaml、ファイルがなかったらデフォルト値
+    return config_store.get("cache.yaml") or {}
+
+
+def create_bridge(server_url: str) -> ComfyuiBridge:
+    # comfyui.yaml の http 設定でプール付きクライアントを作る
+    http_config = get_comfyui_config().get("http") or {}
+    client = HttpClient(server_url, **http_config)
+    return ComfyuiBridge(server_url, client)
+
+
+# タグ解析モデルの設定
+tagger_config = get_tagger_config()
+
+
+@cache
+def get_result_cache() -> ResultCache | None:
+    # キャプション・タグの解析結果のキャッシュ、cache.yaml の result で無効にできる
+    result_cache_config = dict(get_cache_config().get("result") or {})
+    if not result_cache_config.pop("enabled", True):
+        return None
+    return ResultCache(**result_cache_config)
+
+
+# tagger (onnxruntime, numpy) と ollama_caption (ollama) は読み込みに時間がかかるので、
+# 画像生成だけのセッションの起動を遅くしないよう最初に使うときに import する
+@cache
+def load_tagger():
+    import fm_mcp_comfyui_bridge.tagger as Tagger
+
+    Tagger.registry.max_models = tagger_config.get(
+        "max_models", Tagger.TAGGER_MAX_MODELS
+    )
+    Tagger.registry.result_cache = get_result_cache()
+    Tagger.registry.session_config = Tagger.SessionConfig(
+        **(tagger_config.get("session") or {}),
+        quantize=tagger_config.get("quantize", False),
+    )
+    return Tagger
+
+
+@cache
+def load_ollama_caption():
+    import fm_mcp_comfyui_bridge.ollama_caption as OllamaCaption
+
+    return OllamaCaption
+
+
+def get_tagger_model_repo() -> str:
+    return tagger_config.get("model_repo", load_tagger().SWINV2_MODEL_DSV3_REPO)
+
+
+# Ollama のホストと同時実行数ごとに使い回すキャプション生成
+captioners: dict[tuple, "OllamaCaption.OllamaCaption"] = {}
+
+
+def get_captioner() -> "OllamaCaption.OllamaCaption":
+    OllamaCaption = load_ollama_caption()
+    client_config = get_ollama_client_config()
+    key = (client_config["host"], client_config["max_concurrency"])
+    captioner = captioners.get(key)
+    if captioner is None:
+        captioner = OllamaCaption.OllamaCaption(
+            model_name=get_ollama_config(),
+            result_cache=get_result_cache(),
+            host=client_config["host"],
+            max_concurrency=client_config["max_concurrency"],
+        )
+        captioners[key] = captioner
+    return captioner
+
+
+def get_caption_settings() -> "OllamaCaption.CaptionSettings":
+    # ollama.yaml の変更はインスタンスを作り直さずに、呼び出しごとの設定として渡す
+    OllamaCaption = load_ollama_caption()
+    client_config = get_ollama_client_config()
+    return OllamaCaption.CaptionSettings(
+        get_ollama_config(),
+        keep_alive=client_config["keep_alive"],
+        options=client_config["options"],
+        stream=client_config["stream"],
+        **get_ollama_image_config(),
+    )
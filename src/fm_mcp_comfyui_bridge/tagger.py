@@ -5,14 +5,30 @@
 # The model used is from SmilingWolf.
 # The necessary models will be downloaded at runtime.
 
+import csv
+import functools
+import hashlib
+import logging
+import os
+import platform
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
 import huggingface_hub
 import numpy as np
 import onnxruntime as rt
-import pandas as pd
 import requests
 import io
 from PIL import Image
 
+from fm_mcp_comfyui_bridge.result_cache import ResultCache
+
+# 標準出力は MCP の stdio トランスポートが使うので、診断メッセージはログに出す
+logger = logging.getLogger(__name__)
+
 # Dataset v3 series of models:
 SWINV2_MODEL_DSV3_REPO = "SmilingWolf/wd-swinv2-tagger-v3"
 CONV_MODEL_DSV3_REPO = "SmilingWolf/wd-convnext-tagger-v3"
@@ -31,11 +47,260 @@ VIT_MODEL_DSV2_REPO = "SmilingWolf/wd-v1-4-vit-tagger-v2"
 MODEL_FILENAME = "model.onnx"
 LABEL_FILENAME = "selected_tags.csv"
 
+# Tag categories in selected_tags.csv
+CATEGORY_GENERAL = 0
+CATEGORY_CHARACTER = 4
+CATEGORY_RATING = 9
+
+# default config value
+## 同時にメモリに保持する tagger モデルの数
+TAGGER_MAX_MODELS = 2
+## 一度の推論にまとめる最大画像数
+TAGGER_MAX_BATCH_SIZE = 8
+## 前処理(読み込み・リサイズ)を並列に行うスレッド数
+TAGGER_PREPROCESS_WORKERS = 4
+## character タグの閾値
+TAGGER_CHARACTER_THRESHOLD = 0.85
+## 縮小率が大きいときは整数分の 1 に reduce してから LANCZOS で縮小する (Pillow の reducing_gap)
+TAGGER_REDUCING_GAP = 3.0
+## ONNX Runtime のグラフ最適化レベル (disable / basic / extended / all)
+TAGGER_GRAPH_OPTIMIZATION = "all"
+## 最適化済みモデルと量子化モデルを保存するディレクトリ
+TAGGER_MODEL_CACHE_DIR = Path.home() / ".cache" / "fm-mcp-comfyui-bridge" / "onnx"
+## INT8 の動的量子化の対象にする演算 (Transformer 系の重みの大部分は MatMul)
+TAGGER_QUANTIZE_OP_TYPES = ("MatMul",)
+## URL から画像を取得するときの接続と読み込みのタイムアウト (秒)
+TAGGER_DOWNLOAD_TIMEOUT = (5.0, 60.0)
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": rt.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": rt.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": rt.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": rt.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+def escape_tag(name: str) -> str:
+    return name.replace("(", "\\(").replace(")", "\\)")
+
+
+@dataclass
+class TagResult:
+    """カテゴリ別のタグとスコア、いずれもスコアの高い順"""
+
+    general: dict[str, float] = field(default_factory=dict)
+    character: dict[str, float] = field(default_factory=dict)
+    rating: dict[str, float] = field(default_factory=dict)
+
+    def general_string(self) -> str:
+        return ", ".join(escape_tag(name) for name in self.general)
+
+
+@dataclass(frozen=True)
+class TagLabels:
+    """selected_tags.csv のラベル表を NumPy 配列として保持する"""
+
+    names: np.ndarray
+    categories: np.ndarray
+    general_indexes: np.ndarray
+    character_indexes: np.ndarray
+    rating_indexes: np.ndarray
+
+    @classmethod
+    def from_csv(cls, csv_path) -> "TagLabels":
+        # 必要なのは name と category の 2 列だけなので csv モジュールで読む
+        with open(csv_path, "r", encoding="utf-8", newline="") as file:
+            rows = [(row["name"], int(row["category"])) for row in csv.DictReader(file)]
+        names = np.empty(len(rows), dtype=object)
+        names[:] = [name for name, _ in rows]
+        return cls.from_arrays(
+            names, np.array([category for _, category in rows], dtype=np.int64)
+        )
+
+    @classmethod
+    def from_arrays(cls, names: np.ndarray, categories: np.ndarray) -> "TagLabels":
+        return cls(
+            names=names,
+            categories=categories,
+            general_indexes=np.flatnonzero(categories == CATEGORY_GENERAL),
+            character_indexes=np.flatnonzero(categories == CATEGORY_CHARACTER),
+            rating_indexes=np.flatnonzero(categories == CATEGORY_RATING),
+        )
+
+    def _select(self, scores, indexes, threshold=None, top_k=None):
+        category_scores = scores[indexes]
+        if threshold is None:
+            hits = np.arange(len(indexes))
+        else:
+            hits = np.flatnonzero(category_scores > threshold)
+        if top_k is not None and top_k < 0:
+            raise ValueError(f"top_k must be 0 or more: {top_k}")
+        # スコア降順、同点はラベル表の順 (top_k の境界の同点もラベル表の順で選ぶ)
+        order = np.lexsort((hits, -category_scores[hits]))
+        hits = hits[order[:top_k]]
+        return dict(
+            zip(
+                self.names[indexes[hits]].tolist(),
+                category_scores[hits].tolist(),
+            )
+        )
+
+    def result(
+        self,
+        scores,
+        general_threshold=0.35,
+        character_threshold=TAGGER_CHARACTER_THRESHOLD,
+        top_k=None,
+    ) -> TagResult:
+        """
+        1 画像分のスコアからタグを抽出する。
+
+        general / character は閾値を超えたものをスコア順に並べ、
+        top_k を指定した場合は general を上位 top_k 件に絞る (0 なら general は空)。
+        rating は閾値なしで全件を返す。
+        """
+        return TagResult(
+            general=self._select(scores, self.general_indexes, general_threshold, top_k),
+            character=self._select(scores, self.character_indexes, character_threshold),
+            rating=self._select(scores, self.rating_indexes),
+        )
+
+
+@dataclass(frozen=True)
+class SessionConfig:
+    """
+    ONNX Runtime のセッション設定 (tagger.yaml の session)。
+
+    スレッド数は 0 で ONNX Runtime の既定 (物理コア数) になる。
+    タグ解析は workers 個のスレッドから同時に実行されるので、共有マシンでは
+    intra_op_threads * workers がコア数を超えないようにする。
+    optimized_model_cache を有効にすると、最適化後のモデルを cache_dir に保存し、
+    次回からは最適化を省いて読み込む。quantize を有効にすると、ダウンロードした
+    model.onnx を INT8 に動的量子化したモデルを使う (onnx パッケージが必要)。
+    """
+
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    optimization: str = TAGGER_GRAPH_OPTIMIZATION
+    optimized_model_cache: bool = True
+    cache_dir: str | None = None
+    providers: tuple[str, ...] | None = None
+    quantize: bool = False
+
+    @property
+    def model_cache_dir(self) -> Path:
+        return Path(self.cache_dir) if self.cache_dir else TAGGER_MODEL_CACHE_DIR
+
+
+def model_cache_key(model_path: str, *parts) -> str:
+    # モデルファイルと設定が同じなら同じキーになる
+    stat = Path(model_path).stat()
+    source = [str(Path(model_path).resolve()), stat.st_size, stat.st_mtime_ns, *parts]
+    return hashlib.sha256(repr(source).encode("utf-8")).hexdigest()[:16]
+
+
+@functools.cache
+def cpu_features() -> str:
+    """最適化後のグラフが使う命令セットを区別するための CPU の情報。"""
+    try:
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            for line in f:
+                # x86 は flags、ARM は Features
+                name, _, value = line.partition(":")
+                if name.strip() in ("flags", "Features"):
+                    return " ".join(sorted(value.split()))
+    except OSError:
+        pass
+    # /proc/cpuinfo がない環境 (Windows / macOS) ではプロセッサ名で区別する
+    return platform.processor()
+
+
+def quantize_model(model_path: str, cache_dir: Path) -> str:
+    """model_path を INT8 に動的量子化したモデルのパスを返す。まだなければ作る。"""
+    # onnx パッケージが必要なので使うときだけ import する
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    key = model_cache_key(model_path, TAGGER_QUANTIZE_OP_TYPES)
+    target = cache_dir / f"{key}.int8.onnx"
+    if not target.exists():
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # 同時に量子化する他のプロセスと一時ファイルを取り合わないよう pid を付ける
+        tmp_path = target.with_suffix(f".{os.getpid()}.tmp.onnx")
+        try:
+            quantize_dynamic(
+                model_path,
+                tmp_path,
+                op_types_to_quantize=list(TAGGER_QUANTIZE_OP_TYPES),
+                weight_type=QuantType.QUInt8,
+            )
+            os.replace(tmp_path, target)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return str(target)
+
+
+def create_session(model_path: str, config: SessionConfig) -> rt.InferenceSession:
+    options = rt.SessionOptions()
+    if config.intra_op_threads:
+        options.intra_op_num_threads = config.intra_op_threads
+    if config.inter_op_threads:
+        options.inter_op_num_threads = config.inter_op_threads
+    level = GRAPH_OPTIMIZATION_LEVELS.get(config.optimization)
+    if level is None:
+        raise ValueError(f"unknown graph optimization level: {config.optimization}")
+    available = rt.get_available_providers()
+    providers = None
+    if config.providers:
+        providers = [p for p in config.providers if p in available]
+        for provider in config.providers:
+            if provider not in available:
+                logger.warning(f"ONNX Runtime provider {provider} is not available")
+        providers = providers or None
+    if config.optimized_model_cache and level != rt.GraphOptimizationLevel.ORT_DISABLE_ALL:
+        # 最適化後のグラフは ONNX Runtime のバージョン・CPU・プロバイダに依存する
+        key = model_cache_key(
+            model_path,
+            config.optimization,
+            providers,
+            rt.__version__,
+            platform.machine(),
+            cpu_features(),
+        )
+        optimized_path = config.model_cache_dir / f"{key}.{config.optimization}.onnx"
+        if optimized_path.exists():
+            # 最適化済みなので読み込み時の最適化は省く
+            model_path = str(optimized_path)
+            level = rt.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            config.model_cache_dir.mkdir(parents=True, exist_ok=True)
+            # 書きかけのファイルを読まないよう、一時ファイルに書いてから置き換える
+            # (拡張子が .ort だと ORT 形式になるので .onnx のままにする)
+            tmp_path = optimized_path.with_suffix(f".{os.getpid()}.tmp.onnx")
+            options.optimized_model_filepath = str(tmp_path)
+            options.graph_optimization_level = level
+            try:
+                session = rt.InferenceSession(
+                    model_path, sess_options=options, providers=providers
+                )
+                os.replace(tmp_path, optimized_path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+            return session
+    options.graph_optimization_level = level
+    return rt.InferenceSession(model_path, sess_options=options, providers=providers)
+
 
 class WD14Tagger:
-    def __init__(self, model_repo):
+    def __init__(
+        self,
+        model_repo,
+        result_cache: ResultCache = None,
+        session_config: SessionConfig = None,
+    ):
         self.model_target_size = None
         self.last_loaded_repo = None
+        self.result_cache = result_cache
+        session_config = session_config or SessionConfig()
         # model download
         csv_path = huggingface_hub.hf_hub_download(
             model_repo,
@@ -45,75 +310,317 @@ class WD14Tagger:
             model_repo,
             MODEL_FILENAME,
         )
-        tags_df = pd.read_csv(csv_path)
-        name_series = tags_df["name"]
-        self.tag_names = name_series.tolist()
-        self.general_indexes = list(np.where(tags_df["category"] == 0)[0])
-        model = rt.InferenceSession(model_path)
-        _, height, width, _ = model.get_inputs()[0].shape
+        self.labels = TagLabels.from_csv(csv_path)
+        self.quantized = False
+        if session_config.quantize:
+            try:
+                model_path = quantize_model(model_path, session_config.model_cache_dir)
+                self.quantized = True
+            except ImportError as e:
+                logger.warning(
+                    f"INT8 quantization needs the onnx package, using FP32 ({e})"
+                )
+        self.model_path = model_path
+        model = create_session(model_path, session_config)
+        input_shape = model.get_inputs()[0].shape
+        # NCHW で書き出されたモデルにも対応する
+        self.channels_first = input_shape[1] == 3
+        if self.channels_first:
+            _, _, height, width = input_shape
+        else:
+            _, height, width, _ = input_shape
         self.model_target_size = max(height, width)
+        # 1 枚分の入力 (BGR の float32)
+        size = self.model_target_size
+        self.input_shape = (3, size, size) if self.channels_first else (size, size, 3)
+        # バッチ次元が固定のモデルは 1 枚ずつしか推論できない
+        self.fixed_batch_size = (
+            input_shape[0] if isinstance(input_shape[0], int) else None
+        )
         self.last_loaded_repo = model_repo
         self.model = model
 
-    def prepare_image(self, image_path):
+    @property
+    def model_name(self) -> str:
+        # 結果のキャッシュで FP32 と INT8 のモデルを区別する
+        if self.quantized:
+            return f"{self.last_loaded_repo}:int8"
+        return self.last_loaded_repo
+
+    def load_bytes(self, image_path):
+        # 取得済みのバイト列、またはそれを返す関数にも対応
+        if callable(image_path):
+            image_path = image_path()
+        if image_path is None:
+            raise ValueError("failed to fetch image")
+        if isinstance(image_path, bytes):
+            return image_path
         # URLからの画像読み込みに対応
         if image_path.startswith(('http://', 'https://')):
             # URLから画像をダウンロード
-            response = requests.get(image_path, stream=True)
+            response = requests.get(image_path, stream=True, timeout=TAGGER_DOWNLOAD_TIMEOUT)
             response.raise_for_status()  # エラーがあれば例外を発生
-            # BytesIOを使ってメモリ上でファイルとして扱う
-            image = Image.open(io.BytesIO(response.content))
+            return response.content
         else:
             # 通常のファイルパスからの読み込み
-            image = Image.open(image_path)
-            
+            with open(image_path, "rb") as f:
+                return f.read()
+
+    def load_image(self, image_path):
+        # デコード済みの画像はそのまま使う (preprocess は画像を書き換えない)
+        if isinstance(image_path, Image.Image):
+            return image_path
+        # BytesIOを使ってメモリ上でファイルとして扱う
+        image = Image.open(io.BytesIO(self.load_bytes(image_path)))
+        if image.format == "JPEG" and max(image.size) > self.model_target_size:
+            # JPEG はデコード時に 1/2^n で読み込んで縮小を軽くする
+            image.draft(image.mode, (self.model_target_size, self.model_target_size))
+        return image
+
+    def preprocess_into(self, image, out):
+        """
+        画像をモデルの入力に変換して out に書き込む。
+
+        out は 1 枚分の float32 の配列 (input_shape) で、バッチの配列のスロットを
+        渡せば推論の前にコピーし直さずに済む。長辺を model_target_size に合わせて
+        縮小し、白で正方形にパディングする。透過はパディングと同じ白に合成する。
+        """
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+        size = self.model_target_size
         original_width, original_height = image.size
-        # image resizing and padding to fit model input size (256x256 is a typical value for ResNet-like models, but it can be any other)
-        aspect_ratio = min(
-            self.model_target_size / original_width,
-            self.model_target_size / original_height,
-        )
+        aspect_ratio = min(size / original_width, size / original_height)
         new_size = (
-            int(original_width * aspect_ratio),
-            int(original_height * aspect_ratio),
-        )
-        resized_image = image.resize(new_size, Image.LANCZOS)
-        square_image = Image.new(
-            "RGB", (self.model_target_size, self.model_target_size), (255, 255, 255)
+            max(1, int(original_width * aspect_ratio)),
+            max(1, int(original_height * aspect_ratio)),
         )
-        paste_position = (
-            (self.model_target_size - new_size[0]) // 2,
-            (self.model_target_size - new_size[1]) // 2,
-        )
-        square_image.paste(resized_image, paste_position)
-        # Convert to numpy array
-        image_array = np.asarray(square_image, dtype=np.float32)
-        # Convert PIL-native RGB to BGR
-        image_array = image_array[:, :, ::-1]
-        return np.expand_dims(image_array, axis=0)
-
-    def tagging(self, input, threshold=0.35):
+        if new_size != image.size:
+            # Pillow は RGBA を乗算済みアルファで縮小するので透過部分の色がにじまない
+            image = image.resize(
+                new_size, Image.Resampling.LANCZOS, reducing_gap=TAGGER_REDUCING_GAP
+            )
+        pixels = np.asarray(image)
+        # PIL の RGB(A) を BGR の並びで参照する
+        bgr = pixels[:, :, 2::-1]
+        hwc = out.transpose(1, 2, 0) if self.channels_first else out
+        hwc.fill(255.0)
+        left = (size - new_size[0]) // 2
+        top = (size - new_size[1]) // 2
+        region = hwc[top : top + new_size[1], left : left + new_size[0]]
+        if pixels.shape[2] == 4:
+            alpha = pixels[:, :, 3:].astype(np.float32) / 255.0
+            np.multiply(bgr, alpha, out=region)
+            region += 255.0 * (1.0 - alpha)
+        else:
+            region[...] = bgr
+        return out
+
+    def preprocess(self, image):
+        return self.preprocess_into(image, np.empty(self.input_shape, dtype=np.float32))
+
+    def prepare_image(self, image_path):
+        image = self.load_image(image_path)
+        input = np.empty((1, *self.input_shape), dtype=np.float32)
+        self.preprocess_into(image, input[0])
+        return input
+
+    def predict(self, input):
         # run model
         input_name = self.model.get_inputs()[0].name
         label_name = self.model.get_outputs()[0].name
-        preds = self.model.run([label_name], {input_name: input})[0]
-        # collect labels
-        labels = list(zip(self.tag_names, preds[0].astype(float)))
-        general_names = [labels[i] for i in self.general_indexes]
-        general_res = [x for x in general_names if x[1] > threshold]
-        general_res = dict(general_res)
-        sorted_general_strings = sorted(
-            general_res.items(),
-            key=lambda x: x[1],
-            reverse=True,
+        return self.model.run([label_name], {input_name: input})[0]
+
+    def tag_result(
+        self,
+        scores,
+        general_threshold=0.35,
+        character_threshold=TAGGER_CHARACTER_THRESHOLD,
+        top_k=None,
+    ) -> TagResult:
+        return self.labels.result(
+            scores.astype(np.float32, copy=False),
+            general_threshold,
+            character_threshold,
+            top_k,
         )
-        #
-        sorted_general_strings = [x[0] for x in sorted_general_strings]
-        sorted_general_strings = (
-            ", ".join(sorted_general_strings).replace("(", "\(").replace(")", "\)")
+
+    def tags_from_scores(self, scores, threshold=0.35, top_k=None):
+        return self.tag_result(scores, threshold, top_k=top_k).general_string()
+
+    def tagging(self, input, threshold=0.35, top_k=None):
+        preds = self.predict(input)
+        return self.tags_from_scores(preds[0], threshold, top_k)
+
+    def image_tag(self, image_path, threshold=0.35, top_k=None, decoded=None):
+        # decoded には image_path をデコード済みの画像を渡せる
+        if self.result_cache is None:
+            image = self.prepare_image(decoded if decoded is not None else image_path)
+            return self.tagging(image, threshold, top_k)
+        # 同じ画像・同じ条件の結果があれば推論しない
+        data = self.load_bytes(image_path)
+        key = self.result_cache.make_key(
+            "tag",
+            data,
+            model=self.model_name,
+            threshold=threshold,
+            top_k=top_k,
         )
-        return sorted_general_strings
+        tags = self.result_cache.get(key)
+        if tags is None:
+            image = self.prepare_image(decoded if decoded is not None else data)
+            tags = self.tagging(image, threshold, top_k)
+            self.result_cache.put(key, tags)
+        return tags
+
+    def image_tag_result(
+        self,
+        image_path,
+        general_threshold=0.35,
+        character_threshold=TAGGER_CHARACTER_THRESHOLD,
+        top_k=None,
+    ) -> TagResult:
+        preds = self.predict(self.prepare_image(image_path))
+        return self.tag_result(preds[0], general_threshold, character_threshold, top_k)
+
+    def _prepare_into(self, image_path, out) -> bool:
+        try:
+            self.preprocess_into(self.load_image(image_path), out)
+            return True
+        except Exception as e:
+            logger.error(f"failed to load image: {e}")
+            return False
+
+    def tag_many(
+        self,
+        sources,
+        threshold=0.35,
+        max_batch_size=TAGGER_MAX_BATCH_SIZE,
+        workers=TAGGER_PREPROCESS_WORKERS,
+        top_k=None,
+        executor: ThreadPoolExecutor = None,
+    ):
+        """
+        複数画像をまとめてタグ付けする。
+
+        sources は画像のパス、URL、バイト列、またはバイト列を返す関数のリスト。
+        前処理はスレッドで並列に行い、最大 max_batch_size 枚ずつ 1 回の推論にまとめる。
+        前処理はバッチの配列の各スロットに直接書き込み、配列は 2 つを交互に使って
+        推論中に次のバッチの前処理を進める。
+        executor を渡すと前処理はそのスレッドで行い、省略すると呼び出しごとに
+        workers 個のスレッドを作る。繰り返し呼ぶ場合は executor を使い回す。
+        戻り値は sources と同じ順のタグ文字列のリストで、読み込めなかった画像は None。
+        """
+        if executor is not None:
+            return self._tag_many(sources, threshold, max_batch_size, top_k, executor)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return self._tag_many(sources, threshold, max_batch_size, top_k, executor)
+
+    def _tag_many(self, sources, threshold, max_batch_size, top_k, executor):
+        if self.fixed_batch_size is not None:
+            max_batch_size = self.fixed_batch_size
+        results = [None] * len(sources)
+        chunks = [
+            range(start, min(start + max_batch_size, len(sources)))
+            for start in range(0, len(sources), max_batch_size)
+        ]
+        buffers = [
+            np.empty((min(max_batch_size, len(sources)), *self.input_shape), dtype=np.float32)
+            for _ in range(min(2, len(chunks)))
+        ]
+
+        def submit(n):
+            buffer = buffers[n % 2]
+            return [
+                executor.submit(self._prepare_into, sources[i], buffer[slot])
+                for slot, i in enumerate(chunks[n])
+            ]
+
+        pending = submit(0) if chunks else []
+        for n, chunk in enumerate(chunks):
+            loaded = [future.result() for future in pending]
+            # 次のバッチの前処理をもう一方の配列で推論と並行して進める
+            if n + 1 < len(chunks):
+                pending = submit(n + 1)
+            indexes = [i for i, ok in zip(chunk, loaded) if ok]
+            if not indexes:
+                continue
+            batch = buffers[n % 2][: len(chunk)]
+            if len(indexes) < len(chunk):
+                batch = batch[np.array(loaded)]
+            preds = self.predict(batch)
+            for i, scores in zip(indexes, preds):
+                results[i] = self.tags_from_scores(scores, threshold, top_k)
+        return results
+
+
+class TaggerRegistry:
+    """
+    repo ごとに WD14Tagger を 1 度だけロードして使い回すレジストリ。
+
+    ロード済みの tagger は最近使った順に max_models 個まで保持し、
+    超えた分は最も使われていないものから解放する。
+    同じ repo のロードは 1 スレッドだけが行い、他のスレッドはその完了を待つ。
+    """
+
+    def __init__(
+        self,
+        max_models: int = TAGGER_MAX_MODELS,
+        result_cache: ResultCache = None,
+        session_config: SessionConfig = None,
+    ):
+        self.max_models = max_models
+        self.result_cache = result_cache
+        self.session_config = session_config or SessionConfig()
+        self._taggers: OrderedDict[str, WD14Tagger] = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def get(self, model_repo: str) -> WD14Tagger:
+        with self._lock:
+            tagger = self._lookup(model_repo)
+            if tagger is not None:
+                return tagger
+            load_lock = self._load_locks.setdefault(model_repo, threading.Lock())
+        # ダウンロードとセッション生成は repo 単位のロックで行う
+        with load_lock:
+            with self._lock:
+                tagger = self._lookup(model_repo)
+                if tagger is not None:
+                    return tagger
+            tagger = WD14Tagger(model_repo, self.result_cache, self.session_config)
+            with self._lock:
+                self._taggers[model_repo] = tagger
+                while len(self._taggers) > self.max_models:
+                    self._taggers.popitem(last=False)
+        return tagger
+
+    def _lookup(self, model_repo: str) -> WD14Tagger | None:
+        tagger = self._taggers.get(model_repo)
+        if tagger is not None:
+            self._taggers.move_to_end(model_repo)
+        return tagger
+
+    def warm(self, *model_repos: str):
+        """指定した repo を事前にロードしておく"""
+        for model_repo in model_repos:
+            self.get(model_repo)
+
+    def evict(self, model_repo: str = None):
+        """指定した repo の tagger を解放する、省略時はすべて解放"""
+        with self._lock:
+            if model_repo is None:
+                self._taggers.clear()
+            else:
+                self._taggers.pop(model_repo, None)
+
+    def loaded(self) -> list[str]:
+        with self._lock:
+            return list(self._taggers)
+
+
+# プロセス全体で共有するレジストリ
+registry = TaggerRegistry()
+
 
-    def image_tag(self, image_path, threshold=0.35):
-        image = self.prepare_image(image_path)
-        return self.tagging(image, threshold)
+def get_tagger(model_repo: str = SWINV2_MODEL_DSV3_REPO) -> WD14Tagger:
+    return registry.get(model_repo)
@@ -0,0 +1,100 @@
+import importlib.resources
+import json
+import threading
+from pathlib import Path
+
+# default config value
+## workflow ファイルを置くパッケージ
+WORKFLOW_PACKAGE = "fm_mcp_comfyui_bridge.config.workflow"
+
+
+def parse_path(path: str | tuple) -> tuple[str, ...]:
+    # "6:inputs:text" 形式の文字列を ("6", "inputs", "text") にする
+    if isinstance(path, str):
+        return tuple(path.split(":"))
+    return tuple(path)
+
+
+class WorkflowTemplate:
+    """
+    API 形式の workflow JSON を一度だけ読み込んで使い回すテンプレート。
+
+    paths には名前ごとに値を埋め込む場所 ("6:inputs:text" 形式) を渡し、
+    ロード時にすべての場所が workflow に存在するか確認する。
+    build は埋め込むノードだけをコピーし、それ以外のノードは
+    テンプレートと共有した workflow を返すので、返り値のノードは
+    埋め込んだもの以外を書き換えないこと。
+    ファイルの更新時刻が変わっていたら次の build で読み直す。
+    """
+
+    def __init__(self, filename: str, paths: dict[str, str | tuple]):
+        self.filename = filename
+        self.paths = {name: parse_path(path) for name, path in paths.items()}
+        self.path = Path(str(importlib.resources.files(WORKFLOW_PACKAGE) / filename))
+        self._lock = threading.Lock()
+        self._stamp = None
+        self.graph: dict = {}
+        self.refresh()
+
+    def refresh(self):
+        # ファイルが更新されていたら読み直して埋め込み先を検証する
+        stat = self.path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            with open(self.path, "r", encoding="utf-8") as f:
+                graph = json.load(f)
+            self._validate(graph)
+            self.graph = graph
+            self._stamp = stamp
+
+    def _validate(self, graph: dict):
+        for name, path in self.paths.items():
+            node = graph
+            for depth, key in enumerate(path):
+                if not isinstance(node, dict) or key not in node:
+                    raise ValueError(
+                        f"{self.filename}: {name} の埋め込み先 {':'.join(path)} が"
+                        f" workflow にありません ({':'.join(path[: depth + 1])})"
+                    )
+                node = node[key]
+
+    def node_id(self, name: str) -> str:
+        return self.paths[name][0]
+
+    def build(self, values: dict[str, any]) -> dict:
+        self.refresh()
+        workflow = dict(self.graph)
+        copied = set()
+        for name, value in values.items():
+            path = self.paths[name]
+            # 埋め込み先までの dict を 1 回だけコピーする (copy-on-write)
+            parent = workflow
+            for depth, key in enumerate(path[:-1]):
+                prefix = path[: depth + 1]
+                if prefix not in copied:
+                    parent[key] = dict(parent[key])
+                    copied.add(prefix)
+                parent = parent[key]
+            parent[path[-1]] = value
+        return workflow
+
+
+_templates: dict[tuple, WorkflowTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def get_template(filename: str, paths: dict[str, str | tuple]) -> WorkflowTemplate:
+    # workflow ファイルと埋め込み先の組ごとにテンプレートを使い回す
+    key = (filename, tuple(sorted((k, parse_path(v)) for k, v in paths.items())))
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(key)
+            if template is None:
+                template = WorkflowTemplate(filename, paths)
+                _templates[key] = template
+    return template
@@ -0,0 +1,9 @@
+import pytest
+from stub_comfyui import StubComfyui
+
+
+@pytest.fixture
+def stub():
+    # 1 プロンプト 0.2 秒、4 ステップで実行する ComfyUI
+    with StubComfyui(delay=0.2, steps=4, image_size=64) as stub:
+        yield stub
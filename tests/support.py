@@ -0,0 +1,17 @@
+import asyncio
+import socket
+
+
+def unused_url() -> str:
+    # 何も待ち受けていないポートの URL
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/"
+
+
+async def wait_until(predicate, timeout: float = 5.0):
+    # predicate が真になるまで待つ、timeout 秒を過ぎたら TimeoutError
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.01)
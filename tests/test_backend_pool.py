@@ -0,0 +1,88 @@
+import asyncio
+
+from stub_comfyui import StubComfyui
+from support import unused_url
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.http_client import HttpClient
+
+MODEL = ("SDXL_LoRA_Base_API.json", "a.safetensors", None)
+
+
+def bridge(url: str) -> ComfyuiBridge:
+    return ComfyuiBridge(url, HttpClient(url, retries=0, backoff=0.0))
+
+
+def test_acquire_picks_shortest_queue():
+    async def run(busy: StubComfyui, idle: StubComfyui):
+        pool = BackendPool([bridge(busy.url), bridge(idle.url)], health_interval=0)
+        try:
+            for _ in range(3):
+                await pool.backends[0].bridge.send_request({})
+            backend = await pool.acquire(MODEL)
+            pool.release(backend)
+            return backend.server_url, [b.queue_length for b in pool.backends]
+        finally:
+            await pool.close()
+
+    with StubComfyui(delay=5.0) as busy, StubComfyui(delay=5.0) as idle:
+        server_url, lengths = asyncio.run(run(busy, idle))
+    assert server_url == idle.url
+    assert lengths == [3, 0]
+
+
+def test_acquire_prefers_loaded_model_within_slack():
+    async def run(busy: StubComfyui, idle: StubComfyui, slack: int):
+        pool = BackendPool(
+            [bridge(busy.url), bridge(idle.url)], health_interval=0, affinity_slack=slack
+        )
+        try:
+            await pool.backends[0].bridge.send_request({})
+            await pool.backends[0].bridge.send_request({})
+            pool.backends[0].model = MODEL
+            backend = await pool.acquire(MODEL)
+            pool.release(backend)
+            return backend.server_url
+        finally:
+            await pool.close()
+
+    with StubComfyui(delay=5.0) as busy, StubComfyui(delay=5.0) as idle:
+        assert asyncio.run(run(busy, idle, slack=2)) == busy.url
+        assert asyncio.run(run(busy, idle, slack=1)) == idle.url
+
+
+def test_unhealthy_backend_is_skipped_and_recovers(stub):
+    async def run():
+        dead_url = unused_url()
+        pool = BackendPool([bridge(dead_url), bridge(stub.url)], health_interval=0)
+        try:
+            backend = await pool.acquire()
+            pool.release(backend)
+            assert backend.server_url == stub.url
+            dead = pool.find(dead_url)
+            assert not dead.healthy
+            assert dead.last_error
+            # ヘルスチェックで応答が戻れば振り分けに戻す
+            dead.bridge = pool.find(stub.url).bridge
+            assert await pool.check(dead)
+            assert dead.healthy
+            assert dead.last_error is None
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_all_unhealthy_still_returns_a_backend():
+    async def run():
+        pool = BackendPool([bridge(unused_url()), bridge(unused_url())], health_interval=0)
+        try:
+            backend = await pool.acquire()
+            assert backend.dispatching == 1
+            pool.release(backend)
+            return [b.healthy for b in pool.backends]
+        finally:
+            await pool.close()
+
+    assert asyncio.run(run()) == [False, False]
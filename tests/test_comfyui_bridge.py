@@ -0,0 +1,114 @@
+import asyncio
+import uuid
+
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+
+# スタブは SaveImage ノードの無い workflow の出力を "9" に置く
+OUTPUT_NODE = "9"
+WORKFLOW = {
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+    "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "1girl", "clip": ["4", 1]}},
+    "3": {"class_type": "KSampler", "inputs": {"positive": ["6", 0]}},
+    "9": {"class_type": "SaveImage", "inputs": {"images": ["3", 0]}},
+}
+
+
+async def generate(
+    url: str, ws_mode: str = "open", check_interval: float = 10.0, workflow: dict = None
+) -> tuple[dict, list]:
+    bridge = ComfyuiBridge(url)
+    events = []
+    try:
+        client_id = uuid.uuid4().hex
+        ws = None
+        if ws_mode != "none":
+            ws = await bridge.open_websocket(client_id)
+        # other は別の client_id で送るのでイベントが届かない
+        send_id = client_id if ws_mode != "other" else uuid.uuid4().hex
+        prompt_id = await bridge.send_request(workflow or {}, client_id=send_id)
+        if ws_mode == "closed":
+            await ws.close()
+        outputs = await bridge.await_prompt(
+            prompt_id,
+            ws,
+            OUTPUT_NODE,
+            check_interval=check_interval,
+            on_event=lambda type, data: events.append(type),
+        )
+        if ws is not None:
+            await ws.close()
+        return outputs, events
+    finally:
+        await bridge.close()
+
+
+def images(outputs: dict) -> list[str]:
+    return [image["filename"] for image in outputs[OUTPUT_NODE]["images"]]
+
+
+def test_await_prompt_over_websocket(stub):
+    outputs, events = asyncio.run(generate(stub.url, "open"))
+    assert len(images(outputs)) == 1
+    assert events.count("progress") == 4
+    assert stub.counts["history"] == 0
+
+
+def test_rerun_with_cached_nodes_does_not_poll_history(stub):
+    async def run():
+        await generate(stub.url, workflow=WORKFLOW)
+        return await generate(stub.url, workflow=WORKFLOW)
+
+    outputs, events = asyncio.run(run())
+    assert len(images(outputs)) == 1
+    # ローダーとテキストエンコーダーはキャッシュされるが、出力は executed で届く
+    assert "execution_cached" in events
+    assert "execution_success" in events
+    assert stub.counts["history"] == 0
+
+
+def test_cached_output_node_is_read_from_history(stub):
+    async def run():
+        await generate(stub.url, workflow=WORKFLOW)
+        stub.output_cached = True
+        return await generate(stub.url, workflow=WORKFLOW)
+
+    outputs, events = asyncio.run(run())
+    assert len(images(outputs)) == 1
+    assert "executed" not in events
+    # 完了 (node None) の時点で history は書き込まれているので 1 回で取れる
+    assert stub.counts["history"] == 1
+
+
+def test_await_prompt_without_websocket_polls_history(stub):
+    outputs, events = asyncio.run(generate(stub.url, "none"))
+    assert len(images(outputs)) == 1
+    assert events == []
+    assert stub.counts["history"] > 0
+
+
+def test_await_prompt_falls_back_when_websocket_closes(stub):
+    outputs, _ = asyncio.run(generate(stub.url, "closed"))
+    assert len(images(outputs)) == 1
+    assert stub.counts["history"] > 0
+
+
+def test_await_prompt_checks_history_when_events_are_missed(stub):
+    outputs, events = asyncio.run(generate(stub.url, "other", check_interval=0.1))
+    assert len(images(outputs)) == 1
+    assert events == []
+
+
+def test_await_history_gives_up_on_vanished_prompt(stub, capsys, caplog):
+    async def run():
+        bridge = ComfyuiBridge(stub.url)
+        try:
+            async with asyncio.timeout(5):
+                return await bridge.await_history("missing", 0.01)
+        finally:
+            await bridge.close()
+
+    assert asyncio.run(run()) is None
+    assert stub.counts["queue"] == 1
+    # 標準出力は MCP の stdio トランスポートなので、エラーはログにだけ出す
+    assert capsys.readouterr().out == ""
+    assert "missing" in caplog.text
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from fm_mcp_comfyui_bridge.config_store import ConfigStore
+
+
+def write(path, text: str):
+    # 更新時刻が同じ時刻の単位に収まっても変更が分かるよう、書くたびに進める
+    mtime = path.stat().st_mtime_ns if path.exists() else 0
+    path.write_text(text, encoding="utf-8")
+    os.utime(path, ns=(mtime + 1_000_000, mtime + 1_000_000))
+
+
+def test_get_returns_frozen_snapshot(tmp_path):
+    write(
+        tmp_path / "ollama.yaml",
+        "vision_model: gemma3\noptions:\n  num_ctx: 4096\nhosts: [a, b]\n",
+    )
+    store = ConfigStore(tmp_path)
+    config = store.get("ollama.yaml")
+    assert config["vision_model"] == "gemma3"
+    assert config["hosts"] == ("a", "b")
+    with pytest.raises(TypeError):
+        config["vision_model"] = "llava"
+    with pytest.raises(TypeError):
+        config["options"]["num_ctx"] = 8192
+    # 変更がなければ読み直さずに同じスナップショットを返す
+    assert store.get("ollama.yaml") is config
+
+
+def test_changed_file_is_reloaded(tmp_path):
+    path = tmp_path / "comfyui.yaml"
+    write(path, "url: http://a:8188\n")
+    store = ConfigStore(tmp_path)
+    before = store.get("comfyui.yaml")
+    write(path, "url: http://b:8188\n")
+    after = store.get("comfyui.yaml")
+    assert after["url"] == "http://b:8188"
+    # 渡し済みのスナップショットは変わらない
+    assert before["url"] == "http://a:8188"
+
+
+def test_missing_file(tmp_path):
+    store = ConfigStore(tmp_path)
+    assert store.get("custom.yaml") is None
+    with pytest.raises(FileNotFoundError):
+        store.get("custom.yaml", required=True)
+    # 削除されたファイルは古い内容を返さない
+    path = tmp_path / "custom.yaml"
+    write(path, "workflow: a.json\n")
+    assert store.get("custom.yaml")["workflow"] == "a.json"
+    path.unlink()
+    assert store.get("custom.yaml") is None
+
+
+def test_invalidate_forces_reload(tmp_path):
+    write(tmp_path / "cache.yaml", "image:\n  max_mb: 64\n")
+    store = ConfigStore(tmp_path)
+    first = store.get("cache.yaml")
+    store.invalidate("cache.yaml")
+    second = store.get("cache.yaml")
+    assert second == first
+    assert second is not first
+    store.invalidate()
+    assert store.get("cache.yaml") is not second
@@ -0,0 +1,44 @@
+import asyncio
+
+import httpx
+import pytest
+from support import unused_url
+
+from fm_mcp_comfyui_bridge.http_client import HttpClient
+
+
+async def request(url: str, method: str, path: str, **kwargs) -> httpx.Response:
+    client = HttpClient(url, backoff=0.0, **kwargs)
+    try:
+        return await client.request(method, path)
+    finally:
+        await client.close()
+
+
+def test_get_retries_503_until_success(stub):
+    stub.failures["queue"] = 2
+    response = asyncio.run(request(stub.url, "GET", "queue"))
+    assert response.status_code == 200
+    assert stub.failures["queue"] == 0
+    assert stub.counts["queue"] == 1
+
+
+def test_get_returns_503_after_retries(stub):
+    stub.failures["queue"] = 5
+    response = asyncio.run(request(stub.url, "GET", "queue", retries=2))
+    assert response.status_code == 503
+    # 最初の 1 回とリトライ 2 回
+    assert stub.failures["queue"] == 2
+
+
+def test_post_is_not_retried_on_503(stub):
+    # 二重送信になりうるので POST の 5xx はリトライしない
+    stub.failures["prompt"] = 1
+    response = asyncio.run(request(stub.url, "POST", "prompt"))
+    assert response.status_code == 503
+    assert stub.counts["prompt"] == 0
+
+
+def test_connect_error_is_raised_after_retries():
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(request(unused_url(), "POST", "prompt", retries=1))
@@ -0,0 +1,76 @@
+import asyncio
+import io
+
+from PIL import Image
+
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.http_client import HttpClient
+from fm_mcp_comfyui_bridge.image_cache import ImageCache
+
+
+def test_image_is_fetched_once(stub):
+    async def run():
+        cache = ImageCache()
+        bridge = ComfyuiBridge(stub.url)
+        # 同時の要求も 2 回目の要求も /view は 1 回だけ
+        first = await asyncio.gather(
+            *(cache.get(bridge, "stub", "a.png") for _ in range(3))
+        )
+        second = await cache.get(bridge, "stub", "a.png")
+        return first, second, cache.stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first == [stub.png] * 3
+    assert second == stub.png
+    assert stub.counts["view"] == 1
+    assert (stats["misses"], stats["entries"]) == (1, 1)
+
+
+def test_evicted_image_is_read_back_from_disk(stub, tmp_path):
+    async def run():
+        # 1 枚分のメモリしかないので、2 枚目を入れると 1 枚目はディスクに書き出す
+        cache = ImageCache(max_mb=len(stub.png) * 1.5 / 1024 / 1024, disk_dir=tmp_path)
+        bridge = ComfyuiBridge(stub.url)
+        await cache.get(bridge, "stub", "a.png")
+        await cache.get(bridge, "stub", "b.png")
+        data = await cache.get(bridge, "stub", "a.png")
+        return data, cache.stats()
+
+    data, stats = asyncio.run(run())
+    assert data == stub.png
+    assert stub.counts["view"] == 2
+    assert stats["disk_hits"] == 1
+    assert len(list(tmp_path.iterdir())) >= 1
+
+
+def test_variant_is_transcoded_once(stub):
+    async def run():
+        cache = ImageCache()
+        bridge = ComfyuiBridge(stub.url)
+        first = await cache.variant(bridge, "stub", "a.png", max_side=16, format="webp")
+        second = await cache.variant(bridge, "stub", "a.png", max_side=16, format="webp")
+        return first, second, cache.stats()
+
+    first, second, stats = asyncio.run(run())
+    assert first == second
+    image = Image.open(io.BytesIO(first))
+    assert (image.format, max(image.size)) == ("WEBP", 16)
+    assert (stats["variant_misses"], stats["variant_hits"]) == (1, 1)
+    assert stub.counts["view"] == 1
+
+
+def test_failed_fetch_is_logged_and_not_cached(stub, capsys, caplog):
+    stub.failures["view"] = 1
+
+    async def run():
+        cache = ImageCache()
+        # 503 を再試行せずに返す
+        bridge = ComfyuiBridge(stub.url, HttpClient(stub.url, retries=0, backoff=0.0))
+        failed = await cache.get(bridge, "stub", "a.png")
+        return failed, await cache.get(bridge, "stub", "a.png")
+
+    failed, data = asyncio.run(run())
+    assert failed is None
+    assert data == stub.png
+    assert "failed to fetch stub/a.png: 503" in caplog.text
+    assert capsys.readouterr().out == ""
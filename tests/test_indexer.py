@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+from PIL import Image
+
+from fm_mcp_comfyui_bridge.indexer import (
+    Indexer,
+    JsonlIndex,
+    SqliteIndex,
+    open_index,
+    walk_directory,
+)
+
+
+def record(sha256: str, filename: str) -> dict:
+    return {
+        "sha256": sha256,
+        "subfolder": "2026-10-16",
+        "filename": filename,
+        "width": 64,
+        "height": 64,
+        "tags": "1girl",
+        "caption": None,
+        "indexed_at": 0.0,
+    }
+
+
+def test_jsonl_truncates_partial_last_line(tmp_path):
+    path = tmp_path / "index.jsonl"
+    index = JsonlIndex(path)
+    index.add(record("a", "a.png"))
+    index.add(record("b", "b.png"))
+    index.close()
+    complete = path.read_bytes()
+    # 書き込みの途中で止まった行
+    with open(path, "ab") as file:
+        file.write(b'{"sha256": "c", "subfol')
+
+    index = JsonlIndex(path)
+    assert index.hashes == {"a", "b"}
+    assert index.sources == {"2026-10-16/a.png", "2026-10-16/b.png"}
+    assert path.read_bytes() == complete
+    index.add(record("c", "c.png"))
+    index.close()
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["sha256"] for line in lines] == ["a", "b", "c"]
+
+
+def test_jsonl_skips_broken_complete_line(tmp_path):
+    path = tmp_path / "index.jsonl"
+    lines = [
+        json.dumps(record("a", "a.png")),
+        "not json",
+        json.dumps(record("b", "b.png")),
+    ]
+    path.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+    index = JsonlIndex(path)
+    assert index.hashes == {"a", "b"}
+    index.close()
+
+
+def test_sqlite_keeps_records_between_runs(tmp_path):
+    path = tmp_path / "index.sqlite3"
+    index = open_index(str(path))
+    assert isinstance(index, SqliteIndex)
+    index.add(record("a", "a.png"))
+    index.add(record("a", "renamed.png"))
+    index.close()
+
+    index = open_index(str(path))
+    assert index.hashes == {"a"}
+    assert index.sources == {"2026-10-16/renamed.png"}
+    index.close()
+
+
+def write_images(root, count: int):
+    for n in range(count):
+        Image.new("RGB", (8, 8), (n * 40, 0, 0)).save(root / f"{n}.png")
+    # 内容が同じ画像は 1 回だけ記録する
+    Image.new("RGB", (8, 8), (0, 0, 0)).save(root / "copy.png")
+
+
+def index_directory(output, root, limit: int = None) -> Indexer:
+    async def run():
+        index = open_index(str(output))
+        indexer = Indexer(index, tags=False, caption=False, batch_size=2, limit=limit)
+        try:
+            await indexer.run(walk_directory(root))
+        finally:
+            index.close()
+        return indexer
+
+    return asyncio.run(run())
+
+
+def test_interrupted_jsonl_run_resumes(tmp_path):
+    images = tmp_path / "output"
+    images.mkdir()
+    write_images(images, 5)
+    output = tmp_path / "index.jsonl"
+    assert index_directory(output, images, limit=2).stats.indexed == 2
+    # 2 件目のレコードの書き込み中に止まった
+    data = output.read_bytes()
+    output.write_bytes(data[: data.rindex(b"{") + 10])
+    second = index_directory(output, images)
+    # 書きかけの 2 件目はもう一度処理し、0.png と同じ内容の copy.png は飛ばす
+    assert (second.stats.indexed, second.stats.skipped) == (4, 2)
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert len({json.loads(line)["sha256"] for line in lines}) == len(lines) == 5
+
+
+def test_interrupted_sqlite_run_resumes(tmp_path):
+    images = tmp_path / "output"
+    images.mkdir()
+    write_images(images, 5)
+    output = tmp_path / "index.sqlite3"
+    assert index_directory(output, images, limit=2).stats.indexed == 2
+    second = index_directory(output, images)
+    assert (second.stats.indexed, second.stats.skipped) == (3, 3)
+    index = open_index(str(output))
+    assert len(index.hashes) == 5
+    index.close()
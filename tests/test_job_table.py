@@ -0,0 +1,216 @@
+import asyncio
+
+import httpx
+import pytest
+from stub_comfyui import StubComfyui
+from support import wait_until
+from websockets.protocol import State
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.http_client import HttpClient
+from fm_mcp_comfyui_bridge.job_table import (
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_RUNNING,
+    JobTable,
+)
+from fm_mcp_comfyui_bridge.scheduler import ModelAffinityScheduler
+
+OUTPUT_NODE = "9"
+
+
+def job_table(url: str, scheduler: bool = False) -> JobTable:
+    pool = BackendPool([ComfyuiBridge(url)], health_interval=0)
+    return JobTable(
+        pool,
+        free_policy="never",
+        scheduler=ModelAffinityScheduler() if scheduler else None,
+    )
+
+
+def test_submit_and_wait(stub):
+    async def run():
+        jobs = job_table(stub.url)
+        try:
+            job = await jobs.submit({}, OUTPUT_NODE)
+            return await jobs.wait(job)
+        finally:
+            await jobs.pool.close()
+
+    job = asyncio.run(run())
+    assert job.status == JOB_DONE
+    assert job.progress == job.progress_max == 4
+    assert len(job.status_dict()["urls"]) == 1
+
+
+def test_cancel_running_job_interrupts_comfyui(stub):
+    async def run():
+        jobs = job_table(stub.url)
+        try:
+            job = await jobs.submit({}, OUTPUT_NODE)
+            await wait_until(lambda: job.status == JOB_RUNNING)
+            await jobs.cancel(job.job_id)
+            # 中断されたプロンプトは error として history に入る
+            await wait_until(lambda: job.prompt_id in stub.history)
+            return job, jobs.active()
+        finally:
+            await jobs.pool.close()
+
+    job, active = asyncio.run(run())
+    assert job.status == JOB_CANCELLED
+    assert active == []
+    assert stub.counts["interrupt"] == 1
+    assert stub.history[job.prompt_id]["status"]["status_str"] == "error"
+
+
+def test_cancel_pending_job_removes_it_from_queue(stub):
+    async def run():
+        jobs = job_table(stub.url)
+        try:
+            first = await jobs.submit({}, OUTPUT_NODE)
+            second = await jobs.submit({}, OUTPUT_NODE)
+            await jobs.cancel(second.job_id)
+            queued = [prompt_id for prompt_id, _, _ in stub._queue]
+            await jobs.wait(first)
+            return first, second, queued
+        finally:
+            await jobs.pool.close()
+
+    first, second, queued = asyncio.run(run())
+    assert first.status == JOB_DONE
+    assert second.status == JOB_CANCELLED
+    assert queued == []
+    assert stub.counts["interrupt"] == 0
+    assert second.prompt_id not in stub.history
+
+
+def test_websocket_is_closed_when_send_fails(stub):
+    async def run():
+        jobs = job_table(stub.url)
+        bridge = jobs.pool.primary
+        opened = []
+        open_websocket = bridge.open_websocket
+
+        async def record_websocket(client_id):
+            ws = await open_websocket(client_id)
+            opened.append(ws)
+            return ws
+
+        async def failing_send_request(*args, **kwargs):
+            raise httpx.ConnectError("refused")
+
+        bridge.open_websocket = record_websocket
+        bridge.send_request = failing_send_request
+        try:
+            with pytest.raises(httpx.ConnectError):
+                await jobs.submit({}, OUTPUT_NODE)
+            return opened
+        finally:
+            await jobs.pool.close()
+
+    opened = asyncio.run(run())
+    assert len(opened) == 1
+    assert opened[0].state == State.CLOSED
+
+
+def test_cancel_job_waiting_in_scheduler(stub):
+    async def run():
+        jobs = job_table(stub.url, scheduler=True)
+        try:
+            first = await jobs.submit({}, OUTPUT_NODE)
+            second = await jobs.submit({}, OUTPUT_NODE)
+            await jobs.cancel(second.job_id)
+            await jobs.wait(first)
+            return first, second
+        finally:
+            await jobs.pool.close()
+
+    first, second = asyncio.run(run())
+    assert first.status == JOB_DONE
+    assert second.status == JOB_CANCELLED
+    # 2 件目は ComfyUI に送られない
+    assert stub.counts["prompt"] == 1
+
+
+def test_cancel_while_dispatching(stub):
+    async def run():
+        jobs = job_table(stub.url, scheduler=True)
+        bridge = jobs.pool.primary
+        send_request = bridge.send_request
+
+        async def slow_send_request(*args, **kwargs):
+            await asyncio.sleep(0.2)
+            return await send_request(*args, **kwargs)
+
+        bridge.send_request = slow_send_request
+        try:
+            submit = asyncio.create_task(jobs.submit({}, OUTPUT_NODE))
+            await wait_until(lambda: jobs.active())
+            job = jobs.active()[0]
+            # 待ち行列から出て送信している最中に取り消す
+            assert job.backend is None
+            await jobs.cancel(job.job_id)
+            assert job.status == JOB_CANCELLED
+            await submit
+            # 送信されたプロンプトも ComfyUI から取り除かれる
+            await wait_until(lambda: stub._running is None and not stub._queue)
+            return job, jobs.active()
+        finally:
+            await jobs.pool.close()
+
+    job, active = asyncio.run(run())
+    assert job.status == JOB_CANCELLED
+    assert job.error is None
+    assert active == []
+    assert stub.counts["prompt"] == 1
+    # 実行中なら中断、待機中ならキューから削除されていて、生成は完了しない
+    assert all(h["status"]["status_str"] == "error" for h in stub.history.values())
+
+
+def test_failed_idle_free_is_logged(caplog):
+    async def run():
+        with StubComfyui(delay=0.05, steps=1) as stub:
+            pool = BackendPool(
+                [ComfyuiBridge(stub.url, HttpClient(stub.url, retries=0, backoff=0.0))],
+                health_interval=0,
+            )
+            jobs = JobTable(pool, free_policy="idle", free_idle_seconds=0.5)
+            job = await jobs.wait(await jobs.submit({}, OUTPUT_NODE))
+            await wait_until(lambda: jobs._free_timers)
+            (timer,) = jobs._free_timers.values()
+        # 解放する前に ComfyUI が止まった
+        await timer
+        await jobs.close()
+        return job, pool.backends[0]
+
+    loop_errors = []
+    with asyncio.Runner() as runner:
+        runner.get_loop().set_exception_handler(
+            lambda loop, context: loop_errors.append(context)
+        )
+        job, backend = runner.run(run())
+    assert job.status == JOB_DONE
+    assert "Failed to free memory" in caplog.text
+    # 解放できなかったのでモデルは残っている扱いのまま
+    assert backend.warm
+    assert loop_errors == []
+
+
+def test_close_cancels_idle_free(stub):
+    async def run():
+        jobs = JobTable(
+            BackendPool([ComfyuiBridge(stub.url)], health_interval=0),
+            free_policy="idle",
+            free_idle_seconds=60,
+        )
+        await jobs.wait(await jobs.submit({}, OUTPUT_NODE))
+        await wait_until(lambda: jobs._free_timers)
+        timers = list(jobs._free_timers.values())
+        await jobs.close()
+        return timers
+
+    timers = asyncio.run(run())
+    assert len(timers) == 1
+    assert timers[0].cancelled()
+    assert stub.counts["free"] == 0
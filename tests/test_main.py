@@ -0,0 +1,126 @@
+import asyncio
+import importlib
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import yaml
+from bench_concurrency import loop_lag, poll_picture
+from mcp.shared.memory import create_connected_server_and_client_session
+
+from fm_mcp_comfyui_bridge.backend_pool import BackendPool
+from fm_mcp_comfyui_bridge.comfyui_bridge import ComfyuiBridge
+from fm_mcp_comfyui_bridge.job_table import JobTable
+from fm_mcp_comfyui_bridge.lora_yaml import SdLoraYaml
+
+# パッケージの main 関数と名前が重なるので import_module で取得する
+server = importlib.import_module("fm_mcp_comfyui_bridge.main")
+
+SAMPLE_CONFIG = Path(server.__file__).parent / "config" / "sample_config.yaml"
+
+
+@pytest.fixture
+def tools(stub, monkeypatch):
+    # config.yaml はローカルの設定なので、サンプルの設定でスタブに生成させる
+    lora = SdLoraYaml(data=yaml.safe_load(SAMPLE_CONFIG.read_text(encoding="utf-8")))
+    monkeypatch.setattr(server, "get_workflow_config", lambda: (None, lora))
+    monkeypatch.setattr(server, "pool", None)
+    monkeypatch.setattr(server, "jobs", None)
+    return stub
+
+
+async def call_tool(url: str, name: str, arguments: dict) -> tuple[object, list[tuple]]:
+    server.pool = BackendPool([ComfyuiBridge(url)], health_interval=0)
+    server.jobs = JobTable(server.pool, free_policy="never")
+    received = []
+
+    async def on_progress(progress: float, total: float | None, message: str | None):
+        received.append((progress, total, message))
+
+    try:
+        async with create_connected_server_and_client_session(server.mcp) as session:
+            result = await session.call_tool(
+                name=name, arguments=arguments, progress_callback=on_progress
+            )
+    finally:
+        await server.pool.close()
+    return result, received
+
+
+def test_generate_picture_reports_progress(tools):
+    # 進捗の通知は 0.5 秒ごとに間引かれるので、ステップが見えるくらい遅くする
+    tools.delay = 2.0
+    result, received = asyncio.run(
+        call_tool(tools.url, "generate_picture", {"prompt": "1girl"})
+    )
+    assert not result.isError
+    assert result.content[0].text.startswith(f"{tools.url}view?subfolder=stub")
+    progresses = [progress for progress, _, _ in received]
+    assert progresses == sorted(progresses)
+    assert all(total == 1 for _, total, _ in received)
+    assert received[-1] == (1.0, 1, "done")
+    assert any("step" in message for _, _, message in received)
+
+
+def test_generate_pictures_reports_done_count(tools):
+    result, received = asyncio.run(
+        call_tool(tools.url, "generate_pictures", {"prompt": "1girl", "seeds": [1, 2]})
+    )
+    assert not result.isError
+    assert len(result.content) == 2
+    assert all(total == 2 for _, total, _ in received)
+    assert received[-1] == (2.0, 2, "2/2 done, done")
+    assert tools.counts["prompt"] == 2
+
+
+def test_generate_pictures_without_submitted_jobs(tools):
+    # ComfyUI がプロンプトを受け付けなかったら生成は 1 件も投入されない
+    tools.failures["prompt"] = 1
+    result, received = asyncio.run(
+        call_tool(tools.url, "generate_pictures", {"prompt": "1girl", "count": 2})
+    )
+    assert not result.isError
+    assert result.content[0].text == "Generate error."
+    assert received == []
+
+
+@pytest.mark.parametrize("max_side", [0, -64])
+def test_get_picture_rejects_non_positive_max_side(tools, max_side):
+    result, _ = asyncio.run(
+        call_tool(
+            tools.url,
+            "get_picture",
+            {"subfolder": "stub", "filename": "missing.png", "max_side": max_side},
+        )
+    )
+    assert result.isError
+    assert "max_side must be a positive number" in result.content[0].text
+    assert tools.counts["view"] == 0
+
+
+def test_get_picture_answers_while_generating(tools):
+    async def run():
+        server.pool = BackendPool([ComfyuiBridge(tools.url)], health_interval=0)
+        server.jobs = JobTable(server.pool, free_policy="never")
+        try:
+            query = parse_qs(urlparse(await server.generate_picture("1girl")).query)
+            stop = asyncio.Event()
+            lag = asyncio.create_task(loop_lag(stop))
+            poll = asyncio.create_task(
+                poll_picture(stop, query["subfolder"][0], query["filename"][0])
+            )
+            # ComfyUI は 1 件ずつ実行するので、4 件の生成は 0.8 秒かかる
+            results = await asyncio.gather(
+                *(server.generate_picture("1girl") for _ in range(4))
+            )
+            stop.set()
+            return results, await lag, await poll
+        finally:
+            await server.jobs.close()
+
+    results, worst_lag, latencies = asyncio.run(run())
+    assert all(result.startswith(tools.url) for result in results)
+    # get_picture は生成の完了を待たずに返り、イベントループも止まらない
+    assert len(latencies) >= 5
+    assert max(latencies) < tools.delay
+    assert worst_lag < 0.1
@@ -0,0 +1,59 @@
+import asyncio
+import io
+
+from PIL import Image
+from support import wait_until
+
+from fm_mcp_comfyui_bridge.ollama_caption import CaptionSettings, OllamaCaption
+from fm_mcp_comfyui_bridge.result_cache import ResultCache
+
+
+class FakeClient:
+    # Ollama の代わりに、呼ばれたモデル名をキャプションとして返す
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.models = []
+
+    async def show(self, model):
+        return {}
+
+    async def chat(self, model, messages, options=None, keep_alive=None, stream=False):
+        self.models.append(model)
+        await self.release.wait()
+        return {"message": {"content": f"caption by {model}"}}
+
+
+def png_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_waiting_caption_keeps_its_own_settings(tmp_path):
+    data = png_bytes()
+
+    async def run():
+        cache = ResultCache(cache_dir=tmp_path)
+        captioner = OllamaCaption(model_name="model-a", result_cache=cache)
+        captioner.client = FakeClient()
+        first = asyncio.create_task(
+            captioner.caption(data, settings=CaptionSettings("model-a", stream=False))
+        )
+        await wait_until(lambda: captioner.in_flight == 1)
+        # 1 件目の実行中に別の設定で呼ばれた 2 件目は順番を待つ
+        second = asyncio.create_task(
+            captioner.caption(data, settings=CaptionSettings("model-b", stream=False))
+        )
+        await wait_until(lambda: captioner.waiting == 1)
+        captioner.client.release.set()
+        captions = await asyncio.gather(first, second)
+        cached = await captioner.caption(
+            data, settings=CaptionSettings("model-b", stream=False)
+        )
+        cache.close()
+        return captions, cached, captioner.client.models
+
+    captions, cached, models = asyncio.run(run())
+    assert captions == ["caption by model-a", "caption by model-b"]
+    assert models == ["model-a", "model-b"]
+    assert cached == "caption by model-b"
@@ -0,0 +1,56 @@
+import time
+
+from fm_mcp_comfyui_bridge.result_cache import ResultCache
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(cache_dir=tmp_path)
+    key = ResultCache.make_key("tag", b"image", model="m", threshold=0.35)
+    assert cache.get(key) is None
+    cache.put(key, {"tags": ["a", "b"]})
+    assert cache.get(key) == {"tags": ["a", "b"]}
+    assert cache.stats()["entries"] == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_key_depends_on_image_and_params():
+    key = ResultCache.make_key("caption", b"image", model="m", prompt="p")
+    # パラメータの順番はキーに影響しない
+    assert key == ResultCache.make_key("caption", b"image", prompt="p", model="m")
+    assert key != ResultCache.make_key("caption", b"other", model="m", prompt="p")
+    assert key != ResultCache.make_key("caption", b"image", model="n", prompt="p")
+    assert key != ResultCache.make_key("tag", b"image", model="m", prompt="p")
+
+
+def test_expired_result_is_not_used(tmp_path):
+    cache = ResultCache(cache_dir=tmp_path, ttl=0.05)
+    cache.put("key", "caption")
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    cache.close()
+
+
+def test_least_recently_accessed_is_evicted(tmp_path):
+    cache = ResultCache(cache_dir=tmp_path, max_entries=2)
+    cache.put("a", 1)
+    time.sleep(0.01)
+    cache.put("b", 2)
+    time.sleep(0.01)
+    # a を参照したので、3 件目を入れると b が消える
+    assert cache.get("a") == 1
+    time.sleep(0.01)
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    cache.close()
+
+
+def test_results_are_shared_between_processes(tmp_path):
+    # 別のサーバープロセスと同じファイルを共有する
+    writer = ResultCache(cache_dir=tmp_path)
+    reader = ResultCache(cache_dir=tmp_path)
+    writer.put("key", "caption")
+    assert reader.get("key") == "caption"
+    writer.close()
+    reader.close()
@@ -0,0 +1,68 @@
+from fm_mcp_comfyui_bridge.scheduler import ModelAffinityScheduler
+
+MODEL_A = ("workflow", "a.safetensors", None)
+MODEL_B = ("workflow", "b.safetensors", None)
+
+
+def drain(scheduler: ModelAffinityScheduler, model: tuple | None) -> list[str]:
+    # 出したジョブのモデルを次の pop に渡す (バックエンドに最後に投入したモデル)
+    order = []
+    while len(scheduler):
+        job = scheduler.pop(model)
+        model = MODEL_A if job.startswith("a") else MODEL_B
+        order.append(job)
+    return order
+
+
+def test_same_model_goes_first():
+    scheduler = ModelAffinityScheduler()
+    for job, model in (("a1", MODEL_A), ("b1", MODEL_B), ("a2", MODEL_A), ("b2", MODEL_B)):
+        scheduler.push(job, model)
+    assert drain(scheduler, MODEL_B) == ["b1", "b2", "a1", "a2"]
+    assert scheduler.stats()["starved"] == 0
+
+
+def test_oldest_model_when_nothing_matches():
+    scheduler = ModelAffinityScheduler()
+    scheduler.push("b1", MODEL_B)
+    scheduler.push("a1", MODEL_A)
+    assert scheduler.pop(None) == "b1"
+
+
+def test_priority_comes_before_model():
+    scheduler = ModelAffinityScheduler()
+    scheduler.push("a1", MODEL_A)
+    scheduler.push("b1", MODEL_B, priority=1)
+    assert scheduler.pop(MODEL_A) == "b1"
+
+
+def test_job_skipped_max_skips_times_goes_next():
+    scheduler = ModelAffinityScheduler(max_skips=2)
+    scheduler.push("b1", MODEL_B)
+    for i in range(4):
+        scheduler.push(f"a{i}", MODEL_A)
+    # b1 は 2 回追い越されたらモデルに関係なく出る
+    assert [scheduler.pop(MODEL_A) for _ in range(3)] == ["a0", "a1", "b1"]
+    assert scheduler.stats()["starved"] == 1
+
+
+def test_job_waiting_max_wait_goes_next():
+    scheduler = ModelAffinityScheduler(max_wait=0.0)
+    scheduler.push("b1", MODEL_B)
+    scheduler.push("a1", MODEL_A)
+    # どのジョブも待ち時間の上限を超えているので到着順
+    assert scheduler.pop(MODEL_A) == "b1"
+    assert scheduler.stats()["starved"] == 1
+
+
+def test_position_and_remove():
+    scheduler = ModelAffinityScheduler()
+    scheduler.push("a1", MODEL_A)
+    scheduler.push("a2", MODEL_A)
+    scheduler.push("b1", MODEL_B, priority=1)
+    assert scheduler.position("b1") == 0
+    assert scheduler.position("a2") == 2
+    assert scheduler.remove("a1")
+    assert not scheduler.remove("a1")
+    assert scheduler.position("a2") == 1
+    assert scheduler.position("a1") is None
@@ -0,0 +1,176 @@
+import io
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from fm_mcp_comfyui_bridge import tagger as Tagger
+
+
+def write_model(path, size: int = 8, labels: int = 6):
+    # 画素の平均に重みを掛けて sigmoid する、入力 NHWC の小さなタグ付けモデル
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper, numpy_helper
+
+    weights = np.random.RandomState(0).randn(3, labels).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("ReduceMean", ["input", "axes"], ["mean"], keepdims=0),
+            helper.make_node("MatMul", ["mean", "weights"], ["logits"]),
+            helper.make_node("Sigmoid", ["logits"], ["output"]),
+        ],
+        "tagger",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["batch", size, size, 3])],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch", labels])],
+        initializer=[
+            numpy_helper.from_array(weights, "weights"),
+            numpy_helper.from_array(np.array([1, 2], dtype=np.int64), "axes"),
+        ],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 18)])
+    model.ir_version = 9
+    onnx.save(model, path)
+    return str(path)
+
+
+def test_quantize_model_is_cached(tmp_path):
+    model_path = write_model(tmp_path / "model.onnx")
+    cache_dir = tmp_path / "cache"
+    quantized = Path(Tagger.quantize_model(model_path, cache_dir))
+    assert quantized.name.endswith(".int8.onnx")
+    # 2 回目は作り直さずに同じファイルを返す
+    mtime = quantized.stat().st_mtime_ns
+    assert Tagger.quantize_model(model_path, cache_dir) == str(quantized)
+    assert quantized.stat().st_mtime_ns == mtime
+    assert list(cache_dir.iterdir()) == [quantized]
+
+
+def test_failed_quantize_leaves_no_temp_file(tmp_path):
+    pytest.importorskip("onnx")
+    model_path = tmp_path / "model.onnx"
+    model_path.write_bytes(b"not a model")
+    cache_dir = tmp_path / "cache"
+    with pytest.raises(Exception):
+        Tagger.quantize_model(str(model_path), cache_dir)
+    assert list(cache_dir.iterdir()) == []
+
+
+def write_labels(tmp_path) -> str:
+    # general 4 件、character 1 件、rating 2 件のラベル表
+    csv_path = tmp_path / "selected_tags.csv"
+    csv_path.write_text(
+        "tag_id,name,category,count\n"
+        "0,general,9,1\n"
+        "1,explicit,9,1\n"
+        "2,1girl,0,1\n"
+        "3,smile,0,1\n"
+        "4,hat,0,1\n"
+        "5,hatsune_miku,4,1\n"
+        "6,solo_(focus),0,1\n",
+        encoding="utf-8",
+    )
+    return str(csv_path)
+
+
+def labels(tmp_path) -> Tagger.TagLabels:
+    return Tagger.TagLabels.from_csv(write_labels(tmp_path))
+
+
+SCORES = np.array([0.9, 0.1, 0.5, 0.8, 0.5, 0.95, 0.5], dtype=np.float32)
+
+
+def test_result_sorts_by_score_then_label_order(tmp_path):
+    result = labels(tmp_path).result(SCORES, general_threshold=0.35)
+    assert list(result.general) == ["smile", "1girl", "hat", "solo_(focus)"]
+    assert list(result.character) == ["hatsune_miku"]
+    # rating は閾値なしで全件
+    assert list(result.rating) == ["general", "explicit"]
+    assert result.general_string() == "smile, 1girl, hat, solo_\\(focus\\)"
+
+
+def test_top_k_breaks_ties_by_label_order(tmp_path):
+    tag_labels = labels(tmp_path)
+    # 0.5 の 3 件のうち、ラベル表で先の 1girl と hat を選ぶ
+    result = tag_labels.result(SCORES, general_threshold=0.35, top_k=3)
+    assert list(result.general) == ["smile", "1girl", "hat"]
+    assert list(tag_labels.result(SCORES, top_k=10).general) == [
+        "smile",
+        "1girl",
+        "hat",
+        "solo_(focus)",
+    ]
+    # top_k は general だけを絞る
+    assert list(result.character) == ["hatsune_miku"]
+
+
+def test_top_k_zero_and_negative(tmp_path):
+    tag_labels = labels(tmp_path)
+    assert tag_labels.result(SCORES, top_k=0).general == {}
+    with pytest.raises(ValueError):
+        tag_labels.result(SCORES, top_k=-1)
+
+
+def test_threshold_is_exclusive(tmp_path):
+    result = labels(tmp_path).result(SCORES, general_threshold=0.5)
+    assert list(result.general) == ["smile"]
+
+
+@pytest.fixture
+def tagger(tmp_path, monkeypatch):
+    # ダウンロードの代わりに小さなモデルとラベル表を使う
+    files = {
+        Tagger.LABEL_FILENAME: write_labels(tmp_path),
+        Tagger.MODEL_FILENAME: write_model(tmp_path / "model.onnx", labels=7),
+    }
+    monkeypatch.setattr(
+        Tagger.huggingface_hub,
+        "hf_hub_download",
+        lambda repo, filename, **kwargs: files[filename],
+    )
+    config = Tagger.SessionConfig(cache_dir=str(tmp_path / "onnx"))
+    return Tagger.WD14Tagger("test/tagger", session_config=config)
+
+
+def png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_preprocess_pads_to_square_in_bgr(tagger):
+    assert tagger.input_shape == (8, 8, 3)
+    out = tagger.preprocess(Image.new("RGB", (16, 8), (255, 0, 0)))
+    # 16x8 は 8x4 に縮小して上下を白で埋める
+    assert (out[:2] == 255.0).all() and (out[6:] == 255.0).all()
+    assert (out[2:6] == [0.0, 0.0, 255.0]).all()
+
+
+def test_preprocess_composites_alpha_on_white(tagger):
+    out = tagger.preprocess(Image.new("RGBA", (8, 8), (0, 0, 255, 0)))
+    assert (out == 255.0).all()
+    out = tagger.preprocess(Image.new("RGBA", (8, 8), (0, 0, 255, 255)))
+    assert (out == [255.0, 0.0, 0.0]).all()
+    # パレット画像の透過も白にする
+    image = Image.new("P", (8, 8), 0)
+    image.info["transparency"] = 0
+    assert (tagger.preprocess(image) == 255.0).all()
+
+
+def test_prepare_image_accepts_bytes_and_decoded_images(tagger):
+    image = Image.new("RGB", (32, 24), (10, 200, 30))
+    from_bytes = tagger.prepare_image(png(image))
+    assert from_bytes.shape == (1, 8, 8, 3)
+    np.testing.assert_array_equal(from_bytes, tagger.prepare_image(image))
+
+
+def test_tag_many_matches_single_images(tagger, caplog):
+    colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255), (0, 0, 0)]
+    sources = [png(Image.new("RGB", (12, 12), color)) for color in colors]
+    sources.insert(2, b"not an image")
+    expected = [tagger.image_tag(source) for source in sources if source[1:4] == b"PNG"]
+    # 2 枚ずつのバッチで、読み込めなかった画像は None になる
+    results = tagger.tag_many(sources, max_batch_size=2, workers=2)
+    assert results[2] is None
+    assert results[:2] + results[3:] == expected
+    assert "failed to load image" in caplog.text
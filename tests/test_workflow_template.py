@@ -0,0 +1,85 @@
+import json
+import os
+import sys
+
+import pytest
+
+from fm_mcp_comfyui_bridge import workflow_template
+from fm_mcp_comfyui_bridge.comfyui_bridge import (
+    COMFYUI_WORKFLOW_DEFAULT,
+    COMFYUI_WORKFLOW_PATHS,
+)
+from fm_mcp_comfyui_bridge.workflow_template import WorkflowTemplate, get_template
+
+GRAPH = {
+    "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "", "clip": ["4", 1]}},
+    "3": {"class_type": "KSampler", "inputs": {"seed": 0, "steps": 20}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "ComfyUI"}},
+}
+PATHS = {"prompt": "6:inputs:text", "seed": ("3", "inputs", "seed")}
+
+
+@pytest.fixture
+def workflows(tmp_path, monkeypatch):
+    # workflow を置くパッケージを tmp_path に作る
+    package = tmp_path / "test_workflows"
+    package.mkdir()
+    (package / "__init__.py").write_text("")
+    (package / "test.json").write_text(json.dumps(GRAPH), encoding="utf-8")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    # 前のテストで import したパッケージは別の tmp_path を指している
+    monkeypatch.delitem(sys.modules, "test_workflows", raising=False)
+    monkeypatch.setattr(workflow_template, "WORKFLOW_PACKAGE", "test_workflows")
+    monkeypatch.setattr(workflow_template, "_templates", {})
+    return package
+
+
+def test_build_copies_only_injected_nodes(workflows):
+    template = WorkflowTemplate("test.json", PATHS)
+    workflow = template.build({"prompt": "1girl", "seed": 42})
+    assert workflow["6"]["inputs"] == {"text": "1girl", "clip": ["4", 1]}
+    assert workflow["3"]["inputs"]["seed"] == 42
+    # テンプレートは書き換えず、埋め込まないノードは共有する
+    assert template.graph == GRAPH
+    assert workflow["9"] is template.graph["9"]
+    assert template.build({"prompt": "cat"})["3"]["inputs"]["seed"] == 0
+    assert template.node_id("seed") == "3"
+
+
+def test_missing_path_names_the_parameter(workflows):
+    with pytest.raises(ValueError, match="seed.*3:inputs:noise_seed"):
+        WorkflowTemplate("test.json", {**PATHS, "seed": "3:inputs:noise_seed"})
+    with pytest.raises(ValueError, match="prompt"):
+        WorkflowTemplate("test.json", {"prompt": "7:inputs:text"})
+
+
+def test_changed_file_is_reloaded(workflows):
+    template = WorkflowTemplate("test.json", PATHS)
+    path = workflows / "test.json"
+    graph = json.loads(json.dumps(GRAPH))
+    graph["3"]["inputs"]["steps"] = 30
+    path.write_text(json.dumps(graph), encoding="utf-8")
+    # 更新時刻が同じ秒でも確実に変わるようにする
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert template.build({"prompt": "1girl"})["3"]["inputs"]["steps"] == 30
+    # 埋め込み先が消えた workflow は読み込まず、エラーにする
+    del graph["6"]
+    path.write_text(json.dumps(graph), encoding="utf-8")
+    with pytest.raises(ValueError):
+        template.build({"prompt": "1girl"})
+
+
+def test_get_template_is_shared(workflows):
+    template = get_template("test.json", PATHS)
+    # 同じ埋め込み先は書き方が違っても同じテンプレート
+    same = get_template("test.json", {"seed": "3:inputs:seed", "prompt": "6:inputs:text"})
+    assert same is template
+    assert get_template("test.json", {"prompt": "6:inputs:text"}) is not template
+
+
+def test_default_workflow_has_all_paths():
+    template = WorkflowTemplate(COMFYUI_WORKFLOW_DEFAULT, COMFYUI_WORKFLOW_PATHS)
+    workflow = template.build({"prompt": "1girl", "width": 832, "height": 1216})
+    assert workflow[template.node_id("prompt")]["inputs"]["text"] == "1girl"
+    assert workflow[template.node_id("width")]["inputs"]["height"] == 1216